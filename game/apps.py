@@ -1,46 +1,21 @@
-from django.apps import AppConfig
-
-
-from django.apps import AppConfig
+# game/apps.py
 import os
+import sys
+from django.apps import AppConfig
 
 class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
 
+    # Startup must not touch the network: default images come from `manage.py bootstrap_assets`
+    # or are generated in the background on first use (game/default_assets.py)
     def ready(self):
-        # On server start in DEBUG, clear generated images except specified defaults, and auto-generate defaults if missing
+        from . import checks  # registers the system checks
         from django.conf import settings
-        from .utils import generate_and_save_image
-        import os
-        if settings.DEBUG:
-            img_dir = os.path.join(settings.BASE_DIR, 'static', 'images')
-            if os.path.isdir(img_dir):
-                # Define default images and their prompts
-                defaults = {
-                    'default_detective_office.png': "16-bit pixel art of a 1940s detective office: wooden desk with typewriter, dim lamp, files strewn, venetian blinds casting shadows, noir atmosphere, limited grayscale palette, hard edges, chiaroscuro",
-                    'default_newsroom.png': "16-bit pixel art of a 1940s newspaper newsroom: rows of desks with typewriters, journalists at work, overhead lamps, bulletin boards with headlines, sepia-toned noir style, limited palette, hard edges"
-                }
-                # Remove non-default generated images
-                keep = set(defaults.keys()) | {'placeholder_bg.png'}
-                for fname in os.listdir(img_dir):
-                    if fname not in keep:
-                        file_path = os.path.join(img_dir, fname)
-                        try:
-                            if os.path.isfile(file_path):
-                                os.remove(file_path)
-                        except Exception:
-                            pass
-                # Generate default images if missing
-                for fname, prompt in defaults.items():
-                    path = os.path.join(img_dir, fname)
-                    if not os.path.isfile(path):
-                        # Attempt generation; smaller size for speed
-                        try:
-                            # Use 512x512 generation and resize to 800x600
-                            success, err = generate_and_save_image(prompt, fname, is_background=True)
-                            if not success:
-                                # Could log error
-                                pass
-                        except Exception:
-                            pass
+        if not settings.ASSET_BOOTSTRAP_ON_STARTUP:
+            return
+        # The runserver autoreloader parent only watches files; bootstrap in the serving child
+        if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
+        from .default_assets import schedule_bootstrap
+        schedule_bootstrap()
@@ -0,0 +1,199 @@
+# game/assets.py
+# Shared, content-addressed store for generated backgrounds and sprites.
+# Assets are keyed by a hash of their normalized description, reference-counted per game,
+# and garbage collected least-recently-used first once ASSET_STORE_MAX_BYTES is exceeded
+# (only assets no game references any more).
+import hashlib
+import os
+import re
+import threading
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+from . import imaging, metrics, state_cache
+from .models import Asset, AssetRef, SceneCache
+from .similarity import scene_index
+
+# Hex digits of the content hash used in asset URLs
+HASH_URL_CHARS = 16
+
+def images_dir():
+    return os.path.join(settings.BASE_DIR, 'static', 'images')
+
+def normalize(text):
+    text = re.sub(r"[^a-z0-9\s]", ' ', (text or '').lower())
+    return ' '.join(text.split())
+
+def asset_key(kind, *parts):
+    raw = '|'.join([kind] + [normalize(str(p)) for p in parts])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def background_key(level_number, scene_description):
+    return asset_key(Asset.KIND_BACKGROUND, level_number, scene_description)
+
+def sprite_key(character_name, character_description):
+    return asset_key(Asset.KIND_SPRITE, character_name, character_description)
+
+# File name under static/images for a key, so evicting one asset never touches another's file
+def asset_image_name(kind, key):
+    prefix = {Asset.KIND_BACKGROUND: 'bg', Asset.KIND_ATLAS: 'atlas'}.get(kind, 'sprite')
+    return f"{prefix}_{key[:16]}.png"
+
+# image_name -> (mtime_ns, size, sha256 hex) so hashing happens once per file version
+_hashes = {}
+_hash_lock = threading.Lock()
+
+def file_hash(image_name):
+    path = os.path.join(images_dir(), image_name)
+    st = os.stat(path)
+    with _hash_lock:
+        cached = _hashes.get(image_name)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _hash_lock:
+        _hashes[image_name] = (st.st_mtime_ns, st.st_size, value)
+    return value
+
+# Content-addressed URL served by AssetFileView with immutable caching; falls back to the
+# plain static URL when the file is not there (yet)
+def asset_url(image_name, content_hash=None):
+    if content_hash is None:
+        try:
+            content_hash = file_hash(image_name)
+        except OSError:
+            return f'/static/images/{image_name}'
+    return f'/assets/{content_hash[:HASH_URL_CHARS]}/{image_name}'
+
+def asset_payload(asset):
+    variants = [
+        dict(variant, url=asset_url(variant['image_name'], variant.get('hash'))) for variant in asset.variants
+    ]
+    primary = next((v for v in variants if v['image_name'] == asset.image_name), None)
+    return {
+        'prompt': asset.prompt,
+        'image_name': asset.image_name,
+        'url': primary['url'] if primary else asset_url(asset.image_name),
+        # Smaller/WebP renditions; clients pick the smallest one that fits
+        'variants': variants,
+    }
+
+# Return the stored asset for key (and record a reference from game), or None on a miss
+def lookup(key, game=None):
+    asset = Asset.objects.filter(key=key).first()
+    if asset is not None and not os.path.isfile(os.path.join(images_dir(), asset.image_name)):
+        # File was removed behind our back (manual deletion, or a concurrent collect_garbage)
+        scene_index.remove(asset.key)
+        asset.delete()
+        asset = None
+    if asset is None:
+        metrics.incr('asset_store_misses')
+        return None
+    Asset.objects.filter(pk=asset.pk).update(last_used_at=timezone.now())
+    if game is not None:
+        AssetRef.objects.get_or_create(asset=asset, game=game)
+    metrics.incr('asset_store_hits')
+    return asset
+
+# Register a freshly generated image file, then enforce the disk budget
+def store(key, kind, description, prompt, image_name, game=None):
+    variants = imaging.existing_variants(image_name, images_dir())
+    for variant in variants:
+        variant['hash'] = file_hash(variant['image_name'])
+    size = sum(variant['bytes'] for variant in variants)
+    asset, _ = Asset.objects.update_or_create(
+        key=key,
+        defaults={
+            'kind': kind,
+            'description': description or '',
+            'prompt': prompt,
+            'image_name': image_name,
+            'variants': variants,
+            'size_bytes': size,
+            'last_used_at': timezone.now(),
+        }
+    )
+    if game is not None:
+        AssetRef.objects.get_or_create(asset=asset, game=game)
+    if kind == Asset.KIND_BACKGROUND:
+        scene_index.add(key, description)
+    collect_garbage(keep=asset)
+    return asset
+
+# Reuse the background of the most similar stored scene if it passes SCENE_MATCH_THRESHOLD
+def lookup_similar_background(scene_description, game=None):
+    key, score = scene_index.best_match(scene_description)
+    asset = None
+    if key is not None and score >= settings.SCENE_MATCH_THRESHOLD:
+        asset = lookup(key, game)
+        if asset is None:
+            # Evicted, possibly by another process
+            scene_index.remove(key)
+    metrics.incr('scene_match_hits' if asset is not None else 'scene_match_misses')
+    return asset
+
+# Drop every reference held by a finished game
+def release(game):
+    AssetRef.objects.filter(game=game).delete()
+
+def total_bytes():
+    return Asset.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+
+# Per-game scene cache entries still pointing at an evicted asset's file (games that ended
+# keep their SceneCache rows)
+def _forget_scenes(asset):
+    rows = SceneCache.objects.filter(payload__image_name=asset.image_name)
+    stale = list(rows.values_list('game_id', 'scene_key'))
+    if stale:
+        rows.delete()
+        state_cache.drop_scenes(stale)
+
+# Evict least-recently-used unreferenced assets until the store fits ASSET_STORE_MAX_BYTES.
+# Assets a game still references are never evicted, so the budget is exceeded rather than
+# breaking images of games in progress.
+def collect_garbage(keep=None):
+    budget = settings.ASSET_STORE_MAX_BYTES
+    total = total_bytes()
+    if total <= budget:
+        return 0
+    evicted = 0
+    for asset in list(Asset.objects.filter(refs__isnull=True).order_by('last_used_at')):
+        if total <= budget:
+            break
+        if keep is not None and asset.pk == keep.pk:
+            continue
+        imaging.remove_variants(asset.variants or [{'image_name': asset.image_name}], images_dir())
+        total -= asset.size_bytes
+        scene_index.remove(asset.key)
+        _forget_scenes(asset)
+        asset.delete()
+        evicted += 1
+        metrics.incr('asset_store_evictions')
+    if total > budget:
+        metrics.incr('asset_store_over_budget')
+    return evicted
+
+def stats():
+    return {
+        'assets': Asset.objects.count(),
+        'bytes': total_bytes(),
+        'max_bytes': settings.ASSET_STORE_MAX_BYTES,
+        'hits': metrics.get('asset_store_hits'),
+        'misses': metrics.get('asset_store_misses'),
+        'evictions': metrics.get('asset_store_evictions'),
+        'over_budget': metrics.get('asset_store_over_budget'),
+    }
+
+def scene_match_stats():
+    hits = metrics.get('scene_match_hits')
+    misses = metrics.get('scene_match_misses')
+    return {
+        'threshold': settings.SCENE_MATCH_THRESHOLD,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+    }
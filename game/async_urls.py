@@ -0,0 +1,14 @@
+# game/async_urls.py
+from django.urls import path
+from .async_views import (
+    AsyncNewGameView, AsyncNextLevelView, AsyncHeadlineView, AsyncLevelTransitionView, AsyncGenerateBackgroundView, AsyncGenerateSpriteView
+)
+
+urlpatterns = [
+    path('new_game/', AsyncNewGameView.as_view(), name='async_new_game'),
+    path('next_level/', AsyncNextLevelView.as_view(), name='async_next_level'),
+    path('headline/', AsyncHeadlineView.as_view(), name='async_headline'),
+    path('level_transition/', AsyncLevelTransitionView.as_view(), name='async_level_transition'),
+    path('generate_background/', AsyncGenerateBackgroundView.as_view(), name='async_generate_background'),
+    path('generate_sprite/', AsyncGenerateSpriteView.as_view(), name='async_generate_sprite'),
+]
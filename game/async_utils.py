@@ -0,0 +1,106 @@
+# game/async_utils.py
+# Async counterparts of the helpers in game/utils.py, for the ASGI views in game/async_views.py
+import asyncio
+import logging
+import weakref
+from django.conf import settings
+from . import metrics
+from .clients import get_async_openai_client, awith_retries
+from .story import record_prompt_tokens
+from .schemas import OUTLINE_SCHEMA, LEVEL_SCHEMA, IMAGE_PROMPT_SCHEMA
+from .utils import (
+    chat_kwargs, structured_format, is_unsupported_format_error, disable_structured_output,
+    build_outline_messages, parse_outline,
+    build_level_messages, parse_level_content,
+    build_headline_messages, parse_headline,
+    build_background_prompt_messages, parse_background_prompt,
+    build_sprite_prompt_messages, parse_sprite_prompt,
+    image_sizes, save_generated_image,
+)
+
+logger = logging.getLogger(__name__)
+
+# One semaphore per event loop caps in-flight upstream requests (chat + image)
+_semaphores = weakref.WeakKeyDictionary()
+
+def upstream_slot():
+    loop = asyncio.get_running_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = _semaphores[loop] = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+    return sem
+
+async def acall_openai_chat(messages, max_tokens=1000, temperature=0.7, response_format=None, purpose='chat', level_number=None):
+    create = get_async_openai_client().chat.completions.create
+    async with upstream_slot():
+        try:
+            with metrics.timed('llm_chat'):
+                try:
+                    response = await awith_retries(create, **chat_kwargs(messages, max_tokens, temperature, response_format))
+                except Exception as e:
+                    if not is_unsupported_format_error(e, response_format):
+                        raise
+                    disable_structured_output()
+                    response = await awith_retries(create, **chat_kwargs(messages, max_tokens, temperature, None))
+        except Exception as e:
+            metrics.record_error('llm_chat', e)
+            raise
+    record_prompt_tokens(purpose, messages, level_number, getattr(response, 'usage', None))
+    return response.choices[0].message.content
+
+async def agenerate_story_outline():
+    content = await acall_openai_chat(
+        build_outline_messages(), max_tokens=1000, response_format=structured_format('outline', OUTLINE_SCHEMA),
+        purpose='outline'
+    )
+    return parse_outline(content)
+
+async def agenerate_level_content(outline, story_digest, level_number):
+    messages, role = build_level_messages(outline, story_digest, level_number)
+    content = await acall_openai_chat(
+        messages, max_tokens=2000, response_format=structured_format('level', LEVEL_SCHEMA),
+        purpose='level', level_number=level_number
+    )
+    return parse_level_content(content, level_number, role)
+
+async def agenerate_headline(outline, story_digest, level_number):
+    content = await acall_openai_chat(
+        build_headline_messages(outline, story_digest, level_number), max_tokens=100,
+        purpose='headline', level_number=level_number
+    )
+    return parse_headline(content)
+
+async def agenerate_dynamic_background_prompt(level_number, level_summary, node_context=None):
+    messages = build_background_prompt_messages(level_number, level_summary, node_context)
+    content = await acall_openai_chat(
+        messages, max_tokens=200, response_format=structured_format('image_prompt', IMAGE_PROMPT_SCHEMA),
+        purpose='background_prompt'
+    )
+    return parse_background_prompt(content, level_number, level_summary, node_context)
+
+async def agenerate_dynamic_sprite_prompt(character_name, character_description):
+    messages = build_sprite_prompt_messages(character_name, character_description)
+    content = await acall_openai_chat(
+        messages, max_tokens=200, response_format=structured_format('image_prompt', IMAGE_PROMPT_SCHEMA),
+        purpose='sprite_prompt'
+    )
+    return parse_sprite_prompt(content, character_name, character_description)
+
+async def agenerate_and_save_image(prompt, image_name, is_background=True):
+    gen_size, final_size = image_sizes(is_background)
+    stage = 'image_generate'
+    try:
+        async with upstream_slot():
+            with metrics.timed(stage):
+                response = await awith_retries(
+                    get_async_openai_client().images.generate, prompt=prompt, n=1, size=gen_size,
+                    response_format='b64_json'
+                )
+            stage = 'image_process'
+            # Decoding + quantizing are blocking; keep them off the event loop
+            await asyncio.to_thread(save_generated_image, response.data[0], image_name, final_size, is_background)
+        return True, None
+    except Exception as e:
+        error = metrics.record_error(stage, e)
+        logger.warning("Image %s failed at %s: %s: %s", image_name, stage, error, e)
+        return False, f"{error}: {e}"
@@ -0,0 +1,255 @@
+# game/async_views.py
+# Async versions of the endpoints in game/views.py, for deployment behind noirgame/asgi.py.
+# Each request awaits the OpenAI round trip instead of holding a worker thread.
+import asyncio
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from .models import Game, LevelData, Asset
+from . import assets, pipeline, singleflight, state_cache, warm_pool
+from .jobs import (
+    cache_background, cached_background, placeholder_background, enqueue_background, pregenerate_level_backgrounds,
+    sprite_atlas_for
+)
+from .level_format import level_for_response
+from .level_graph import compile_level
+from .prefetch import schedule_prefetch, claim_prefetched
+from .renderers import MEDIA_TYPE, accepts_msgpack, is_msgpack, packb, unpackb
+from .story import digest_with_level, load_story_digest
+from .views import (
+    GAME_COMPLETED, begin_level_change, choices_request_error, failure, level_summary_for, state_scene,
+    store_next_level
+)
+from .async_utils import (
+    agenerate_story_outline, agenerate_level_content, agenerate_headline,
+    agenerate_dynamic_sprite_prompt, agenerate_and_save_image
+)
+
+def _request_data(request):
+    if is_msgpack(request):
+        try:
+            return unpackb(request.body)
+        except Exception:
+            return {}
+    try:
+        return json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return {}
+
+# Level payloads in the negotiated encoding: MessagePack if accepted, else JSON
+def _level_response(request, data, payload):
+    if 'level' in payload:
+        payload['level'] = level_for_response(payload['level'], request.GET, data)
+    if accepts_msgpack(request):
+        return HttpResponse(packb(payload), content_type=MEDIA_TYPE)
+    return JsonResponse(payload)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncNewGameView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        warm = await sync_to_async(warm_pool.claim)()
+        if warm is not None:
+            outline, level_content = warm
+            started = time.monotonic()
+            game = await Game.objects.acreate(outline=outline, current_level=1)
+            sprite_atlas = await sync_to_async(sprite_atlas_for)(game)
+        else:
+            try:
+                outline = await agenerate_story_outline()
+            except Exception as e:
+                return JsonResponse({'error': failure('outline', 'Failed to generate story outline', e)}, status=500)
+            started = time.monotonic()
+            game = await Game.objects.acreate(outline=outline, current_level=1)
+            # The atlas renders on the job pool while level 1 is generated
+            sprite_atlas = await sync_to_async(sprite_atlas_for)(game)
+            try:
+                level_content = await agenerate_level_content(outline, [], 1)
+            except Exception as e:
+                return JsonResponse({'error': failure('level', 'Failed generate level1', e)}, status=500)
+        graph = compile_level(level_content)
+        await LevelData.objects.acreate(
+            game=game,
+            level_number=1,
+            role=level_content.get('role', 'detective'),
+            content=level_content,
+            graph=graph
+        )
+        await sync_to_async(state_cache.store_game)(game, level_content, graph)
+        level_summary = level_summary_for(outline, 1)
+        await sync_to_async(pregenerate_level_backgrounds)(game, level_content, level_summary, graph)
+        await sync_to_async(schedule_prefetch)(game, level_content, 1, graph)
+        # Blocks until the first screen's deadlines; keep it off the shared sync thread
+        start_background, sprite_atlas, asset_status = await sync_to_async(pipeline.first_screen, thread_sensitive=False)(
+            game, level_content, graph, level_summary, sprite_atlas, started
+        )
+        return _level_response(request, data, {
+            'game_id': str(game.pk),
+            'level': level_content,
+            'graph': graph,
+            'level_summary': level_summary,
+            'sprite_atlas': sprite_atlas,
+            'start_background': start_background,
+            'assets': asset_status
+        })
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncNextLevelView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        game, next_level, error = await sync_to_async(begin_level_change)(data)
+        if error is not None:
+            return JsonResponse(error, status=400)
+        if next_level is None:
+            return JsonResponse(GAME_COMPLETED)
+        # May wait on an in-flight prefetch; run it outside the shared sync thread
+        level_content = await sync_to_async(claim_prefetched, thread_sensitive=False)(
+            game, next_level, data['choices_path']
+        )
+        if level_content is None:
+            try:
+                story_digest = await sync_to_async(load_story_digest)(game)
+                level_content = await agenerate_level_content(game.outline, story_digest, next_level)
+            except Exception as e:
+                return JsonResponse({'error': failure('level', f'Failed generate level{next_level}', e)}, status=500)
+        level_summary, graph = await sync_to_async(store_next_level)(game, next_level, level_content)
+        return _level_response(request, data, {'level': level_content, 'graph': graph, 'level_summary': level_summary})
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncHeadlineView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        error = choices_request_error(data)
+        if error is not None:
+            return JsonResponse(error, status=400)
+        choices_path = data['choices_path']
+        state = await sync_to_async(state_cache.get_state)(data['game_id'])
+        if state is None:
+            return JsonResponse({'error': 'Invalid game_id'}, status=400)
+        story_digest = digest_with_level(
+            state['story_digest'], state['current_level'], choices_path, state['level_content']
+        )
+        try:
+            headline = await agenerate_headline(state['outline'], story_digest, state['current_level'])
+        except Exception as e:
+            return JsonResponse({'error': failure('headline', 'Failed generate headline', e)}, status=500)
+        return JsonResponse({'headline': headline})
+
+async def _headline_or_error(outline, story_digest, level_number):
+    try:
+        return {'headline': await agenerate_headline(outline, story_digest, level_number)}
+    except Exception as e:
+        return {'error': failure('headline', 'Failed generate headline', e)}
+
+async def _claim_or_generate(game, story_digest, next_level, choices_path):
+    level_content = await sync_to_async(claim_prefetched, thread_sensitive=False)(game, next_level, choices_path)
+    if level_content is None:
+        level_content = await agenerate_level_content(game.outline, story_digest, next_level)
+    return level_content
+
+# Same contract as the fused /api/level_transition/, returned as one JSON body:
+# {'headline', 'level', 'level_summary'}; both completions are awaited concurrently
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLevelTransitionView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        game, next_level, error = await sync_to_async(begin_level_change)(data)
+        if error is not None:
+            return JsonResponse(error, status=400)
+        story_digest = await sync_to_async(load_story_digest)(game)
+        tasks = []
+        if data.get('headline', True):
+            tasks.append(_headline_or_error(game.outline, story_digest, game.current_level))
+        if next_level is None:
+            payload = dict(GAME_COMPLETED)
+            for result in await asyncio.gather(*tasks):
+                payload.update(result)
+            return JsonResponse(payload)
+        tasks.append(_claim_or_generate(game, story_digest, next_level, data['choices_path']))
+        *headline, level_content = await asyncio.gather(*tasks, return_exceptions=True)
+        if isinstance(level_content, Exception):
+            return JsonResponse(
+                {'error': failure('level', f'Failed generate level{next_level}', level_content)}, status=500
+            )
+        level_summary, graph = await sync_to_async(store_next_level)(game, next_level, level_content)
+        payload = {'level': level_content, 'graph': graph, 'level_summary': level_summary}
+        for result in headline:
+            payload.update(result)
+        return _level_response(request, data, payload)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGenerateBackgroundView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        game_id = data.get('game_id')
+        level_number = data.get('level_number')
+        scene_description = data.get('scene_description')
+        node_id = data.get('node_id')
+        level_summary = data.get('level_summary')
+        if not game_id or level_number is None or level_summary is None:
+            return JsonResponse({'error': 'game_id, level_number and level_summary required'}, status=400)
+        state = await sync_to_async(state_cache.get_state)(game_id)
+        if state is None:
+            return JsonResponse({'error': 'Invalid game_id'}, status=400)
+        game = state_cache.game_from_state(state)
+        if not scene_description and node_id is not None:
+            scene_description = state_scene(state, level_number, node_id)
+
+        cache_entry = await sync_to_async(cached_background)(game, level_number, scene_description)
+        if cache_entry:
+            return JsonResponse(cache_entry)
+
+        asset_key = assets.background_key(level_number, scene_description)
+        asset = await sync_to_async(assets.lookup)(asset_key, game)
+        if asset is None:
+            asset = await sync_to_async(assets.lookup_similar_background)(scene_description, game)
+        if asset is not None:
+            # Reads and hashes the asset's files
+            response_payload = await sync_to_async(assets.asset_payload, thread_sensitive=False)(asset)
+            await sync_to_async(cache_background)(game, level_number, scene_description, response_payload)
+            return JsonResponse(response_payload)
+
+        job = await sync_to_async(enqueue_background)(game, level_number, level_summary, scene_description)
+        # Renders and writes the local stand-in image; keep it off the event loop
+        response_payload = await sync_to_async(placeholder_background, thread_sensitive=False)(
+            level_number, scene_description
+        )
+        response_payload.update({'job_id': str(job.pk), 'status': job.status})
+        return JsonResponse(response_payload)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGenerateSpriteView(View):
+    async def post(self, request):
+        data = _request_data(request)
+        character_name = data.get('character_name')
+        character_description = data.get('character_description')
+        if not character_name or not character_description:
+            return JsonResponse({'error': 'character_name and character_description required'}, status=400)
+        asset_key = assets.sprite_key(character_name, character_description)
+        asset = await sync_to_async(assets.lookup)(asset_key)
+        if asset is not None:
+            return JsonResponse(await sync_to_async(assets.asset_payload, thread_sensitive=False)(asset))
+
+        async def produce():
+            sp = await agenerate_dynamic_sprite_prompt(character_name, character_description)
+            prompt = sp.get('prompt')
+            image_name = assets.asset_image_name(Asset.KIND_SPRITE, asset_key)
+            success, err = await agenerate_and_save_image(prompt, image_name, is_background=False)
+            if not success:
+                raise RuntimeError('Sprite gen failed: ' + err)
+            return await sync_to_async(assets.store)(
+                asset_key, Asset.KIND_SPRITE, f"{character_name}: {character_description}", prompt, image_name
+            )
+
+        async def lookup():
+            return await sync_to_async(assets.lookup)(asset_key)
+
+        try:
+            asset = await singleflight.arun(asset_key, produce, lookup)
+            return JsonResponse(await sync_to_async(assets.asset_payload, thread_sensitive=False)(asset))
+        except Exception as e:
+            return JsonResponse({'error': failure('sprite', 'Sprite prompt/gen failed', e)}, status=500)
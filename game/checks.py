@@ -0,0 +1,21 @@
+# game/checks.py
+from django.conf import settings
+from django.core import checks
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Deployments run several workers; their game state versions must live in one shared cache
+@checks.register(checks.Tags.caches, deploy=True)
+def check_game_state_cache(app_configs, **kwargs):
+    backend = settings.CACHES[settings.GAME_STATE_CACHE_ALIAS]['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Warning(
+        f"GAME_STATE_CACHE_ALIAS uses the process-local {backend.rsplit('.', 1)[-1]}.",
+        hint="With several workers, set CACHE_BACKEND/CACHE_LOCATION to a shared cache (Redis, "
+             "Memcached) so every worker sees a game's current level.",
+        id='game.W001',
+    )]
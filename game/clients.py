@@ -0,0 +1,131 @@
+# game/clients.py
+# Shared upstream clients: one pooled keep-alive OpenAI client (sync and async) and one pooled
+# requests session, with per-call timeouts and exponential backoff that honors Retry-After.
+# openai/requests are imported on first use so that app startup stays fast.
+import asyncio
+import random
+import threading
+import time
+from django.conf import settings
+from . import metrics
+
+_lock = threading.Lock()
+_client = None
+_async_client = None
+_session = None
+
+def _client_kwargs():
+    return {
+        'api_key': settings.OPENAI_API_KEY,
+        'base_url': settings.OPENAI_BASE_URL or None,
+        'timeout': settings.OPENAI_TIMEOUT,
+        # Retries are handled by with_retries/awith_retries below
+        'max_retries': 0,
+    }
+
+def get_openai_client():
+    global _client
+    with _lock:
+        if _client is None:
+            import openai  # pylint: disable=no-member
+            _client = openai.OpenAI(**_client_kwargs())
+        return _client
+
+def get_async_openai_client():
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            import openai  # pylint: disable=no-member
+            _async_client = openai.AsyncOpenAI(**_client_kwargs())
+        return _async_client
+
+def get_http_session():
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(
+                total=settings.HTTP_MAX_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=('GET',),
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=settings.HTTP_POOL_SIZE,
+                pool_maxsize=settings.HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+# GET a URL through the pooled session; returns the response body
+def download(url):
+    res = get_http_session().get(url, timeout=settings.HTTP_TIMEOUT)
+    res.raise_for_status()
+    return res.content
+
+def _retry_after(exc):
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def retryable_errors():
+    import openai  # pylint: disable=no-member
+    return (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+def _should_retry(exc, attempt):
+    if attempt >= settings.OPENAI_MAX_RETRIES or not isinstance(exc, retryable_errors()):
+        return False
+    # An exhausted quota is reported as 429 too, but waiting does not help
+    return getattr(exc, 'code', None) != 'insufficient_quota'
+
+def _backoff_delay(exc, attempt):
+    import openai  # pylint: disable=no-member
+    if isinstance(exc, openai.RateLimitError):
+        metrics.incr('openai_rate_limited')
+    metrics.incr('openai_retries')
+    delay = _retry_after(exc)
+    if delay is None:
+        delay = settings.OPENAI_BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+    return min(delay, settings.OPENAI_BACKOFF_MAX)
+
+# Call fn(*args, **kwargs), retrying transient OpenAI errors with exponential backoff
+def with_retries(fn, *args, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not _should_retry(e, attempt):
+                raise
+            time.sleep(_backoff_delay(e, attempt))
+            attempt += 1
+
+async def awith_retries(fn, *args, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if not _should_retry(e, attempt):
+                raise
+            await asyncio.sleep(_backoff_delay(e, attempt))
+            attempt += 1
@@ -0,0 +1,234 @@
+# game/compositor.py
+# Local, network-free noir backgrounds. A low-resolution scene is layered from procedural
+# tiles (sky, skyline, street, office, rain, blinds) picked by keywords in the scene
+# description, seeded by the description so the same scene always looks the same, then
+# upscaled with hard pixel edges. Used as the instant first paint and as the fallback when
+# image generation fails; the generated image replaces it once ready. Renders live outside the
+# asset store; at most LOCAL_BACKGROUNDS_MAX_FILES are kept, oldest removed first (drawing one
+# again is cheap).
+import hashlib
+import os
+import random
+from PIL import Image, ImageDraw
+from django.conf import settings
+from . import metrics
+from .assets import asset_url, images_dir, normalize
+from .imaging import existing_variants, quantize, remove_variants, save_variants
+
+# Drawing resolution; scaled by 4 to the 800x600 background size
+WIDTH, HEIGHT = 200, 150
+FINAL_SIZE = (800, 600)
+
+INK = (12, 12, 18)
+DARK = (30, 30, 40)
+MID = (58, 58, 72)
+GREY = (98, 98, 110)
+LIGHT = (156, 156, 164)
+PALE = (214, 212, 200)
+AMBER = (222, 168, 78)
+BROWN = (96, 64, 38)
+
+INTERIOR_WORDS = {
+    'office', 'desk', 'room', 'bar', 'club', 'apartment', 'hotel', 'lobby', 'newsroom', 'station',
+    'precinct', 'study', 'diner', 'restaurant', 'kitchen', 'interrogation', 'morgue', 'warehouse',
+    'hall', 'inside', 'interior', 'cell', 'library', 'archive', 'typewriter',
+}
+EXTERIOR_WORDS = {
+    'street', 'alley', 'road', 'dock', 'pier', 'harbor', 'harbour', 'bridge', 'rooftop', 'roof', 'city',
+    'avenue', 'park', 'corner', 'parking', 'outside', 'sidewalk', 'waterfront', 'skyline',
+}
+RAIN_WORDS = {'rain', 'rainy', 'storm', 'stormy', 'wet', 'drizzle', 'downpour', 'puddle', 'raining'}
+BLINDS_WORDS = {'blinds', 'shutters', 'venetian', 'slats'}
+
+def _words(text):
+    words = set()
+    for word in normalize(text).split():
+        words.add(word)
+        words.add(word.rstrip('s'))
+    return words
+
+# Which layers to draw for a scene description
+def scene_layers(scene_description):
+    words = _words(scene_description)
+    interior = len(words & INTERIOR_WORDS) > len(words & EXTERIOR_WORDS)
+    return {
+        'interior': interior,
+        'rain': bool(words & RAIN_WORDS),
+        'blinds': bool(words & BLINDS_WORDS) or (interior and 'office' in words),
+    }
+
+# 2x2 ordered dither: True where a pixel at coverage `fraction` (0..1) should be lit
+def _lit(x, y, fraction):
+    return fraction > ((x & 1) * 2 + (y & 1) * 3) % 4 / 4.0 + 0.125
+
+def _dither_pick(x, y, fraction, a, b):
+    return b if _lit(x, y, fraction) else a
+
+def draw_sky(img, rng, box):
+    x0, y0, x1, y1 = box
+    px = img.load()
+    bands = [INK, DARK, MID]
+    span = max(1, y1 - y0)
+    for y in range(y0, y1):
+        t = (y - y0) / span * (len(bands) - 1)
+        i = min(int(t), len(bands) - 2)
+        for x in range(x0, x1):
+            px[x, y] = _dither_pick(x, y, t - i, bands[i], bands[i + 1])
+    if rng.random() < 0.6:
+        cx, cy, r = rng.randint(x0 + 15, max(x0 + 16, x1 - 15)), y0 + rng.randint(8, 22), rng.randint(5, 9)
+        ImageDraw.Draw(img).ellipse((cx - r, cy - r, cx + r, cy + r), fill=PALE)
+
+def draw_skyline(img, rng, box, horizon):
+    x0, y0, x1, _ = box
+    draw = ImageDraw.Draw(img)
+    x = x0 - rng.randint(0, 10)
+    while x < x1:
+        w = rng.randint(12, 30)
+        top = max(y0 + 4, horizon - rng.randint(25, 85))
+        color = rng.choice([INK, DARK])
+        draw.rectangle((x, top, x + w, horizon), fill=color)
+        for wy in range(top + 3, horizon - 3, 5):
+            for wx in range(x + 2, x + w - 2, 4):
+                if rng.random() < 0.18:
+                    draw.rectangle((wx, wy, wx + 1, wy + 1), fill=AMBER)
+        x += w + rng.randint(0, 3)
+
+def draw_street(img, rng, horizon, rain):
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, horizon, WIDTH, HEIGHT), fill=INK)
+    draw.rectangle((0, horizon, WIDTH, horizon + 6), fill=DARK)
+    px = img.load()
+    for lamp_x in range(rng.randint(15, 40), WIDTH, rng.randint(60, 90)):
+        top = horizon - 45
+        draw.line((lamp_x, top, lamp_x, HEIGHT - 1), fill=DARK)
+        draw.rectangle((lamp_x - 2, top - 3, lamp_x + 2, top), fill=AMBER)
+        # Dithered cone of light down to the pavement
+        for y in range(top + 1, HEIGHT):
+            half = (y - top) // 3
+            for x in range(max(0, lamp_x - half), min(WIDTH, lamp_x + half + 1)):
+                fade = 1.0 - (y - top) / (HEIGHT - top)
+                if _lit(x, y, fade * 0.6):
+                    px[x, y] = GREY if y > horizon else LIGHT
+        if rain:
+            # Reflections on the wet street
+            for y in range(horizon + 8, HEIGHT, 3):
+                draw.line((lamp_x - 1, y, lamp_x + 1, y), fill=AMBER if y % 2 else LIGHT)
+
+def draw_office(img, rng, rain):
+    draw = ImageDraw.Draw(img)
+    floor = 118
+    draw.rectangle((0, 0, WIDTH, floor), fill=MID)
+    draw.rectangle((0, floor - 30, WIDTH, floor), fill=DARK)
+    draw.rectangle((0, floor, WIDTH, HEIGHT), fill=INK)
+    # Window onto the city
+    wx0, wy0 = rng.randint(20, 110), 14
+    window = (wx0, wy0, wx0 + 70, wy0 + 58)
+    draw_sky(img, rng, window)
+    draw_skyline(img, rng, window, window[3])
+    if rain:
+        draw_rain(img, rng, window, count=60)
+    draw.rectangle(window, outline=INK, width=2)
+    draw.line(((window[0] + window[2]) // 2, window[1], (window[0] + window[2]) // 2, window[3]), fill=INK)
+    # Door with frosted glass, filing cabinet, desk with lamp and typewriter
+    door_x = 8 if wx0 > 60 else 160
+    draw.rectangle((door_x, 30, door_x + 30, floor), fill=BROWN, outline=INK)
+    draw.rectangle((door_x + 5, 36, door_x + 25, 62), fill=LIGHT)
+    cab_x = door_x + 36 if door_x < 100 else door_x - 24
+    draw.rectangle((cab_x, 70, cab_x + 18, floor), fill=GREY, outline=INK)
+    for y in (80, 93, 106):
+        draw.line((cab_x + 6, y, cab_x + 12, y), fill=INK)
+    desk = (wx0 - 5, 98, wx0 + 80, 110)
+    draw.rectangle(desk, fill=BROWN, outline=INK)
+    draw.rectangle((desk[0] + 4, 110, desk[0] + 8, HEIGHT - 10), fill=BROWN)
+    draw.rectangle((desk[2] - 8, 110, desk[2] - 4, HEIGHT - 10), fill=BROWN)
+    draw.rectangle((desk[0] + 30, 90, desk[0] + 46, 98), fill=INK)
+    lamp_x = desk[2] - 14
+    draw.polygon([(lamp_x - 6, 86), (lamp_x + 6, 86), (lamp_x + 2, 80), (lamp_x - 2, 80)], fill=AMBER)
+    draw.line((lamp_x, 86, lamp_x, 98), fill=INK)
+    px = img.load()
+    for y in range(87, 98):
+        half = (y - 86)
+        for x in range(lamp_x - half, lamp_x + half + 1):
+            if 0 <= x < WIDTH and _lit(x, y, 0.45):
+                px[x, y] = AMBER if y > 95 else PALE
+
+def draw_rain(img, rng, box=(0, 0, WIDTH, HEIGHT), count=350):
+    x0, y0, x1, y1 = box
+    draw = ImageDraw.Draw(img)
+    for _ in range(count):
+        x, y = rng.randint(x0, x1 - 1), rng.randint(y0, y1 - 1)
+        length = rng.randint(2, 5)
+        draw.line((x, y, max(x0, x - length // 2), min(y1 - 1, y + length)), fill=rng.choice([GREY, LIGHT]))
+
+def draw_blinds(img):
+    shadow = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    px = shadow.load()
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            if (y + x // 3) % 8 < 3:
+                px[x, y] = (0, 0, 0, 120)
+    return Image.alpha_composite(img.convert('RGBA'), shadow)
+
+def compose(scene_description, level_number=None):
+    seed = int(hashlib.sha1(f"{level_number}|{normalize(scene_description)}".encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    layers = scene_layers(scene_description)
+    img = Image.new('RGB', (WIDTH, HEIGHT), INK)
+    if layers['interior']:
+        draw_office(img, rng, layers['rain'])
+    else:
+        horizon = rng.randint(80, 100)
+        draw_sky(img, rng, (0, 0, WIDTH, horizon))
+        draw_skyline(img, rng, (0, 0, WIDTH, horizon), horizon)
+        draw_street(img, rng, horizon, layers['rain'])
+        if layers['rain']:
+            draw_rain(img, rng)
+    if layers['blinds']:
+        img = draw_blinds(img)
+    return img
+
+def local_image_name(level_number, scene_description):
+    key = hashlib.sha256(f"{level_number}|{normalize(scene_description)}".encode('utf-8')).hexdigest()
+    return f"local_{key[:16]}.png"
+
+def _is_local_primary(name):
+    return name.startswith('local_') and name.endswith('.png') and '@' not in name
+
+# Remove the oldest renders beyond LOCAL_BACKGROUNDS_MAX_FILES, never `keep`
+def prune_local(save_dir, keep=None):
+    renders = []
+    for name in os.listdir(save_dir):
+        if _is_local_primary(name) and name != keep:
+            try:
+                renders.append((os.path.getmtime(os.path.join(save_dir, name)), name))
+            except OSError:
+                continue
+    excess = len(renders) + (keep is not None) - settings.LOCAL_BACKGROUNDS_MAX_FILES
+    if excess <= 0:
+        return 0
+    for _, name in sorted(renders)[:excess]:
+        # Primary first, so a concurrent request renders the scene again instead of reusing it
+        variants = existing_variants(name, save_dir)
+        remove_variants(sorted(variants, key=lambda v: v['image_name'] != name), save_dir)
+        metrics.incr('local_backgrounds_pruned')
+    return excess
+
+# Background payload for a scene, rendered once and then served from disk
+def local_background(level_number, scene_description):
+    image_name = local_image_name(level_number, scene_description)
+    save_dir = images_dir()
+    if os.path.isfile(os.path.join(save_dir, image_name)):
+        metrics.incr('local_backgrounds_reused')
+        variants = existing_variants(image_name, save_dir)
+    else:
+        img = quantize(compose(scene_description, level_number), settings.IMAGE_PALETTE_COLORS, dither=False)
+        variants = save_variants(img, image_name, FINAL_SIZE, True, save_dir, dither=False)
+        metrics.incr('local_backgrounds_rendered')
+        prune_local(save_dir, keep=image_name)
+    return {
+        'prompt': None,
+        'image_name': image_name,
+        'url': asset_url(image_name),
+        'variants': [dict(v, url=asset_url(v['image_name'])) for v in variants],
+        'source': 'local',
+    }
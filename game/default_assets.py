@@ -0,0 +1,88 @@
+# game/default_assets.py
+# Declarative manifest of the images the game expects to find under static/images before any
+# level-specific art exists. Missing entries are generated by `manage.py bootstrap_assets`, or
+# in the background the first time one is needed; requests never wait for them.
+import logging
+import os
+import threading
+from . import metrics
+from .assets import images_dir
+from .utils import generate_and_save_image
+
+logger = logging.getLogger(__name__)
+
+# Checked into the repo; used whenever a default image is not available (yet)
+PLACEHOLDER_BACKGROUND = 'placeholder_bg.png'
+
+DEFAULT_ASSETS = [
+    {
+        'image_name': 'default_detective_office.png',
+        'is_background': True,
+        'levels': [1],
+        'prompt': (
+            "16-bit pixel art of a 1940s detective office: wooden desk with typewriter, dim lamp, files strewn, "
+            "venetian blinds casting shadows, noir atmosphere, limited grayscale palette, hard edges, chiaroscuro"
+        ),
+    },
+    {
+        'image_name': 'default_newsroom.png',
+        'is_background': True,
+        'levels': [2],
+        'prompt': (
+            "16-bit pixel art of a 1940s newspaper newsroom: rows of desks with typewriters, journalists at work, "
+            "overhead lamps, bulletin boards with headlines, sepia-toned noir style, limited palette, hard edges"
+        ),
+    },
+]
+
+_lock = threading.Lock()
+_thread = None
+
+def exists(image_name):
+    return os.path.isfile(os.path.join(images_dir(), image_name))
+
+def missing():
+    return [entry for entry in DEFAULT_ASSETS if not exists(entry['image_name'])]
+
+# Generate manifest entries (only the missing ones unless force); returns [(image_name, ok, error)]
+def bootstrap(force=False):
+    results = []
+    for entry in DEFAULT_ASSETS if force else missing():
+        ok, err = generate_and_save_image(entry['prompt'], entry['image_name'], is_background=entry['is_background'])
+        if ok:
+            metrics.incr('default_assets_generated')
+        else:
+            metrics.incr('default_assets_failed')
+            logger.warning("Default asset %s could not be generated: %s", entry['image_name'], err)
+        results.append((entry['image_name'], ok, err))
+    return results
+
+def _worker():
+    global _thread
+    try:
+        bootstrap()
+    finally:
+        with _lock:
+            _thread = None
+
+# Bootstrap missing entries in a background thread; at most one runs per process
+def schedule_bootstrap():
+    global _thread
+    if not missing():
+        return False
+    with _lock:
+        if _thread is not None:
+            return False
+        _thread = threading.Thread(target=_worker, name='default-assets', daemon=True)
+        _thread.start()
+    return True
+
+# Default background for a level, or the placeholder while it is still being generated
+def default_background_name(level_number):
+    entry = next((e for e in DEFAULT_ASSETS if level_number in e['levels']), None)
+    if entry is None:
+        return PLACEHOLDER_BACKGROUND
+    if exists(entry['image_name']):
+        return entry['image_name']
+    schedule_bootstrap()
+    return PLACEHOLDER_BACKGROUND
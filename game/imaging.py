@@ -0,0 +1,153 @@
+# game/imaging.py
+# Post-processing for generated images: quantize to a small indexed palette (the art style
+# only uses a handful of colors anyway), then write an optimized PNG plus WebP variants at
+# the widths configured per kind. Variant files sit next to the primary image:
+#   bg_<key>.png, bg_<key>.webp, bg_<key>@400w.png, bg_<key>@400w.webp, ...
+# plus bg_<key>.variants.json listing them, so callers never have to scan the directory.
+import glob
+import json
+import os
+import tempfile
+from io import BytesIO
+from PIL import Image, features
+from django.conf import settings
+from . import metrics
+
+def webp_enabled():
+    return settings.IMAGE_WEBP_VARIANTS and features.check('webp')
+
+def variant_widths(is_background):
+    return settings.BACKGROUND_VARIANT_WIDTHS if is_background else settings.SPRITE_VARIANT_WIDTHS
+
+def variant_name(image_name, width=None, ext='png'):
+    stem = os.path.splitext(image_name)[0]
+    return f"{stem}@{width}w.{ext}" if width else f"{stem}.{ext}"
+
+# Reduce to `colors` palette entries; fully transparent pixels share one extra index
+def quantize(img, colors, dither):
+    rgba = img.convert('RGBA')
+    alpha = rgba.getchannel('A')
+    has_alpha = alpha.getextrema()[0] < 128
+    n = max(colors - 1 if has_alpha else colors, 2)
+    rgb = rgba.convert('RGB')
+    palette = rgb.quantize(n, method=Image.Quantize.MEDIANCUT)
+    out = rgb.quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    if has_alpha:
+        # The quantizer may return fewer entries than asked for; transparency goes right after them
+        rgb_palette = out.getpalette()[:n * 3]
+        index = len(rgb_palette) // 3
+        out.putpalette(rgb_palette + [0, 0, 0])
+        out.paste(index, mask=alpha.point(lambda a: 255 if a < 128 else 0))
+        out.info['transparency'] = index
+    return out
+
+# Variant list of image_name, written by save_variants
+def manifest_name(image_name):
+    return os.path.splitext(image_name)[0].split('@')[0] + '.variants.json'
+
+# Written to a temporary file and renamed into place, so readers never see a partial file
+def write_file(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-', suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(data)
+
+def write_image(img, path, fmt):
+    buf = BytesIO()
+    if fmt == 'webp':
+        img.convert('RGBA').save(buf, format='WEBP', lossless=True, method=6)
+    else:
+        img.save(buf, format='PNG', optimize=True)
+    return write_file(path, buf.getvalue())
+
+# Quantize raw image bytes and write the primary PNG (final_size, named image_name) plus
+# its variants into save_dir; returns the list of variant descriptors
+def process_and_save(raw, image_name, final_size, is_background, save_dir):
+    source = Image.open(BytesIO(raw)).convert('RGBA')
+    return save_variants(source, image_name, final_size, is_background, save_dir)
+
+# Same as process_and_save for an image already in memory
+def save_variants(source, image_name, final_size, is_background, save_dir, dither=None):
+    source = source.convert('RGBA')
+    # Resample in full color first, then quantize once per output size
+    colors = settings.IMAGE_PALETTE_COLORS
+    dither = settings.IMAGE_DITHER if dither is None else dither
+    os.makedirs(save_dir, exist_ok=True)
+    width, height = final_size
+    sizes = [(width, height, None)]
+    for w in variant_widths(is_background):
+        if w != width:
+            sizes.append((w, max(1, round(height * w / width)), w))
+    formats = ['png', 'webp'] if webp_enabled() else ['png']
+    variants = []
+    # Primary file last: once it exists, every variant does too
+    for w, h, suffix in reversed(sizes):
+        # Nearest keeps pixel edges hard when enlarging; box-average when shrinking
+        resample = Image.NEAREST if w >= source.width else Image.BOX
+        with metrics.timed('resize'):
+            img = quantize(source.resize((w, h), resample), colors, dither)
+        for fmt in reversed(formats):
+            name = image_name if suffix is None and fmt == 'png' else variant_name(image_name, suffix, fmt)
+            with metrics.timed('save'):
+                size = write_image(img, os.path.join(save_dir, name), fmt)
+            variants.append({'image_name': name, 'width': w, 'height': h, 'format': fmt, 'bytes': size})
+            metrics.incr(f'image_bytes_{fmt}', size)
+    metrics.incr('images_processed')
+    variants.reverse()
+    write_file(os.path.join(save_dir, manifest_name(image_name)), json.dumps(variants).encode('utf-8'))
+    return variants
+
+# Descriptors of the files written for image_name: its manifest, or for images saved without
+# one (or while the manifest is being written) the files named after it
+def existing_variants(image_name, save_dir):
+    try:
+        with open(os.path.join(save_dir, manifest_name(image_name)), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        pass
+    stem = os.path.splitext(image_name)[0]
+    names = [image_name, stem + '.webp'] + glob.glob(glob.escape(stem) + '@*', root_dir=save_dir)
+    variants = []
+    for name in sorted(set(names)):
+        path = os.path.join(save_dir, name)
+        try:
+            with Image.open(path) as img:
+                w, h = img.size
+        except OSError:
+            continue
+        variants.append({
+            'image_name': name,
+            'width': w,
+            'height': h,
+            'format': os.path.splitext(name)[1].lstrip('.'),
+            'bytes': os.path.getsize(path),
+        })
+    return variants
+
+# Remove the files and, once they are gone, their manifest
+def remove_variants(variants, save_dir):
+    names = [variant['image_name'] for variant in variants]
+    for name in names + sorted({manifest_name(name) for name in names}):
+        try:
+            os.remove(os.path.join(save_dir, name))
+        except OSError:
+            pass
+
+def stats():
+    return {
+        'palette_colors': settings.IMAGE_PALETTE_COLORS,
+        'dither': settings.IMAGE_DITHER,
+        'webp': webp_enabled(),
+        'processed': metrics.get('images_processed'),
+        'bytes_png': metrics.get('image_bytes_png'),
+        'bytes_webp': metrics.get('image_bytes_webp'),
+        'local_rendered': metrics.get('local_backgrounds_rendered'),
+        'local_reused': metrics.get('local_backgrounds_reused'),
+        'local_failed': metrics.get('local_backgrounds_failed'),
+        'local_pruned': metrics.get('local_backgrounds_pruned'),
+    }
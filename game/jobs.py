@@ -0,0 +1,337 @@
+# game/jobs.py
+# Image generation jobs: persisted as ImageJob rows and executed by a local thread pool,
+# so request threads only enqueue work and return a placeholder immediately.
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from . import assets, compositor, default_assets, level_graph, metrics, singleflight, sprites, state_cache
+from .models import Asset, ImageJob, SceneCache
+from .utils import generate_dynamic_background_prompt, generate_and_save_image
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+# job id -> Future, for jobs submitted by this process and not finished yet
+_futures = {}
+_futures_lock = threading.Lock()
+
+def bg_cache_key(level_number, scene_description):
+    return f"lvl{level_number}:{scene_description}"
+
+def scene_key(level_number, scene_description):
+    return hashlib.sha1(bg_cache_key(level_number, scene_description).encode('utf-8')).hexdigest()
+
+# Per-game scene cache: one indexed row per scene instead of a JSON blob on Game
+# (read-through the hot cache in game/state_cache.py, written through on every store)
+def cached_background(game, level_number, scene_description):
+    key = scene_key(level_number, scene_description)
+    payload = state_cache.get_scene(game.pk, key)
+    if payload is None:
+        payload = SceneCache.objects.filter(game=game, scene_key=key).values_list('payload', flat=True).first()
+        if payload is not None:
+            state_cache.put_scene(game.pk, key, payload)
+    return payload
+
+# Background for a scene from the per-game cache or the shared asset store (an exact or a
+# similar scene); None if it still has to be generated
+def known_background(game, level_number, scene_description):
+    payload = cached_background(game, level_number, scene_description)
+    if payload is not None:
+        return payload
+    asset_key = assets.background_key(level_number, scene_description)
+    asset = assets.lookup(asset_key, game) or assets.lookup_similar_background(scene_description, game)
+    if asset is None:
+        return None
+    payload = assets.asset_payload(asset)
+    cache_background(game, level_number, scene_description, payload)
+    return payload
+
+def cache_background(game, level_number, scene_description, payload):
+    key = scene_key(level_number, scene_description)
+    SceneCache.objects.update_or_create(
+        game=game, scene_key=key,
+        defaults={'level_number': level_number, 'scene_description': scene_description or '', 'payload': payload}
+    )
+    state_cache.put_scene(game.pk, key, payload)
+
+def default_background(level_number):
+    default_image = default_assets.default_background_name(level_number)
+    return {
+        'prompt': None,
+        'image_name': default_image,
+        'url': assets.asset_url(default_image)
+    }
+
+# Instant stand-in while a scene's image is generated (and if generation fails): the local
+# compositor's rendering of the scene, or the level default when that is disabled
+def placeholder_background(level_number, scene_description):
+    if settings.LOCAL_BACKGROUNDS_ENABLED and scene_description:
+        try:
+            return compositor.local_background(level_number, scene_description)
+        except Exception as e:
+            metrics.incr('local_backgrounds_failed')
+            metrics.record_error('local_background', e)
+            logger.exception("Local background for level %s failed", level_number)
+    return default_background(level_number)
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_JOB_WORKERS,
+                thread_name_prefix='image-job'
+            )
+        return _executor
+
+# Re-queue jobs left behind by a previous process (pending, or running for too long);
+# returns how many were submitted. Run at server startup and by `manage.py resume_image_jobs`.
+def resume_pending():
+    stale = timezone.now() - timedelta(seconds=settings.IMAGE_JOB_STALE_SECONDS)
+    ImageJob.objects.filter(status=ImageJob.STATUS_RUNNING, updated_at__lt=stale).update(
+        status=ImageJob.STATUS_PENDING
+    )
+    executor = _get_executor()
+    resumed = 0
+    for job_id in ImageJob.objects.filter(status=ImageJob.STATUS_PENDING).values_list('pk', flat=True):
+        _track(str(job_id), executor.submit(_run, job_id))
+        resumed += 1
+    metrics.incr('image_jobs_resumed', resumed)
+    return resumed
+
+# Wait for every submitted job to finish (for one-off commands; the pool cannot be reused)
+def shutdown():
+    _get_executor().shutdown(wait=True)
+
+_resume_thread = None
+
+def _resume_worker():
+    try:
+        resume_pending()
+    except Exception:
+        # e.g. the tables do not exist yet before the first migrate
+        logger.exception("Resuming pending image jobs failed")
+    finally:
+        close_old_connections()
+
+# Resume in a background thread so a slow or missing database never delays startup; once per process
+def schedule_resume():
+    global _resume_thread
+    with _lock:
+        if _resume_thread is not None:
+            return
+        _resume_thread = threading.Thread(target=_resume_worker, name='image-job-resume', daemon=True)
+        _resume_thread.start()
+
+# Prompt + image + asset store + per-game cache for one scene; returns the response payload
+# (several games' jobs for the same scene share one generation, see game/singleflight.py)
+def generate_background(game, level_number, level_summary, scene_description):
+    asset_key = assets.background_key(level_number, scene_description)
+
+    def produce():
+        bg_info = generate_dynamic_background_prompt(level_number, level_summary, node_context=scene_description)
+        prompt = bg_info.get('prompt')
+        image_name = assets.asset_image_name(Asset.KIND_BACKGROUND, asset_key)
+        success, err = generate_and_save_image(prompt, image_name, is_background=True)
+        if not success:
+            raise RuntimeError(err)
+        return assets.store(asset_key, Asset.KIND_BACKGROUND, scene_description, prompt, image_name, game)
+
+    asset = singleflight.run(asset_key, produce, lambda: assets.lookup(asset_key, game))
+    payload = assets.asset_payload(asset)
+    if game is not None:
+        cache_background(game, level_number, scene_description, payload)
+    return payload
+
+def _run(job_id):
+    try:
+        # Claim atomically so a job resumed by several processes only runs once
+        claimed = ImageJob.objects.filter(pk=job_id, status=ImageJob.STATUS_PENDING).update(
+            status=ImageJob.STATUS_RUNNING, updated_at=timezone.now()
+        )
+        if not claimed:
+            return
+        job = ImageJob.objects.select_related('game').get(pk=job_id)
+        params = job.params
+        start = time.perf_counter()
+        try:
+            if job.kind == Asset.KIND_BACKGROUND:
+                result = generate_background(
+                    job.game, params['level_number'], params['level_summary'], params['scene_description']
+                )
+            elif job.kind == Asset.KIND_ATLAS:
+                characters = [tuple(c) for c in params['characters']]
+                result = sprites.atlas_payload(sprites.build_atlas(characters, job.game))
+            else:
+                raise ValueError(f"Unknown job kind {job.kind}")
+        except Exception as e:
+            error = metrics.record_error(f'job_{job.kind}', e)
+            logger.warning("Image job %s (%s) failed: %s: %s", job_id, job.kind, error, e)
+            job.status = ImageJob.STATUS_FAILED
+            job.error = str(e)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            metrics.incr('image_jobs_failed')
+            return
+        # Successful runs only: this is what expected_remaining() estimates from
+        metrics.observe_stage(f'job_{job.kind}', time.perf_counter() - start)
+        job.status = ImageJob.STATUS_DONE
+        job.result = result
+        job.save(update_fields=['status', 'result', 'updated_at'])
+        metrics.incr('image_jobs_done')
+    finally:
+        close_old_connections()
+
+# Queue a job unless one for the same asset is already queued/running, in which case join it
+def _enqueue(kind, dedupe_key, game, params):
+    # Per key, across threads and processes alike; never under _lock, as waiting for the
+    # lock row can take up to its TTL
+    with singleflight.exclusive(f'enqueue:{dedupe_key}'):
+        job = ImageJob.objects.filter(
+            dedupe_key=dedupe_key,
+            status__in=[ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING]
+        ).first()
+        if job is not None:
+            metrics.incr('image_jobs_deduplicated')
+            return job
+        job = ImageJob.objects.create(kind=kind, dedupe_key=dedupe_key, game=game, params=params)
+    metrics.incr('image_jobs_enqueued')
+    _track(str(job.pk), _get_executor().submit(_run, job.pk))
+    return job
+
+def _track(job_id, future):
+    with _futures_lock:
+        _futures[job_id] = future
+    # Outside the lock: a future that is already done runs the callback right here
+    future.add_done_callback(lambda _: _forget(job_id))
+
+def _forget(job_id):
+    with _futures_lock:
+        _futures.pop(job_id, None)
+
+# Futures of the given jobs that this process runs
+def _local_futures(job_ids):
+    with _futures_lock:
+        return [_futures[job_id] for job_id in job_ids if job_id in _futures]
+
+# Seconds until a job should be done, from the average successful run of its kind in this
+# process and how long it has been running; None while there is nothing to estimate from
+def expected_remaining(job):
+    average = metrics.stage_average(f'job_{job.kind}')
+    if average is None:
+        return None
+    if job.status == ImageJob.STATUS_RUNNING:
+        return max(0.0, average - (timezone.now() - job.updated_at).total_seconds())
+    return average
+
+# Wait until each job has finished or its deadline (a time.monotonic() value) has passed;
+# returns {job_id: ImageJob} as last read. Jobs run by this process are awaited directly,
+# others (queued by another process) are polled.
+def wait_for_jobs(deadlines):
+    pending = dict(deadlines)
+    found = {}
+    while pending:
+        for job in ImageJob.objects.filter(pk__in=list(pending)):
+            found[str(job.pk)] = job
+            if job.status in (ImageJob.STATUS_DONE, ImageJob.STATUS_FAILED):
+                pending.pop(str(job.pk), None)
+        now = time.monotonic()
+        pending = {job_id: deadline for job_id, deadline in pending.items() if deadline > now}
+        if not pending:
+            break
+        timeout = min(min(pending.values()) - now, 0.25)
+        local = _local_futures(pending)
+        if local:
+            wait(local, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(timeout)
+    return found
+
+# Block for up to `timeout` seconds or until the job finishes, if this process runs it;
+# False when it does not, so the caller has to poll
+def wait_for_job(job_id, timeout):
+    local = _local_futures([str(job_id)])
+    if not local:
+        return False
+    wait(local, timeout=timeout)
+    return True
+
+# Queue background generation for a scene
+def enqueue_background(game, level_number, level_summary, scene_description):
+    return _enqueue(Asset.KIND_BACKGROUND, assets.background_key(level_number, scene_description), game, {
+        'level_number': level_number,
+        'level_summary': level_summary,
+        'scene_description': scene_description,
+    })
+
+# Sprite atlas for all key characters of the game: the stored atlas payload if this set of
+# characters was packed before, otherwise {'atlas_key', 'job_id', 'status'} for a queued build.
+# None when the outline names no characters or atlases are disabled.
+def sprite_atlas_for(game):
+    characters = sprites.game_characters(game.outline)
+    if not characters:
+        return None
+    key = sprites.atlas_key(characters)
+    atlas = sprites.lookup_atlas(key, game)
+    if atlas is not None:
+        return sprites.atlas_payload(atlas)
+    job = _enqueue(Asset.KIND_ATLAS, key, game, {'characters': [list(c) for c in characters]})
+    return {'atlas_key': key, 'job_id': str(job.pk), 'status': job.status}
+
+# Distinct scene descriptions of a level, start node first: nearest first from the compiled
+# graph when there is one, otherwise in dialogue order
+def level_scenes(level_content, graph=None):
+    if graph is not None:
+        return level_graph.scene_order(graph)
+    nodes = level_content.get('dialogue_nodes', [])
+    start = str(level_content.get('start_node'))
+    ordered = sorted(nodes, key=lambda n: str(n.get('id')) != start)
+    scenes = []
+    for node in ordered:
+        scene = (node.get('scene_description') or '').strip()
+        if scene and scene not in scenes:
+            scenes.append(scene)
+    return scenes
+
+# Pipeline stage run once a level is stored: resolve every scene of the level from the caches,
+# queue generation for the rest (at most LEVEL_PREGEN_MAX_IMAGES), so node transitions never wait.
+def pregenerate_level_backgrounds(game, level_content, level_summary, graph=None):
+    level_number = level_content.get('level_number')
+    known = set(SceneCache.objects.filter(game=game, level_number=level_number).values_list('scene_key', flat=True))
+    cached = []
+    queued = 0
+    for scene in level_scenes(level_content, graph):
+        key = scene_key(level_number, scene)
+        if key in known:
+            continue
+        asset_key = assets.background_key(level_number, scene)
+        asset = assets.lookup(asset_key, game) or assets.lookup_similar_background(scene, game)
+        if asset is not None:
+            cached.append(SceneCache(
+                game=game, scene_key=key, level_number=level_number,
+                scene_description=scene, payload=assets.asset_payload(asset)
+            ))
+        elif queued < settings.LEVEL_PREGEN_MAX_IMAGES:
+            enqueue_background(game, level_number, level_summary, scene)
+            queued += 1
+    if cached:
+        SceneCache.objects.bulk_create(cached, ignore_conflicts=True)
+        for row in cached:
+            state_cache.put_scene(game.pk, row.scene_key, row.payload)
+    metrics.incr('level_pregen_queued', queued)
+    metrics.incr('level_pregen_cached', len(cached))
+    return queued
+
+def job_payload(job):
+    return {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'result': job.result,
+        'error': job.error,
+    }
@@ -0,0 +1,37 @@
+# game/level_format.py
+# Optional compact level encoding for API responses, requested with level_format=interned
+# (query string or request body). Speaker names and scene descriptions repeat across nodes;
+# here each is listed once and nodes refer to it by index:
+#   {..., 'format': 'interned', 'speakers': [...], 'scenes': [...],
+#    'dialogue_nodes': [{'id', 'speaker': 0, 'scene_description': 1, 'text', 'choices'}, ...]}
+# Stored levels, prompts and the SSE stream keep the plain format; expandLevel() in
+# static/js/main.js turns a response back into it.
+INTERNED = 'interned'
+
+def _index(value, values, positions):
+    if value is None:
+        return None
+    if value not in positions:
+        positions[value] = len(values)
+        values.append(value)
+    return positions[value]
+
+def intern_level(level_content):
+    speakers, scenes = [], []
+    speaker_positions, scene_positions = {}, {}
+    nodes = []
+    for node in level_content.get('dialogue_nodes', []):
+        nodes.append(dict(
+            node,
+            speaker=_index(node.get('speaker'), speakers, speaker_positions),
+            scene_description=_index(node.get('scene_description'), scenes, scene_positions),
+        ))
+    return dict(level_content, format=INTERNED, speakers=speakers, scenes=scenes, dialogue_nodes=nodes)
+
+# The level as the client asked for it (`params`: query string, then body)
+def level_for_response(level_content, *params):
+    for source in params:
+        value = source.get('level_format') if hasattr(source, 'get') else None
+        if value:
+            return intern_level(level_content) if value == INTERNED else level_content
+    return level_content
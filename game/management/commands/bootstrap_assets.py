@@ -0,0 +1,52 @@
+# game/management/commands/bootstrap_assets.py
+import os
+from django.core.management.base import BaseCommand
+from game import default_assets, imaging
+from game.assets import images_dir
+from game.models import Asset
+
+class Command(BaseCommand):
+    help = "Generate the default images listed in game/default_assets.py that are missing from static/images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate every manifest entry")
+        parser.add_argument('--list', action='store_true', help="Only report which entries are present")
+        parser.add_argument(
+            '--prune', action='store_true',
+            help="Delete images that belong neither to the manifest nor to a stored asset"
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for entry in default_assets.DEFAULT_ASSETS:
+                state = 'present' if default_assets.exists(entry['image_name']) else 'missing'
+                self.stdout.write(f"{entry['image_name']}: {state}")
+            return
+        if options['prune']:
+            self.prune()
+        failed = 0
+        for image_name, ok, err in default_assets.bootstrap(force=options['force']):
+            if ok:
+                self.stdout.write(f"Generated {image_name}")
+            else:
+                failed += 1
+                self.stderr.write(f"Failed {image_name}: {err}")
+        if failed:
+            self.stderr.write(f"{failed} default image(s) could not be generated")
+
+    def prune(self):
+        save_dir = images_dir()
+        keep = {default_assets.PLACEHOLDER_BACKGROUND}
+        for entry in default_assets.DEFAULT_ASSETS:
+            keep.update(v['image_name'] for v in imaging.existing_variants(entry['image_name'], save_dir))
+        for image_name, variants in Asset.objects.values_list('image_name', 'variants'):
+            keep.add(image_name)
+            keep.update(v['image_name'] for v in variants or [])
+        keep.update([imaging.manifest_name(name) for name in keep])
+        removed = 0
+        for name in os.listdir(save_dir) if os.path.isdir(save_dir) else []:
+            path = os.path.join(save_dir, name)
+            if name not in keep and os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+        self.stdout.write(f"Pruned {removed} unreferenced image(s)")
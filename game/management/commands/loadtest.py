@@ -0,0 +1,115 @@
+# game/management/commands/loadtest.py
+import json
+import threading
+import time
+from collections import defaultdict
+import requests
+from django.core.management.base import BaseCommand
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+# Follow the first choice from start_node until a node without choices, like a player would
+def play_level(level):
+    nodes = {str(n.get('id')): n for n in level.get('dialogue_nodes', [])}
+    path, node_id, seen = [], level.get('start_node'), set()
+    while str(node_id) in nodes and str(node_id) not in seen:
+        seen.add(str(node_id))
+        node = nodes[str(node_id)]
+        choices = node.get('choices') or []
+        if not choices:
+            break
+        path.append({'node_id': node.get('id'), 'choice_text': choices[0].get('text')})
+        node_id = choices[0].get('next_id')
+    return path
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, session, endpoint, url, payload):
+        start = time.perf_counter()
+        try:
+            res = session.post(url, json=payload, timeout=600)
+            ok = res.status_code < 400
+            data = res.json() if ok else None
+        except (requests.RequestException, ValueError):
+            ok, data = False, None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+        return data
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent players (new_game, then per level: generate_background, headline, "
+        "next_level) against a running server and report latency percentiles and throughput per endpoint. "
+        "Run the server against `manage.py openai_stub` for repeatable numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api')
+        parser.add_argument('--players', type=int, default=10)
+        parser.add_argument('--levels', type=int, default=10, help="next_level calls per player")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        base = options['base_url'].rstrip('/')
+        recorder = Recorder()
+
+        def player():
+            session = requests.Session()
+            data = recorder.call(session, 'new_game', f"{base}/new_game/", {})
+            if not data or 'level' not in data:
+                return
+            game_id, level, summary = data['game_id'], data['level'], data.get('level_summary', '')
+            for _ in range(options['levels']):
+                start = next((n for n in level.get('dialogue_nodes', [])
+                              if str(n.get('id')) == str(level.get('start_node'))), {})
+                recorder.call(session, 'generate_background', f"{base}/generate_background/", {
+                    'game_id': game_id, 'level_number': level.get('level_number'),
+                    'level_summary': summary, 'scene_description': start.get('scene_description'),
+                })
+                path = play_level(level)
+                recorder.call(session, 'headline', f"{base}/headline/", {'game_id': game_id, 'choices_path': path})
+                data = recorder.call(session, 'next_level', f"{base}/next_level/", {'game_id': game_id, 'choices_path': path})
+                if not data or 'level' not in data:
+                    return
+                level, summary = data['level'], data.get('level_summary', '')
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=player) for _ in range(options['players'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+
+        report = {'players': options['players'], 'wall_seconds': round(wall, 3), 'endpoints': {}}
+        for endpoint, values in recorder.latencies.items():
+            report['endpoints'][endpoint] = {
+                'requests': len(values),
+                'errors': recorder.errors[endpoint],
+                'p50': round(percentile(values, 50), 4),
+                'p95': round(percentile(values, 95), 4),
+                'p99': round(percentile(values, 99), 4),
+                'rps': round(len(values) / wall, 3) if wall else None,
+            }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{options['players']} players, {wall:.1f}s wall time")
+        self.stdout.write(f"{'endpoint':<22}{'reqs':>6}{'errs':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>8}")
+        for endpoint, row in sorted(report['endpoints'].items()):
+            self.stdout.write(
+                f"{endpoint:<22}{row['requests']:>6}{row['errors']:>6}"
+                f"{row['p50']:>9.3f}{row['p95']:>9.3f}{row['p99']:>9.3f}{row['rps']:>8.2f}"
+            )
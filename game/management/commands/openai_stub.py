@@ -0,0 +1,36 @@
+# game/management/commands/openai_stub.py
+from django.core.management.base import BaseCommand
+from game.stub_openai import make_server
+
+class Command(BaseCommand):
+    help = (
+        "Run an offline OpenAI-compatible stub server. Point the app at it with "
+        "OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 (any OPENAI_API_KEY works)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--chat-latency', default='lognormal:2.0:0.4',
+                            help="fixed:S | uniform:A:B | normal:MU:SIGMA | lognormal:MEDIAN:SIGMA (seconds)")
+        parser.add_argument('--image-latency', default='lognormal:6.0:0.3')
+        parser.add_argument('--token-latency', default='fixed:0.02',
+                            help="Delay between streamed chunks")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of requests answered with 429 + Retry-After")
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options['host'], options['port'],
+            chat_latency=options['chat_latency'],
+            image_latency=options['image_latency'],
+            token_latency=options['token_latency'],
+            error_rate=options['error_rate'],
+        )
+        self.stdout.write(f"OpenAI stub listening on http://{options['host']}:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,25 @@
+# game/management/commands/refill_warm_pool.py
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from game import warm_pool
+
+class Command(BaseCommand):
+    help = "Top up the pool of pre-generated outline + level 1 pairs used by new games."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=None, help="Target pool size (default WARM_POOL_SIZE)")
+        parser.add_argument('--loop', action='store_true', help="Keep refilling every --interval seconds")
+        parser.add_argument('--interval', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        target = options['size'] if options['size'] is not None else settings.WARM_POOL_SIZE
+        while True:
+            added = warm_pool.refill(target)
+            remaining = warm_pool.size()
+            self.stdout.write(f"Added {added} entries; pool size {remaining}/{target}")
+            if remaining < settings.WARM_POOL_LOW_WATER:
+                self.stderr.write(f"Warm pool below low-water mark ({settings.WARM_POOL_LOW_WATER})")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,12 @@
+# game/management/commands/resume_image_jobs.py
+from django.core.management.base import BaseCommand
+from game import jobs
+
+class Command(BaseCommand):
+    help = "Run image jobs left pending (or stuck running) by a previous process, then exit."
+
+    def handle(self, *args, **options):
+        resumed = jobs.resume_pending()
+        self.stdout.write(f"Resumed {resumed} image jobs")
+        jobs.shutdown()
+        self.stdout.write("Done")
@@ -0,0 +1,56 @@
+# game/management/commands/startup_benchmark.py
+import json
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter: time django.setup() (settings + every AppConfig.ready()) and the
+# URLconf import that the first request pays for
+CHILD = '''
+import json, os, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({'setup': setup, 'urls': time.perf_counter() - start - setup}))
+'''
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        'min': round(ordered[0], 3),
+        'p50': round(ordered[len(ordered) // 2], 3),
+        'max': round(ordered[-1], 3),
+    }
+
+class Command(BaseCommand):
+    help = "Measure cold-start time of the app (interpreter + django.setup() + URLconf) over several runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'noirgame.settings'))
+        samples = {'total': [], 'setup': [], 'urls': []}
+        for _ in range(max(1, options['runs'])):
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, '-c', CHILD], env=env, cwd=str(settings.BASE_DIR),
+                capture_output=True, text=True, check=True
+            ).stdout
+            samples['total'].append(time.perf_counter() - start)
+            child = json.loads(out.strip().splitlines()[-1])
+            samples['setup'].append(child['setup'])
+            samples['urls'].append(child['urls'])
+        summary = {name: summarize(values) for name, values in samples.items()}
+        if options['json']:
+            self.stdout.write(json.dumps(summary))
+            return
+        for name, stats in summary.items():
+            self.stdout.write(f"{name:>6}: min {stats['min']:.3f}s  p50 {stats['p50']:.3f}s  max {stats['max']:.3f}s")
@@ -0,0 +1,150 @@
+# game/metrics.py
+import contextvars
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Process-wide counters (cache hits, prefetch hits/misses, ...)
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot(prefix=''):
+    with _lock:
+        return {k: v for k, v in sorted(_counters.items()) if k.startswith(prefix)}
+
+# Value observations (e.g. prompt tokens per call): count, sum, max and last value
+_observations = {}
+
+def observe(name, value):
+    with _lock:
+        obs = _observations.get(name)
+        if obs is None:
+            obs = _observations[name] = {'count': 0, 'sum': 0.0, 'max': value, 'last': value}
+        obs['count'] += 1
+        obs['sum'] += value
+        obs['max'] = max(obs['max'], value)
+        obs['last'] = value
+
+def observations(prefix=''):
+    with _lock:
+        return {
+            k: dict(v, avg=v['sum'] / v['count'])
+            for k, v in sorted(_observations.items()) if k.startswith(prefix)
+        }
+
+# Per-stage latency histograms (llm_chat, parse, image_generate, download, resize, save, db, ...)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_stages = {}
+_errors = defaultdict(int)
+_tokens = defaultdict(int)
+
+# Stages timed during the current request, for the request log (see game/middleware.py)
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+def observe_stage(stage, seconds):
+    with _lock:
+        hist = _stages.get(stage)
+        if hist is None:
+            hist = _stages[stage] = {'buckets': [0] * len(STAGE_BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                hist['buckets'][i] += 1
+        hist['count'] += 1
+        hist['sum'] += seconds
+    timings = _request_stages.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+# Mean duration of a stage in seconds; None before it was first observed
+def stage_average(stage):
+    with _lock:
+        hist = _stages.get(stage)
+        return hist['sum'] / hist['count'] if hist else None
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+# Count a failure of `stage` by exception class; returns the class name
+def record_error(stage, exc):
+    error = type(exc).__name__
+    with _lock:
+        _errors[(stage, error)] += 1
+    timings = _request_stages.get()
+    if timings is not None:
+        timings.setdefault('errors', []).append(f'{stage}:{error}')
+    return error
+
+def record_tokens(purpose, prompt_tokens, completion_tokens=0):
+    with _lock:
+        _tokens[(purpose, 'prompt')] += prompt_tokens or 0
+        _tokens[(purpose, 'completion')] += completion_tokens or 0
+
+def stage_report():
+    with _lock:
+        return {
+            stage: {'count': h['count'], 'avg_ms': round(h['sum'] / h['count'] * 1000, 1)}
+            for stage, h in sorted(_stages.items())
+        }
+
+def in_request():
+    return _request_stages.get() is not None
+
+def start_request():
+    return _request_stages.set({})
+
+def finish_request(token):
+    timings = _request_stages.get() or {}
+    _request_stages.reset(token)
+    return timings
+
+def _metric_name(name):
+    return 'noir_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Everything above in the Prometheus text exposition format
+def prometheus():
+    with _lock:
+        counters = sorted(_counters.items())
+        stages = {k: dict(v, buckets=list(v['buckets'])) for k, v in sorted(_stages.items())}
+        errors = sorted(_errors.items())
+        tokens = sorted(_tokens.items())
+        obs = {k: dict(v) for k, v in sorted(_observations.items())}
+    lines = []
+    for name, value in counters:
+        metric = _metric_name(name) + '_total'
+        lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+    lines.append('# TYPE noir_stage_duration_seconds histogram')
+    for stage, hist in stages.items():
+        label = f'stage="{_label(stage)}"'
+        for bound, count in zip(STAGE_BUCKETS, hist['buckets']):
+            lines.append(f'noir_stage_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'noir_stage_duration_seconds_bucket{{{label},le="+Inf"}} {hist["count"]}')
+        lines.append(f'noir_stage_duration_seconds_sum{{{label}}} {hist["sum"]:.6f}')
+        lines.append(f'noir_stage_duration_seconds_count{{{label}}} {hist["count"]}')
+    lines.append('# TYPE noir_errors_total counter')
+    for (stage, error), value in errors:
+        lines.append(f'noir_errors_total{{stage="{_label(stage)}",error="{_label(error)}"}} {value}')
+    lines.append('# TYPE noir_tokens_total counter')
+    for (purpose, kind), value in tokens:
+        lines.append(f'noir_tokens_total{{purpose="{_label(purpose)}",kind="{kind}"}} {value}')
+    for name, o in obs.items():
+        metric = _metric_name(name)
+        lines += [f'# TYPE {metric} summary', f'{metric}_sum {o["sum"]}', f'{metric}_count {o["count"]}']
+    return '\n'.join(lines) + '\n'
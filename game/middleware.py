@@ -0,0 +1,121 @@
+# game/middleware.py
+# One structured (JSON) log line per API request: route, status, total duration and the time
+# spent in each stage during the request (DB queries, LLM calls, parsing, images...), plus
+# the classes of any errors recorded. Streaming responses are timed until the stream starts.
+# Works in both sync (WSGI) and async (ASGI) chains, so /api/async/ views stay async.
+import json
+import logging
+import re
+import time
+import brotli
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from . import metrics
+
+logger = logging.getLogger('game.requests')
+
+_accepts_br = re.compile(r'\bbr\b')
+
+# Queries only count while a request is being timed; the request's context is copied into the
+# sync_to_async threads async views query from, so their queries land in the same log line
+def _timed_query(execute, sql, params, many, context):
+    if not metrics.in_request():
+        return execute(sql, params, many, context)
+    with metrics.timed('db'):
+        return execute(sql, params, many, context)
+
+# Every thread has its own connection; wrap each one as it is opened
+def _install_query_timer(sender, connection, **kwargs):
+    if _timed_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_query)
+
+connection_created.connect(_install_query_timer)
+
+def _log_request(request, response, token, start):
+    elapsed = time.perf_counter() - start
+    stages = metrics.finish_request(token)
+    errors = stages.pop('errors', [])
+    match = getattr(request, 'resolver_match', None)
+    route = match.view_name if match else 'unresolved'
+    status = response.status_code if response is not None else 500
+    metrics.observe_stage(f'request:{route}', elapsed)
+    metrics.incr(f'http_responses_{status // 100}xx')
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': status,
+        'duration_ms': round(elapsed * 1000, 1),
+        'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in sorted(stages.items())},
+        'errors': errors,
+    }))
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        # This thread's connections may predate the connection_created hook
+        for connection in connections.all():
+            _install_query_timer(None, connection)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            _log_request(request, response, token, start)
+
+    async def __acall__(self, request):
+        if not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            _log_request(request, response, token, start)
+
+# Response compression: brotli when the client accepts it, gzip otherwise. Event streams are
+# left alone so SSE stays incremental, and images are already compressed.
+class CompressionMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if content_type.startswith(('text/event-stream', 'image/')) or response.has_header('Content-Encoding'):
+            return response
+        accept = request.headers.get('Accept-Encoding', '')
+        if response.streaming or not _accepts_br.search(accept):
+            return super().process_response(request, response)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < 200:
+            return response
+        compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        metrics.incr('responses_brotli')
+        metrics.incr('response_bytes_saved', len(response.content) - len(compressed))
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Same as GZipMiddleware: the compressed body is no longer byte-identical
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_game_bg_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrefetchedLevel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level_number', models.IntegerField()),
+                ('path_key', models.CharField(max_length=40)),
+                ('content', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prefetched_levels', to='game.game')),
+            ],
+            options={
+                'unique_together': {('game', 'level_number', 'path_key')},
+            },
+        ),
+    ]
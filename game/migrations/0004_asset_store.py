@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_prefetchedlevel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Asset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('kind', models.CharField(max_length=20)),
+                ('description', models.TextField()),
+                ('prompt', models.TextField(blank=True, null=True)),
+                ('image_name', models.CharField(max_length=255)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AssetRef',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refs', to='game.asset')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asset_refs', to='game.game')),
+            ],
+            options={
+                'unique_together': {('asset', 'game')},
+            },
+        ),
+    ]
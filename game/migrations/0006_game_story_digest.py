@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+# Frozen copy of game.story.digest_entry as of this migration; the live helper may change
+def _clip(text, limit):
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def digest_entry(level_number, role, level_content, choices_path):
+    nodes = {str(n.get('id')): n for n in (level_content or {}).get('dialogue_nodes', [])}
+    choices = [_clip(step.get('choice_text'), 80) for step in choices_path or []]
+    outcome = ''
+    if choices_path:
+        last = choices_path[-1]
+        node = nodes.get(str(last.get('node_id'))) or {}
+        choice = next((c for c in node.get('choices') or [] if c.get('text') == last.get('choice_text')), None)
+        reached = nodes.get(str(choice.get('next_id'))) if choice else None
+        outcome = (reached or node).get('text', '')
+    return {
+        'level': level_number,
+        'role': role,
+        'choices': choices,
+        'outcome': _clip(outcome, 240),
+    }
+
+
+# Build the digest for games created before story compaction from their choices_history
+def backfill_story_digest(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    LevelData = apps.get_model('game', 'LevelData')
+    for game in Game.objects.exclude(choices_history=[]).iterator():
+        contents = {
+            level.level_number: level.content
+            for level in LevelData.objects.filter(game=game)
+        }
+        digest = []
+        for entry in game.choices_history:
+            content = contents.get(entry.get('level')) or {}
+            digest.append(digest_entry(entry.get('level'), content.get('role', ''), content, entry.get('path')))
+        game.story_digest = digest
+        game.save(update_fields=['story_digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='story_digest',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(backfill_story_digest, migrations.RunPython.noop),
+    ]
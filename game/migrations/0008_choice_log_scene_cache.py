@@ -0,0 +1,118 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of game.story.digest_entry as of this migration; the live helper may change
+def _clip(text, limit):
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def digest_entry(level_number, role, level_content, choices_path):
+    nodes = {str(n.get('id')): n for n in (level_content or {}).get('dialogue_nodes', [])}
+    choices = [_clip(step.get('choice_text'), 80) for step in choices_path or []]
+    outcome = ''
+    if choices_path:
+        last = choices_path[-1]
+        node = nodes.get(str(last.get('node_id'))) or {}
+        choice = next((c for c in node.get('choices') or [] if c.get('text') == last.get('choice_text')), None)
+        reached = nodes.get(str(choice.get('next_id'))) if choice else None
+        outcome = (reached or node).get('text', '')
+    return {
+        'level': level_number,
+        'role': role,
+        'choices': choices,
+        'outcome': _clip(outcome, 240),
+    }
+
+
+# Move choices_history/story_digest into ChoiceEvent rows and bg_cache into SceneCache rows
+def copy_game_json(apps, schema_editor):
+    import hashlib
+    Game = apps.get_model('game', 'Game')
+    LevelData = apps.get_model('game', 'LevelData')
+    ChoiceEvent = apps.get_model('game', 'ChoiceEvent')
+    SceneCache = apps.get_model('game', 'SceneCache')
+    for game in Game.objects.iterator():
+        digests = {entry.get('level'): entry for entry in game.story_digest or []}
+        events = []
+        for entry in game.choices_history or []:
+            level_number = entry.get('level')
+            digest = digests.get(level_number)
+            if digest is None:
+                level = LevelData.objects.filter(game=game, level_number=level_number).first()
+                content = level.content if level else {}
+                digest = digest_entry(level_number, content.get('role', ''), content, entry.get('path'))
+            events.append(ChoiceEvent(
+                game=game, level_number=level_number, path=entry.get('path') or [], digest=digest
+            ))
+        ChoiceEvent.objects.bulk_create(events)
+        scenes = []
+        for cache_key, payload in (game.bg_cache or {}).items():
+            prefix, _, scene = cache_key.partition(':')
+            try:
+                level_number = int(prefix[3:])
+            except ValueError:
+                continue
+            scenes.append(SceneCache(
+                game=game,
+                scene_key=hashlib.sha1(cache_key.encode('utf-8')).hexdigest(),
+                level_number=level_number,
+                scene_description=scene,
+                payload=payload,
+            ))
+        SceneCache.objects.bulk_create(scenes, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_warmstart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level_number', models.IntegerField()),
+                ('path', models.JSONField(default=list)),
+                ('digest', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='choice_events', to='game.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['game', 'level_number'], name='game_choice_game_id_0b5c3c_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SceneCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scene_key', models.CharField(max_length=40)),
+                ('level_number', models.IntegerField()),
+                ('scene_description', models.TextField(blank=True)),
+                ('payload', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scene_cache', to='game.game')),
+            ],
+            options={
+                'unique_together': {('game', 'scene_key')},
+            },
+        ),
+        migrations.RunPython(copy_game_json, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='game',
+            name='bg_cache',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='choices_history',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='story_digest',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_choice_log_scene_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='variants',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_asset_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpriteAtlas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('manifest', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('asset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='atlas', to='game.asset')),
+            ],
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:52
+
+from collections import deque
+
+from django.db import migrations, models
+
+
+# Frozen copy of game.level_graph.compile_level as of this migration; the live one may change
+def _node_id(node):
+    return str(node.get('id'))
+
+
+def _targets(node, by_id):
+    for choice in node.get('choices') or []:
+        next_id = str(choice.get('next_id'))
+        if next_id in by_id:
+            yield next_id
+
+
+# Breadth-first from start: (depth per node, ids in visiting order)
+def _walk(by_id, start):
+    depth = {start: 0}
+    order = []
+    queue = deque([start])
+    while queue:
+        node_id = queue.popleft()
+        order.append(node_id)
+        for next_id in _targets(by_id[node_id], by_id):
+            if next_id not in depth:
+                depth[next_id] = depth[node_id] + 1
+                queue.append(next_id)
+    return depth, order
+
+
+# Iterative depth-first search; edges into a node still on the stack close a cycle
+def _back_edges(by_id, start):
+    edges = []
+    on_stack = {start}
+    visited = {start}
+    stack = [(start, _targets(by_id[start], by_id))]
+    while stack:
+        node_id, targets = stack[-1]
+        for next_id in targets:
+            if next_id in on_stack:
+                edges.append([node_id, next_id])
+            elif next_id not in visited:
+                visited.add(next_id)
+                on_stack.add(next_id)
+                stack.append((next_id, _targets(by_id[next_id], by_id)))
+                break
+        else:
+            on_stack.discard(node_id)
+            stack.pop()
+    return edges
+
+
+# Prune level_content in place and return its graph
+def compile_level(level_content):
+    nodes = level_content.get('dialogue_nodes') or []
+    by_id = {_node_id(node): node for node in nodes}
+    start = str(level_content.get('start_node'))
+    if start not in by_id:
+        # Nothing to anchor reachability on; keep every node at an unknown depth
+        depth, order, cycles = {}, list(by_id), []
+    else:
+        depth, order = _walk(by_id, start)
+        cycles = _back_edges(by_id, start)
+    pruned = [_node_id(node) for node in nodes if depth and _node_id(node) not in depth]
+    if pruned:
+        nodes = [node for node in nodes if _node_id(node) in depth]
+        level_content['dialogue_nodes'] = nodes
+    scenes = {}
+    for node_id in order:
+        scene = (by_id[node_id].get('scene_description') or '').strip()
+        if scene:
+            scenes.setdefault(scene, []).append(node_id)
+    return {
+        'start_node': start,
+        'index': {_node_id(node): i for i, node in enumerate(nodes)},
+        'depth': depth,
+        'max_depth': max(depth.values(), default=0),
+        'terminal': [node_id for node_id in order if not by_id[node_id].get('choices')],
+        'cycles': cycles,
+        'scenes': scenes,
+        'pruned': pruned,
+    }
+
+
+# Compile the graph of levels stored before it existed (pruning their unreachable nodes)
+def compile_levels(apps, schema_editor):
+    LevelData = apps.get_model('game', 'LevelData')
+    for level in LevelData.objects.filter(graph__isnull=True).iterator():
+        level.graph = compile_level(level.content)
+        level.save(update_fields=['content', 'graph'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_generationlock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leveldata',
+            name='graph',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(compile_levels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+# Keep only the latest row of each level; earlier ones are duplicates left by retried transitions
+def drop_duplicate_events(apps, schema_editor):
+    ChoiceEvent = apps.get_model('game', 'ChoiceEvent')
+    latest = {}
+    for pk, game_id, level_number in ChoiceEvent.objects.order_by('created_at', 'pk').values_list(
+        'pk', 'game_id', 'level_number'
+    ):
+        latest[(game_id, level_number)] = pk
+    ChoiceEvent.objects.exclude(pk__in=latest.values()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0012_leveldata_graph'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_events, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='choiceevent',
+            name='game_choice_game_id_0b5c3c_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='choiceevent',
+            constraint=models.UniqueConstraint(fields=('game', 'level_number'), name='unique_choice_event_per_level'),
+        ),
+    ]
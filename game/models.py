@@ -1,29 +1,159 @@
 # game/models.py
 import uuid
 from django.db import models
+from django.utils import timezone
 
 class Game(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     outline = models.JSONField()
     current_level = models.IntegerField(default=1)
-    choices_history = models.JSONField(default=list)
-    # Cache for background images: maps scene_description to {image_name, url, prompt}
-    bg_cache = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Game {self.pk} - Level {self.current_level}"
 
+# One finished level: the choices the player took and its digest entry (game/story.py).
+# One row per level of a game; a retried transition rewrites it.
+class ChoiceEvent(models.Model):
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='choice_events')
+    level_number = models.IntegerField()
+    path = models.JSONField(default=list)
+    digest = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'level_number'], name='unique_choice_event_per_level')
+        ]
+
+    def __str__(self):
+        return f"Game {self.game_id} Level {self.level_number} choices"
+
+# Resolved background for one scene of one game: {image_name, url, prompt}
+class SceneCache(models.Model):
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='scene_cache')
+    # sha1 of jobs.bg_cache_key(level_number, scene_description)
+    scene_key = models.CharField(max_length=40)
+    level_number = models.IntegerField()
+    scene_description = models.TextField(blank=True)
+    payload = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('game', 'scene_key')
+
+    def __str__(self):
+        return f"Game {self.game_id} Level {self.level_number} scene {self.scene_key[:8]}"
+
 class LevelData(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='levels')
     level_number = models.IntegerField()
     role = models.CharField(max_length=20)
     content = models.JSONField()
+    # Compiled dialogue graph of content (game/level_graph.py)
+    graph = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('game', 'level_number')
 
     def __str__(self):
-        return f"Game {self.game.pk} Level {self.level_number} ({self.role})"
\ No newline at end of file
+        return f"Game {self.game.pk} Level {self.level_number} ({self.role})"
+
+# Speculatively generated next level for one candidate choices_path
+class PrefetchedLevel(models.Model):
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='prefetched_levels')
+    level_number = models.IntegerField()
+    # prefetch.outcome_key(): the ending of the previous level this one was generated for
+    path_key = models.CharField(max_length=40)
+    content = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('game', 'level_number', 'path_key')
+
+    def __str__(self):
+        return f"Game {self.game_id} Level {self.level_number} prefetch {self.path_key[:8]}"
+
+
+# Generated image shared across games, addressed by a hash of its normalized scene/character
+class Asset(models.Model):
+    KIND_BACKGROUND = 'background'
+    KIND_SPRITE = 'sprite'
+    KIND_ATLAS = 'atlas'
+
+    key = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=20)
+    description = models.TextField()
+    prompt = models.TextField(null=True, blank=True)
+    image_name = models.CharField(max_length=255)
+    # Every file written for the image (primary PNG included): image_name, width, height, format, bytes
+    variants = models.JSONField(default=list)
+    size_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.key[:12]} ({self.image_name})"
+
+# Frame manifest of a packed character sprite sheet; the sheet itself is an Asset of KIND_ATLAS
+# keyed by the set of character identities it contains (game/sprites.py)
+class SpriteAtlas(models.Model):
+    asset = models.OneToOneField(Asset, on_delete=models.CASCADE, related_name='atlas')
+    # Phaser/TexturePacker "JSON hash" manifest plus a character name -> frame map
+    manifest = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Sprite atlas {self.asset.key[:12]} ({len(self.manifest.get('frames', {}))} frames)"
+
+# One row per game using an asset; the row count is the asset's reference count
+class AssetRef(models.Model):
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE, related_name='refs')
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='asset_refs')
+
+    class Meta:
+        unique_together = ('asset', 'game')
+
+# Queued image generation; the worker pool in game/jobs.py runs these off the request thread
+class ImageJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20)
+    # Asset key of the image being produced; used to deduplicate concurrent jobs
+    dedupe_key = models.CharField(max_length=64, db_index=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, null=True, blank=True, related_name='image_jobs')
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, default=STATUS_PENDING, db_index=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+# Pre-generated outline + level 1, claimed (deleted) by exactly one new game
+class WarmStart(models.Model):
+    outline = models.JSONField()
+    level_content = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Warm start {self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
+
+# Cross-process single-flight lock (game/singleflight.py): present while one worker generates
+# the asset with this key; other workers wait for it to go away and read the stored result
+class GenerationLock(models.Model):
+    key = models.CharField(max_length=128, primary_key=True)
+    owner = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Lock {self.key} held by {self.owner}"
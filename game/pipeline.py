@@ -0,0 +1,145 @@
+# game/pipeline.py
+# New-game fan-out. Once the outline exists, the sprite atlas job is queued first; level 1 is
+# then streamed and each scene's background is resolved or queued on the image job pool as
+# soon as its node is known to be reachable from the start node, so the images render while
+# the rest of the dialogue is still being written. Before answering, the request waits for the
+# first screen's jobs, but only for those expected to finish within their stage's deadline
+# (NEW_GAME_BACKGROUND_DEADLINE, NEW_GAME_SPRITES_DEADLINE), and reports which of the level's
+# assets are ready.
+import time
+from django.conf import settings
+from . import assets, metrics
+from .jobs import (
+    cached_background, enqueue_background, expected_remaining, known_background, placeholder_background,
+    wait_for_jobs
+)
+from .level_graph import scene_for_node, scene_order
+from .models import ImageJob
+from .utils import stream_level_content
+
+# Level 1 content, with backgrounds queued scene by scene while it streams. Nodes are held
+# back until a chain of choices from the start node reaches them, so scenes that
+# compile_level will prune as unreachable are never generated.
+def stream_first_level(game, outline, level_summary):
+    level_content = None
+    seen = set()
+    arrived = {}       # node id -> node not visited yet
+    reachable = set()  # node ids reachable from the start node, arrived or not
+
+    def queue_scene(node):
+        scene = (node.get('scene_description') or '').strip()
+        if not scene or scene in seen or len(seen) >= settings.LEVEL_PREGEN_MAX_IMAGES:
+            return
+        seen.add(scene)
+        if known_background(game, 1, scene) is None:
+            enqueue_background(game, 1, level_summary, scene)
+            metrics.incr('new_game_early_backgrounds')
+
+    def visit(node_id):
+        stack = [node_id]
+        while stack:
+            node = arrived.pop(stack.pop(), None)
+            if node is None:
+                continue
+            queue_scene(node)
+            for choice in node.get('choices') or []:
+                next_id = str(choice.get('next_id'))
+                if next_id not in reachable:
+                    reachable.add(next_id)
+                    stack.append(next_id)
+
+    with metrics.timed('new_game_level'):
+        for event, value in stream_level_content(outline, [], 1):
+            if event == 'level':
+                level_content = value
+            elif event == 'start_node':
+                reachable.add(str(value))
+                visit(str(value))
+            elif event == 'node':
+                node_id = str(value.get('id'))
+                arrived[node_id] = value
+                if node_id in reachable:
+                    visit(node_id)
+    return level_content
+
+def _job_id(payload):
+    return payload.get('job_id') if payload else None
+
+# Ready/pending listing of the level's backgrounds and the game's sprite atlas
+def asset_status(game, level_number, graph, sprite_atlas):
+    ready, pending = [], []
+    for scene in scene_order(graph):
+        if cached_background(game, level_number, scene) is not None:
+            ready.append({'kind': 'background', 'scene': scene})
+            continue
+        job_id = ImageJob.objects.filter(
+            dedupe_key=assets.background_key(level_number, scene),
+            status__in=[ImageJob.STATUS_PENDING, ImageJob.STATUS_RUNNING]
+        ).values_list('pk', flat=True).first()
+        pending.append({'kind': 'background', 'scene': scene, 'job_id': str(job_id) if job_id else None})
+    if sprite_atlas is not None:
+        if _job_id(sprite_atlas):
+            pending.append({'kind': 'sprite_atlas', 'job_id': _job_id(sprite_atlas)})
+        else:
+            ready.append({'kind': 'sprite_atlas'})
+    return {'ready': ready, 'pending': pending}
+
+# Deadline for waiting on a job: now + limit if it should finish by then, else None (an image
+# that takes far longer is not worth holding the response for)
+def _deadline(job, limit):
+    if job.status in (ImageJob.STATUS_DONE, ImageJob.STATUS_FAILED):
+        return time.monotonic()
+    remaining = expected_remaining(job)
+    if remaining is None or remaining > limit:
+        metrics.incr('new_game_waits_skipped')
+        return None
+    return time.monotonic() + limit
+
+# Start background and sprite atlas for the response, waited on if they are about to finish:
+# (start_background, sprite_atlas, assets). A background still pending comes back as the
+# placeholder plus its job id, as from /api/generate_background/.
+def first_screen(game, level_content, graph, level_summary, sprite_atlas, started):
+    level_number = level_content.get('level_number', 1)
+    start_scene = scene_for_node(level_content, graph, graph['start_node'])
+    background = known_background(game, level_number, start_scene) if start_scene else None
+    limits = {}
+    job = None
+    if start_scene and background is None:
+        # Joins the job queued while the level streamed
+        job = enqueue_background(game, level_number, level_summary, start_scene)
+        limits[str(job.pk)] = settings.NEW_GAME_BACKGROUND_DEADLINE
+    if _job_id(sprite_atlas):
+        limits[_job_id(sprite_atlas)] = settings.NEW_GAME_SPRITES_DEADLINE
+    deadlines = {}
+    for pending in ImageJob.objects.filter(pk__in=list(limits)):
+        deadline = _deadline(pending, limits[str(pending.pk)])
+        if deadline is not None:
+            deadlines[str(pending.pk)] = deadline
+    with metrics.timed('new_game_wait'):
+        finished = wait_for_jobs(deadlines)
+    atlas_job = finished.get(_job_id(sprite_atlas)) if _job_id(sprite_atlas) else None
+    if atlas_job is not None:
+        if atlas_job.status == ImageJob.STATUS_DONE and atlas_job.result:
+            sprite_atlas = atlas_job.result
+        else:
+            sprite_atlas = dict(sprite_atlas, status=atlas_job.status)
+    status = asset_status(game, level_number, graph, sprite_atlas)
+    if job is not None:
+        # Read after the listing so both agree on whether the start scene is ready
+        background = cached_background(game, level_number, start_scene)
+        if background is None:
+            job = finished.get(str(job.pk), job)
+            background = placeholder_background(level_number, start_scene)
+            background.update({'job_id': str(job.pk), 'status': job.status})
+    metrics.incr('new_game_assets_ready', len(status['ready']))
+    metrics.incr('new_game_assets_pending', len(status['pending']))
+    metrics.observe_stage('new_game_first_screen', time.monotonic() - started)
+    return background, sprite_atlas, status
+
+def stats():
+    return {
+        'early_backgrounds': metrics.get('new_game_early_backgrounds'),
+        'assets_ready': metrics.get('new_game_assets_ready'),
+        'assets_pending': metrics.get('new_game_assets_pending'),
+        'waits_skipped': metrics.get('new_game_waits_skipped'),
+    }
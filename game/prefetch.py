@@ -0,0 +1,155 @@
+# game/prefetch.py
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.db import close_old_connections
+from . import level_graph, metrics
+from .models import Game, LevelData, PrefetchedLevel
+from .story import digest_with_level, load_story_digest, reached_node
+from .utils import generate_level_content
+
+_executor = None
+_lock = threading.Lock()
+# (game_id, level_number, path_key) -> Future for generations still running
+_inflight = {}
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PREFETCH_MAX_WORKERS,
+                thread_name_prefix='prefetch'
+            )
+        return _executor
+
+# Prefetches are keyed by the node a level ends on rather than the whole choices_path: the
+# next level's prompt is built mostly from that outcome, and a level has far fewer endings
+# than root-to-leaf paths, so predicting the ending is what makes a hit likely.
+def outcome_key(level_content, choices_path):
+    ending = reached_node(level_content, choices_path)
+    node_id = ending.get('id') if ending else None
+    return hashlib.sha1(json.dumps(str(node_id)).encode('utf-8')).hexdigest()
+
+# Walk the dialogue tree from start_node and return choice paths to up to `limit` distinct
+# endings, one path each. The first listed choice is treated as the most likely one, so the
+# main branch comes first.
+def candidate_paths(level_content, limit, graph=None):
+    if graph is None:
+        graph = {'index': {str(n.get('id')): i for i, n in enumerate(level_content.get('dialogue_nodes', []))}}
+    paths = {}
+
+    def walk(node_id, path, seen):
+        if len(paths) >= limit:
+            return
+        node = level_graph.node(level_content, graph, node_id)
+        choices = (node or {}).get('choices') or []
+        if node is None or not choices or str(node_id) in seen:
+            paths.setdefault(outcome_key(level_content, path), path)
+            return
+        for choice in choices:
+            walk(
+                choice.get('next_id'),
+                path + [{'node_id': node.get('id'), 'choice_text': choice.get('text')}],
+                seen | {str(node_id)}
+            )
+            if len(paths) >= limit:
+                return
+
+    if limit > 0:
+        walk(level_content.get('start_node'), [], frozenset())
+    return list(paths.values())
+
+def _generate(game_id, outline, story_digest, level_number, key):
+    try:
+        content = generate_level_content(outline, story_digest, level_number)
+        # Only keep the result if the player has not moved past this level meanwhile
+        if Game.objects.filter(pk=game_id, current_level=level_number - 1).exists():
+            PrefetchedLevel.objects.get_or_create(
+                game_id=game_id, level_number=level_number, path_key=key,
+                defaults={'content': content}
+            )
+        metrics.incr('prefetch_generated')
+        return content
+    except Exception:
+        metrics.incr('prefetch_failed')
+        return None
+    finally:
+        with _lock:
+            _inflight.pop((str(game_id), level_number, key), None)
+        close_old_connections()
+
+# Start generating level+1 in the background for the most likely branches of the level just served
+def schedule_prefetch(game, level_content, level_number, graph=None):
+    next_level = level_number + 1
+    if not settings.PREFETCH_ENABLED or next_level > 10:
+        return
+    executor = _get_executor()
+    base_digest = load_story_digest(game)
+    for path in candidate_paths(level_content, settings.PREFETCH_MAX_BRANCHES, graph):
+        key = outcome_key(level_content, path)
+        inflight_key = (str(game.pk), next_level, key)
+        story_digest = digest_with_level(base_digest, level_number, path, level_content)
+        with _lock:
+            if inflight_key in _inflight:
+                continue
+            _inflight[inflight_key] = executor.submit(
+                _generate, game.pk, game.outline, story_digest, next_level, key
+            )
+        metrics.incr('prefetch_scheduled')
+
+# Return the pre-generated level for the ending the player's choices reached, or None on a
+# miss. Other speculative branches for that level are discarded.
+def claim_prefetched(game, level_number, choices_path):
+    if not settings.PREFETCH_ENABLED:
+        return None
+    finished = LevelData.objects.filter(game=game, level_number=level_number - 1).values_list(
+        'content', flat=True
+    ).first()
+    key = outcome_key(finished, choices_path)
+    content = None
+    with _lock:
+        future = _inflight.get((str(game.pk), level_number, key))
+        for other_key, other in list(_inflight.items()):
+            gid, lvl, _ = other_key
+            if gid == str(game.pk) and lvl == level_number and other is not future and other.cancel():
+                del _inflight[other_key]
+    if future is not None and future.cancel():
+        # Still queued behind other games' jobs: generating inline is faster than waiting
+        with _lock:
+            _inflight.pop((str(game.pk), level_number, key), None)
+        metrics.incr('prefetch_cancelled')
+    elif future is not None:
+        # Already running, so usually close to done; wait a bounded time, then fall back
+        try:
+            content = future.result(timeout=settings.PREFETCH_CLAIM_TIMEOUT)
+        except FutureTimeout:
+            metrics.incr('prefetch_claim_timeouts')
+    if content is None:
+        row = PrefetchedLevel.objects.filter(game=game, level_number=level_number, path_key=key).first()
+        content = row.content if row else None
+    PrefetchedLevel.objects.filter(game=game, level_number=level_number).delete()
+    metrics.incr('prefetch_hits' if content is not None else 'prefetch_misses')
+    return content
+
+# Drop prefetched rows up to level_number once the game has advanced to it. A sibling branch
+# that was already running when the level was claimed cannot be cancelled and may still have
+# stored its result after claim_prefetched cleared them.
+def discard(game, level_number):
+    PrefetchedLevel.objects.filter(game=game, level_number__lte=level_number).delete()
+
+def stats():
+    return {
+        'enabled': settings.PREFETCH_ENABLED,
+        'max_branches': settings.PREFETCH_MAX_BRANCHES,
+        'max_workers': settings.PREFETCH_MAX_WORKERS,
+        'hits': metrics.get('prefetch_hits'),
+        'misses': metrics.get('prefetch_misses'),
+        'scheduled': metrics.get('prefetch_scheduled'),
+        'generated': metrics.get('prefetch_generated'),
+        'failed': metrics.get('prefetch_failed'),
+        'cancelled': metrics.get('prefetch_cancelled'),
+        'claim_timeouts': metrics.get('prefetch_claim_timeouts'),
+    }
@@ -0,0 +1,46 @@
+# game/renderers.py
+# MessagePack for the API, negotiated with Accept / Content-Type: application/msgpack. Smaller
+# and faster to decode than JSON for level payloads.
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+MEDIA_TYPE = 'application/msgpack'
+
+# UUIDs, datetimes, decimals... encoded the way DRF's JSON encoder does
+_encoder = JSONEncoder()
+
+def packb(data):
+    return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+def unpackb(raw):
+    return msgpack.unpackb(raw, raw=False)
+
+# For the plain Django (async) views, which do their own negotiation
+def accepts_msgpack(request):
+    return MEDIA_TYPE in request.headers.get('Accept', '')
+
+def is_msgpack(request):
+    return request.content_type == MEDIA_TYPE
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data)
+
+class MessagePackParser(BaseParser):
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return unpackb(stream.read())
+        except Exception as e:
+            raise ParseError(f'MessagePack parse error - {e}')
@@ -0,0 +1,184 @@
+# game/schemas.py
+# JSON-schema contracts for model output, a small local validator and repair helpers
+# that turn partial or slightly broken output into something playable without another LLM call.
+
+CHOICE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'text': {'type': 'string'},
+        'next_id': {'type': 'string'},
+    },
+    'required': ['text', 'next_id'],
+    'additionalProperties': False,
+}
+
+NODE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'string'},
+        'speaker': {'type': 'string'},
+        'text': {'type': 'string'},
+        'scene_description': {'type': 'string'},
+        'choices': {'type': 'array', 'items': CHOICE_SCHEMA},
+    },
+    'required': ['id', 'speaker', 'text', 'scene_description', 'choices'],
+    'additionalProperties': False,
+}
+
+LEVEL_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'level_number': {'type': 'integer'},
+        'role': {'type': 'string'},
+        'start_node': {'type': 'string'},
+        'dialogue_nodes': {'type': 'array', 'items': NODE_SCHEMA},
+    },
+    'required': ['level_number', 'role', 'start_node', 'dialogue_nodes'],
+    'additionalProperties': False,
+}
+
+CHARACTER_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'description': {'type': 'string'},
+    },
+    'required': ['name', 'description'],
+    'additionalProperties': False,
+}
+
+OUTLINE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'levels': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'level_number': {'type': 'integer'},
+                    'role': {'type': 'string', 'enum': ['detective', 'journalist']},
+                    'summary': {'type': 'string'},
+                    'key_characters': {'type': 'array', 'items': CHARACTER_SCHEMA},
+                },
+                'required': ['level_number', 'role', 'summary', 'key_characters'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['levels'],
+    'additionalProperties': False,
+}
+
+IMAGE_PROMPT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'prompt': {'type': 'string'},
+        'image_name': {'type': 'string'},
+    },
+    'required': ['prompt', 'image_name'],
+    'additionalProperties': False,
+}
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'integer': int,
+    'number': (int, float),
+    'boolean': bool,
+}
+
+# Validate instance against the subset of JSON schema used above; returns a list of error strings
+def validate(instance, schema, path='$'):
+    expected = _TYPES[schema['type']]
+    if not isinstance(instance, expected) or (schema['type'] == 'integer' and isinstance(instance, bool)):
+        return [f"{path}: expected {schema['type']}"]
+    errors = []
+    if 'enum' in schema and instance not in schema['enum']:
+        errors.append(f"{path}: {instance!r} not in {schema['enum']}")
+    if schema['type'] == 'object':
+        for key in schema.get('required', []):
+            if key not in instance:
+                errors.append(f"{path}: missing '{key}'")
+        for key, sub in schema.get('properties', {}).items():
+            if key in instance:
+                errors.extend(validate(instance[key], sub, f"{path}.{key}"))
+    elif schema['type'] == 'array':
+        for i, item in enumerate(instance):
+            errors.extend(validate(item, schema['items'], f"{path}[{i}]"))
+    return errors
+
+def fill_node_text(node):
+    if not node.get('text') or not str(node['text']).strip():
+        desc = str(node.get('scene_description') or '').strip()
+        node['text'] = desc or "..."
+    return node
+
+# Make a level playable: string ids, no duplicate ids, no dangling next_ids, a valid start_node.
+# Returns (level, repairs) where repairs lists what had to be fixed; raises ValueError if no node survives.
+def repair_level(level, level_number, role):
+    repairs = []
+    if not isinstance(level, dict):
+        raise ValueError(f"Level {level_number}: expected an object")
+    level.setdefault('level_number', level_number)
+    level.setdefault('role', role)
+    nodes = []
+    seen = set()
+    for node in level.get('dialogue_nodes') or []:
+        if not isinstance(node, dict) or node.get('id') is None:
+            repairs.append('dropped malformed node')
+            continue
+        node['id'] = str(node['id'])
+        if node['id'] in seen:
+            repairs.append(f"dropped duplicate node {node['id']}")
+            continue
+        seen.add(node['id'])
+        node.setdefault('speaker', 'Narrator')
+        node.setdefault('scene_description', '')
+        fill_node_text(node)
+        nodes.append(node)
+    if not nodes:
+        raise ValueError(f"Level {level_number}: no usable dialogue nodes")
+    for node in nodes:
+        choices = []
+        for choice in node.get('choices') or []:
+            if not isinstance(choice, dict) or choice.get('next_id') is None:
+                repairs.append(f"dropped malformed choice in {node['id']}")
+                continue
+            choice['next_id'] = str(choice['next_id'])
+            if choice['next_id'] not in seen:
+                repairs.append(f"dropped dangling next_id {choice['next_id']} in {node['id']}")
+                continue
+            choice.setdefault('text', '...')
+            choices.append(choice)
+        node['choices'] = choices
+    start = level.get('start_node')
+    if start is None or str(start) not in seen:
+        # Prefer a node nothing points at (the tree root), else the first node
+        targets = {c['next_id'] for n in nodes for c in n['choices']}
+        start = next((n['id'] for n in nodes if n['id'] not in targets), nodes[0]['id'])
+        repairs.append(f"set start_node to {start}")
+    level['start_node'] = str(start)
+    level['dialogue_nodes'] = nodes
+    return level, repairs
+
+# Fill in missing outline fields; returns (outline, repairs)
+def repair_outline(outline):
+    repairs = []
+    if not isinstance(outline, dict) or not isinstance(outline.get('levels'), list) or not outline['levels']:
+        raise ValueError("Outline has no levels")
+    levels = []
+    for i, lvl in enumerate(outline['levels']):
+        if not isinstance(lvl, dict):
+            repairs.append('dropped malformed level')
+            continue
+        if not isinstance(lvl.get('level_number'), int):
+            lvl['level_number'] = i + 1
+            repairs.append(f"set level_number {i + 1}")
+        if lvl.get('role') not in ('detective', 'journalist'):
+            lvl['role'] = 'detective' if lvl['level_number'] % 2 else 'journalist'
+            repairs.append(f"set role for level {lvl['level_number']}")
+        lvl.setdefault('summary', '')
+        levels.append(lvl)
+    outline['levels'] = levels
+    return outline, repairs
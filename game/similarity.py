@@ -0,0 +1,109 @@
+# game/similarity.py
+# Local TF-IDF index over scene descriptions of stored backgrounds, used to reuse a background
+# for near-identical scenes ("dimly lit office at night" / "the detective's office, night").
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from django.conf import settings
+from .models import Asset
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'at', 'in', 'on', 'with', 'and', 'to', 'by', 'for', 'from', 'into',
+    'is', 'are', 'his', 'her', 'their', 'its', 'scene', 'background', 'view', 'inside', 'interior',
+}
+
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", (text or '').lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        # Crude stemming so plurals/possessives line up: "offices" -> "office"
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+# Assets stored by other processes are picked up every SCENE_INDEX_REFRESH_SECONDS (rows with
+# a higher pk than any seen); assets they delete drop out when a match no longer resolves
+# (game/assets.py). Document vectors are cached until the document frequencies change.
+class SceneIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}  # asset key -> Counter of tokens
+        self._df = Counter()
+        self._postings = defaultdict(set)  # token -> asset keys containing it
+        self._vectors = {}  # asset key -> normalized TF-IDF vector for the current _df
+        self._max_pk = 0
+        self._refreshed_at = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._refreshed_at is not None and now - self._refreshed_at < settings.SCENE_INDEX_REFRESH_SECONDS:
+            return
+        rows = Asset.objects.filter(kind=Asset.KIND_BACKGROUND, pk__gt=self._max_pk).values_list(
+            'pk', 'key', 'description'
+        )
+        for pk, key, description in rows:
+            self._add(key, description)
+            self._max_pk = max(self._max_pk, pk)
+        self._refreshed_at = now
+
+    def _add(self, key, text):
+        tokens = Counter(tokenize(text))
+        if self._docs.get(key) == tokens:
+            return
+        if key in self._docs:
+            self._remove(key)
+        if not tokens:
+            return
+        self._docs[key] = tokens
+        self._df.update(tokens.keys())
+        for token in tokens:
+            self._postings[token].add(key)
+        self._vectors.clear()
+
+    def _remove(self, key):
+        tokens = self._docs.pop(key, None)
+        if tokens:
+            self._df.subtract(tokens.keys())
+            for token in tokens:
+                self._postings[token].discard(key)
+            self._vectors.clear()
+
+    def add(self, key, text):
+        with self._lock:
+            self._add(key, text)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _vector(self, tokens, n_docs):
+        vec = {t: (1 + math.log(c)) * (math.log((1 + n_docs) / (1 + self._df.get(t, 0))) + 1)
+               for t, c in tokens.items()}
+        norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+        return {t: w / norm for t, w in vec.items()}
+
+    # Return (asset key, cosine similarity) of the closest stored scene, or (None, 0.0)
+    def best_match(self, text):
+        query = Counter(tokenize(text))
+        with self._lock:
+            self._refresh()
+            if not query or not self._docs:
+                return None, 0.0
+            n_docs = len(self._docs)
+            qvec = self._vector(query, n_docs)
+            candidates = set().union(*(self._postings.get(t, ()) for t in qvec))
+            best_key, best_score = None, 0.0
+            for key in candidates:
+                dvec = self._vectors.get(key)
+                if dvec is None:
+                    dvec = self._vectors[key] = self._vector(self._docs[key], n_docs)
+                score = sum(w * dvec.get(t, 0.0) for t, w in qvec.items())
+                if score > best_score:
+                    best_key, best_score = key, score
+            return best_key, best_score
+
+scene_index = SceneIndex()
@@ -0,0 +1,224 @@
+# game/singleflight.py
+# Single-flight execution of expensive generations, keyed by asset key. Within a process,
+# concurrent callers for a key wait on the one running call. Across processes, a
+# GenerationLock row marks the key as in flight: other workers wait for the row to go away
+# and then read the stored result (lookup) instead of generating it a second time. The row
+# expires after SINGLEFLIGHT_LOCK_TTL if its holder dies; a live holder keeps renewing it for
+# as long as its generation runs.
+import asyncio
+import os
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from . import metrics
+from .models import GenerationLock
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_lock = threading.Lock()
+# key -> _Call for generations running in this process
+_inflight = {}
+# event loop -> {key: Future} for the async variant
+_ainflight = weakref.WeakKeyDictionary()
+
+# Take the cross-process lock for key; returns an owner token, or None if another worker holds it
+def acquire(key):
+    now = timezone.now()
+    # A lock whose holder died is taken over once it expires
+    GenerationLock.objects.filter(key=key, expires_at__lt=now).delete()
+    token = f'{os.getpid()}:{uuid.uuid4().hex[:12]}'
+    try:
+        with transaction.atomic():
+            GenerationLock.objects.create(
+                key=key, owner=token, expires_at=now + timedelta(seconds=settings.SINGLEFLIGHT_LOCK_TTL)
+            )
+    except IntegrityError:
+        return None
+    return token
+
+# Extend the lease of a lock we hold; False if it expired and was taken over
+def renew(key, token):
+    expires_at = timezone.now() + timedelta(seconds=settings.SINGLEFLIGHT_LOCK_TTL)
+    renewed = GenerationLock.objects.filter(key=key, owner=token).update(expires_at=expires_at) > 0
+    metrics.incr('singleflight_renewals' if renewed else 'singleflight_leases_lost')
+    return renewed
+
+def _renew_interval():
+    return max(settings.SINGLEFLIGHT_LOCK_TTL / 3, settings.SINGLEFLIGHT_POLL_INTERVAL)
+
+# Renew the lease on a background thread while the body runs
+@contextmanager
+def _leased(key, token):
+    stop = threading.Event()
+
+    def heartbeat():
+        try:
+            while not stop.wait(_renew_interval()):
+                renew(key, token)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=heartbeat, name='singleflight-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+async def _aheartbeat(key, token):
+    while True:
+        await asyncio.sleep(_renew_interval())
+        await sync_to_async(renew)(key, token)
+
+def release(key, token):
+    GenerationLock.objects.filter(key=key, owner=token).delete()
+
+def held(key):
+    return GenerationLock.objects.filter(key=key, expires_at__gte=timezone.now()).exists()
+
+# Hold the cross-process lock around a short critical section, waiting for it if needed
+@contextmanager
+def exclusive(key):
+    token = acquire(key)
+    while token is None:
+        time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+        token = acquire(key)
+    try:
+        yield
+    finally:
+        release(key, token)
+
+def _wait_remote(key):
+    deadline = time.monotonic() + settings.SINGLEFLIGHT_LOCK_TTL
+    while held(key) and time.monotonic() < deadline:
+        time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+
+def _run_exclusive(key, produce, lookup):
+    while True:
+        token = acquire(key)
+        if token is not None:
+            try:
+                # Another worker may have finished between the caller's lookup and this lock
+                result = lookup() if lookup else None
+                if result is not None:
+                    metrics.incr('singleflight_late_hits')
+                    return result
+                metrics.incr('singleflight_leaders')
+                with _leased(key, token):
+                    return produce()
+            finally:
+                release(key, token)
+        metrics.incr('singleflight_coalesced_remote')
+        _wait_remote(key)
+        result = lookup() if lookup else None
+        if result is not None:
+            return result
+        # The other worker failed or stored nothing: try to take over
+
+# Result of produce() for key, computed once however many callers ask for it concurrently.
+# Waiters get lookup() (the stored result, seen from their own request) or else the leader's
+# result; a leader's exception is raised to the waiters in its process too.
+def run(key, produce, lookup=None):
+    with _lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+    if not leader:
+        metrics.incr('singleflight_coalesced_local')
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return (lookup() if lookup else None) or call.result
+    try:
+        call.result = _run_exclusive(key, produce, lookup)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+async def _arun_exclusive(key, produce, lookup):
+    while True:
+        token = await sync_to_async(acquire)(key)
+        if token is not None:
+            try:
+                result = await lookup() if lookup else None
+                if result is not None:
+                    metrics.incr('singleflight_late_hits')
+                    return result
+                metrics.incr('singleflight_leaders')
+                heartbeat = asyncio.create_task(_aheartbeat(key, token))
+                try:
+                    return await produce()
+                finally:
+                    heartbeat.cancel()
+            finally:
+                await sync_to_async(release)(key, token)
+        metrics.incr('singleflight_coalesced_remote')
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LOCK_TTL
+        while await sync_to_async(held)(key) and time.monotonic() < deadline:
+            await asyncio.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+        result = await lookup() if lookup else None
+        if result is not None:
+            return result
+
+# Async variant of run(): produce and lookup are coroutine functions. If the leader is
+# cancelled (its client went away), its waiters take over instead of waiting forever.
+async def arun(key, produce, lookup=None):
+    loop = asyncio.get_running_loop()
+    inflight = _ainflight.setdefault(loop, {})
+    future = inflight.get(key)
+    while future is not None:
+        metrics.incr('singleflight_coalesced_local')
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled() or asyncio.current_task().cancelling():
+                raise
+            future = inflight.get(key)
+            continue
+        return (await lookup() if lookup else None) or result
+    future = inflight[key] = loop.create_future()
+    try:
+        result = await _arun_exclusive(key, produce, lookup)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        # Retrieved here so that a flight nobody joined does not log "never retrieved"
+        future.exception()
+        raise
+    finally:
+        inflight.pop(key, None)
+        if not future.done():
+            future.cancel()
+
+def stats():
+    return {
+        'leaders': metrics.get('singleflight_leaders'),
+        'coalesced_local': metrics.get('singleflight_coalesced_local'),
+        'coalesced_remote': metrics.get('singleflight_coalesced_remote'),
+        'late_hits': metrics.get('singleflight_late_hits'),
+        'renewals': metrics.get('singleflight_renewals'),
+        'leases_lost': metrics.get('singleflight_leases_lost'),
+        'locks_held': GenerationLock.objects.filter(expires_at__gte=timezone.now()).count(),
+    }
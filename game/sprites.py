@@ -0,0 +1,137 @@
+# game/sprites.py
+# Character sprite atlases. All key characters of a game's outline are generated in one
+# background job (each sprite is reused from the asset store per character identity) and
+# packed into a single sheet with a Phaser/TexturePacker "JSON hash" frame manifest, so the
+# client loads every character with one image request.
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from django.conf import settings
+from django.db import close_old_connections
+from . import assets, imaging, metrics, singleflight
+from .models import Asset, SpriteAtlas
+from .utils import default_sprite_prompt, generate_and_save_image, image_sizes
+
+# Distinct key characters of the outline, in order of first appearance: [(name, description)]
+def game_characters(outline):
+    characters = {}
+    for level in outline.get('levels', []):
+        for character in level.get('key_characters') or []:
+            name = (character.get('name') or '').strip()
+            if name and assets.normalize(name) not in characters:
+                characters[assets.normalize(name)] = (name, (character.get('description') or '').strip())
+    return list(characters.values())[:settings.SPRITE_ATLAS_MAX_CHARACTERS]
+
+# The atlas is identified by the set of character identities it packs, in any order
+def atlas_key(characters):
+    sprite_keys = sorted(assets.sprite_key(name, description) for name, description in characters)
+    return assets.asset_key(Asset.KIND_ATLAS, *sprite_keys)
+
+# Stored sprite for a character, generated if no game has needed it before
+# (once, even when an atlas build and /api/generate_sprite/ ask for it at the same time)
+def ensure_sprite(name, description):
+    key = assets.sprite_key(name, description)
+    asset = assets.lookup(key)
+    if asset is not None:
+        metrics.incr('sprite_atlas_sprites_reused')
+        return asset
+
+    def produce():
+        prompt = default_sprite_prompt(name, description)
+        image_name = assets.asset_image_name(Asset.KIND_SPRITE, key)
+        success, err = generate_and_save_image(prompt, image_name, is_background=False)
+        if not success:
+            raise RuntimeError(f"Sprite gen failed for {name}: {err}")
+        metrics.incr('sprite_atlas_sprites_generated')
+        return assets.store(key, Asset.KIND_SPRITE, f"{name}: {description}", prompt, image_name)
+
+    return singleflight.run(key, produce, lambda: assets.lookup(key))
+
+# (asset, None) or (None, error) so one failed character does not sink the whole atlas
+def _ensure_sprite(character):
+    try:
+        return ensure_sprite(*character), None
+    except Exception as e:
+        metrics.record_error('sprite_atlas_sprite', e)
+        return None, e
+    finally:
+        close_old_connections()
+
+# Pack equally sized sprites into a near-square grid; returns (sheet, frames)
+def pack(sprites):
+    cell_w, cell_h = image_sizes(False)[1]
+    cols = max(1, math.ceil(math.sqrt(len(sprites))))
+    rows = max(1, math.ceil(len(sprites) / cols))
+    sheet = Image.new('RGBA', (cols * cell_w, rows * cell_h), (0, 0, 0, 0))
+    frames = {}
+    for i, (frame_name, path) in enumerate(sprites):
+        x, y = (i % cols) * cell_w, (i // cols) * cell_h
+        with Image.open(path) as img:
+            sheet.paste(img.convert('RGBA').resize((cell_w, cell_h), Image.NEAREST), (x, y))
+        frames[frame_name] = {
+            'frame': {'x': x, 'y': y, 'w': cell_w, 'h': cell_h},
+            'rotated': False,
+            'trimmed': False,
+            'spriteSourceSize': {'x': 0, 'y': 0, 'w': cell_w, 'h': cell_h},
+            'sourceSize': {'w': cell_w, 'h': cell_h},
+        }
+    return sheet, frames
+
+# Stored atlas for key (recording a reference from game), or None
+def lookup_atlas(key, game=None):
+    asset = assets.lookup(key, game)
+    if asset is None:
+        return None
+    return SpriteAtlas.objects.select_related('asset').filter(asset=asset).first()
+
+# Generate missing sprites (concurrently), pack them and store the sheet plus manifest.
+# Characters whose sprite failed are left out and listed under 'missing' in the manifest; the
+# sheet is then stored under the key of the characters it does contain, so the next game with
+# the full cast retries them. Raises only when no sprite could be generated at all.
+def build_atlas(characters, game=None):
+    key = atlas_key(characters)
+    atlas = lookup_atlas(key, game)
+    if atlas is not None:
+        return atlas
+    with ThreadPoolExecutor(max_workers=settings.SPRITE_ATLAS_WORKERS, thread_name_prefix='sprite') as pool:
+        results = list(pool.map(_ensure_sprite, characters))
+    packed = [(character, asset) for character, (asset, _) in zip(characters, results) if asset is not None]
+    missing = [name for (name, _), (asset, _) in zip(characters, results) if asset is None]
+    if not packed:
+        raise RuntimeError(f"No sprite could be generated: {results[0][1]}")
+    if missing:
+        metrics.incr('sprite_atlas_partial')
+        characters = [character for character, _ in packed]
+        key = atlas_key(characters)
+    sheet, frames = pack([
+        (name, os.path.join(assets.images_dir(), asset.image_name))
+        for (name, _), asset in packed
+    ])
+    image_name = assets.asset_image_name(Asset.KIND_ATLAS, key)
+    # Each sprite is already quantized; keep the union of their palettes
+    sheet = imaging.quantize(sheet, min(256, settings.IMAGE_PALETTE_COLORS * len(characters) + 1), dither=False)
+    formats = ['png', 'webp'] if imaging.webp_enabled() else ['png']
+    for fmt in formats:
+        imaging.write_image(sheet, os.path.join(assets.images_dir(), imaging.variant_name(image_name, ext=fmt)), fmt)
+    asset = assets.store(key, Asset.KIND_ATLAS, ', '.join(name for name, _ in characters), None, image_name, game)
+    manifest = {
+        'frames': frames,
+        'meta': {'image': image_name, 'size': {'w': sheet.width, 'h': sheet.height}, 'scale': '1'},
+        'characters': {name: name for name, _ in characters},
+        'missing': missing,
+    }
+    atlas, _ = SpriteAtlas.objects.update_or_create(asset=asset, defaults={'manifest': manifest})
+    metrics.incr('sprite_atlases_built')
+    return atlas
+
+def atlas_payload(atlas):
+    payload = assets.asset_payload(atlas.asset)
+    manifest = dict(atlas.manifest, meta=dict(atlas.manifest.get('meta', {}), image=payload['url']))
+    return {
+        'atlas_key': atlas.asset.key,
+        'url': payload['url'],
+        'variants': payload['variants'],
+        'manifest': manifest,
+        'missing': atlas.manifest.get('missing', []),
+    }
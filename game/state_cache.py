@@ -0,0 +1,112 @@
+# game/state_cache.py
+# Hot game state on Django's cache framework (local memory by default, see CACHES).
+# A pointer key holds the game's current version (its level); the state itself is stored
+# under game id + version, so advancing a level never serves the previous snapshot.
+# The version pointer must be seen by every worker, so several workers require a shared
+# backend (Redis, Memcached): with local memory, a worker that did not serve the level change
+# keeps answering from its old snapshot. `manage.py check --deploy` warns (game/checks.py).
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from . import metrics
+from .models import Game, LevelData
+from .story import load_story_digest
+
+def _cache():
+    return caches[settings.GAME_STATE_CACHE_ALIAS]
+
+def _version_key(game_id):
+    return f'game:{game_id}:version'
+
+def _state_key(game_id, version):
+    return f'game:{game_id}:v{version}'
+
+def _scene_key(game_id, scene_key):
+    return f'game:{game_id}:scene:{scene_key}'
+
+# Snapshot used by read-only endpoints: outline, level, digest, current level content and graph
+def build_state(game, level_content=None, graph=None):
+    if level_content is None:
+        level = LevelData.objects.filter(game=game, level_number=game.current_level).first()
+        level_content = level.content if level else None
+        graph = level.graph if level else None
+    return {
+        'id': str(game.pk),
+        'outline': game.outline,
+        'current_level': game.current_level,
+        'story_digest': load_story_digest(game),
+        'level_content': level_content,
+        'level_graph': graph,
+    }
+
+def put_state(state):
+    cache = _cache()
+    timeout = settings.GAME_STATE_CACHE_TIMEOUT
+    cache.set(_state_key(state['id'], state['current_level']), state, timeout)
+    cache.set(_version_key(state['id']), state['current_level'], timeout)
+
+# Read-through: cached snapshot, or load it from the DB; None if the game does not exist
+def get_state(game_id):
+    cache = _cache()
+    version = cache.get(_version_key(game_id))
+    if version is not None:
+        state = cache.get(_state_key(game_id, version))
+        if state is not None:
+            metrics.incr('game_state_cache_hits')
+            return state
+    metrics.incr('game_state_cache_misses')
+    try:
+        game = Game.objects.get(pk=game_id)
+    except (Game.DoesNotExist, ValidationError):
+        return None
+    state = build_state(game)
+    put_state(state)
+    return state
+
+# Write-through after the game advanced to a new level
+def store_game(game, level_content, graph=None):
+    state = build_state(game, level_content, graph)
+    put_state(state)
+    return state
+
+def invalidate(game_id):
+    _cache().delete(_version_key(game_id))
+
+# Game as if loaded with .only('id', 'outline', 'current_level'), without the query: a saved
+# instance for foreign keys and prompt building. Other fields load on access, and save() would
+# only write these three, never the rest of the row.
+def game_from_state(state):
+    return Game.from_db(
+        DEFAULT_DB_ALIAS, ['id', 'outline', 'current_level'],
+        [uuid.UUID(state['id']), state['outline'], state['current_level']]
+    )
+
+def get_scene(game_id, scene_key):
+    payload = _cache().get(_scene_key(game_id, scene_key))
+    metrics.incr('scene_cache_hits' if payload is not None else 'scene_cache_misses')
+    return payload
+
+def put_scene(game_id, scene_key, payload):
+    _cache().set(_scene_key(game_id, scene_key), payload, settings.GAME_STATE_CACHE_TIMEOUT)
+
+# Forget cached scenes, given as (game_id, scene_key) pairs
+def drop_scenes(pairs):
+    _cache().delete_many([_scene_key(game_id, scene_key) for game_id, scene_key in pairs])
+
+def _rate(hits, misses):
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+def stats():
+    hits, misses = metrics.get('game_state_cache_hits'), metrics.get('game_state_cache_misses')
+    scene_hits, scene_misses = metrics.get('scene_cache_hits'), metrics.get('scene_cache_misses')
+    return {
+        'backend': settings.CACHES[settings.GAME_STATE_CACHE_ALIAS]['BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': _rate(hits, misses),
+        'scene_hits': scene_hits,
+        'scene_misses': scene_misses,
+        'scene_hit_rate': _rate(scene_hits, scene_misses),
+    }
@@ -0,0 +1,114 @@
+# game/story.py
+# Rolling story-state compaction. After every level the game keeps a short digest entry
+# (choices made and where they led) instead of replaying the full outline and choice
+# history to the model, so prompt size stays roughly flat across the campaign.
+import json
+from django.conf import settings
+from . import metrics
+from .models import ChoiceEvent
+
+MAX_CHOICE_CHARS = 80
+MAX_OUTCOME_CHARS = 240
+MAX_OLD_OUTCOME_CHARS = 100
+
+def _clip(text, limit):
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+# Node a choices_path ends on: the target of its last choice, or the node that choice was
+# made on if it is not in the level; None for an empty path
+def reached_node(level_content, choices_path):
+    if not choices_path:
+        return None
+    nodes = {str(n.get('id')): n for n in (level_content or {}).get('dialogue_nodes', [])}
+    last = choices_path[-1]
+    node = nodes.get(str(last.get('node_id'))) or {}
+    choice = next((c for c in node.get('choices') or [] if c.get('text') == last.get('choice_text')), None)
+    reached = nodes.get(str(choice.get('next_id'))) if choice else None
+    return reached or node
+
+# Digest entry for a finished level: the choices taken and the text of the node they led to
+def digest_entry(level_number, role, level_content, choices_path):
+    choices = [_clip(step.get('choice_text'), MAX_CHOICE_CHARS) for step in choices_path or []]
+    outcome = (reached_node(level_content, choices_path) or {}).get('text', '')
+    return {
+        'level': level_number,
+        'role': role,
+        'choices': choices,
+        'outcome': _clip(outcome, MAX_OUTCOME_CHARS),
+    }
+
+# Record a finished level in the game's choice log. It is written before the next level is
+# generated (whose prompt needs it), so a transition retried after a failed generation
+# rewrites the level's row instead of adding another one
+def record_level_outcome(game, level_number, choices_path, level_content):
+    role = (level_content or {}).get('role', '')
+    entry = digest_entry(level_number, role, level_content, choices_path)
+    ChoiceEvent.objects.update_or_create(
+        game=game, level_number=level_number, defaults={'path': choices_path or [], 'digest': entry}
+    )
+    return entry
+
+# The game's digest, read from the choice log in level order
+def load_story_digest(game):
+    return list(ChoiceEvent.objects.filter(game=game).order_by('level_number').values_list('digest', flat=True))
+
+# Digest including an entry for a level that is finished but not recorded yet (e.g. for the headline)
+def digest_with_level(story_digest, level_number, choices_path, level_content):
+    role = (level_content or {}).get('role', '')
+    entry = digest_entry(level_number, role, level_content, choices_path)
+    return [e for e in story_digest or [] if e.get('level') != level_number] + [entry]
+
+# Compact prompt context: outline entries around the current level and the digest, with
+# levels older than STORY_DIGEST_RECENT_LEVELS reduced to a one-line outcome
+def prompt_context(outline, story_digest, level_number):
+    window = range(level_number - 1, level_number + 2)
+    levels = [lvl for lvl in outline.get('levels', []) if lvl.get('level_number') in window]
+    recent = settings.STORY_DIGEST_RECENT_LEVELS
+    digest = sorted(story_digest or [], key=lambda e: e.get('level', 0))
+    if recent > 0:
+        older, latest = digest[:-recent], digest[-recent:]
+    else:
+        older, latest = digest, []
+    return {
+        'outline': {'levels': levels, 'total_levels': len(outline.get('levels', []))},
+        'earlier_levels': [
+            {'level': e.get('level'), 'outcome': _clip(e.get('outcome'), MAX_OLD_OUTCOME_CHARS)} for e in older
+        ],
+        'recent_levels': latest,
+        'current_level': level_number,
+    }
+
+_encoding = {}
+
+# Prompt size in tokens; exact with tiktoken installed, otherwise ~4 characters per token
+def count_tokens(messages):
+    if 'enc' not in _encoding:
+        try:
+            import tiktoken
+            _encoding['enc'] = tiktoken.encoding_for_model('gpt-4')
+        except Exception:
+            _encoding['enc'] = None
+    enc = _encoding['enc']
+    total = 0
+    for message in messages:
+        content = message.get('content') or ''
+        total += 4 + (len(enc.encode(content)) if enc else len(content) // 4)
+    return total + 2
+
+def record_prompt_tokens(purpose, messages, level_number=None, usage=None):
+    tokens = getattr(usage, 'prompt_tokens', None) or count_tokens(messages)
+    metrics.record_tokens(purpose, tokens, getattr(usage, 'completion_tokens', None))
+    metrics.observe(f'prompt_tokens_{purpose}', tokens)
+    if level_number is not None:
+        metrics.observe(f'prompt_tokens_{purpose}_level_{level_number}', tokens)
+    return tokens
+
+def token_report():
+    return {
+        name: {k: round(v, 1) for k, v in obs.items()}
+        for name, obs in metrics.observations('prompt_tokens_').items()
+    }
+
+def context_json(outline, story_digest, level_number):
+    return json.dumps(prompt_context(outline, story_digest, level_number), ensure_ascii=False)
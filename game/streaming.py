@@ -0,0 +1,89 @@
+# game/streaming.py
+import json
+
+# Incremental parser for a level JSON object arriving in chunks.
+# Emits ('start_node', value) once the top-level start_node value is complete and
+# ('node', dict) for every complete entry of the top-level dialogue_nodes array.
+class IncrementalLevelParser:
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._key = None            # last top-level key seen
+        self._expect_value = False  # top-level ':' seen, value not finished yet
+        self._array_key = None      # top-level key whose array we are inside
+        self._node_start = None
+        self._scalar_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        value = json.loads(text[self._string_start:i + 1])
+                        if self._expect_value:
+                            self._expect_value = False
+                            if self._key == 'start_node':
+                                events.append(('start_node', value))
+                        else:
+                            self._key = value
+                continue
+            if self._depth == 0:
+                # Skip anything (e.g. code fences) before the top-level object
+                if c == '{':
+                    self._depth = 1
+                continue
+            if self._depth == 1 and self._scalar_start is not None and c in ',}':
+                # Non-string start_node value (e.g. a number) ends here
+                try:
+                    events.append(('start_node', json.loads(text[self._scalar_start:i].strip())))
+                except json.JSONDecodeError:
+                    pass
+                self._scalar_start = None
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                if self._depth == 1 and self._expect_value:
+                    self._array_key = self._key if c == '[' else None
+                    self._expect_value = False
+                self._depth += 1
+                if self._depth == 3 and c == '{' and self._array_key == 'dialogue_nodes':
+                    self._node_start = i
+            elif c in '}]':
+                if self._depth == 3 and c == '}' and self._node_start is not None:
+                    try:
+                        events.append(('node', json.loads(text[self._node_start:i + 1])))
+                    except json.JSONDecodeError:
+                        pass
+                    self._node_start = None
+                self._depth -= 1
+                if self._depth <= 1:
+                    self._array_key = None
+            elif self._depth == 1:
+                if c == ':':
+                    self._expect_value = True
+                elif c == ',':
+                    self._expect_value = False
+                elif self._expect_value and not c.isspace():
+                    self._expect_value = False
+                    if self._key == 'start_node':
+                        self._scalar_start = i
+        self._pos = len(text)
+        return events
+
+# Format one Server-Sent Events message
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,209 @@
+# game/stub_openai.py
+# Offline, OpenAI-compatible stand-in server for load tests and local development.
+# Serves canned outline/level/headline/image-prompt completions (streaming and non-streaming)
+# and generated PNGs, after a latency drawn from a configurable distribution.
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image
+
+SCENES = [
+    'detective office at night, rain on the window',
+    'smoky jazz club on 52nd street',
+    'newsroom full of clattering typewriters',
+    'rain-soaked alley behind the docks',
+    'police precinct interrogation room',
+    'penthouse overlooking Central Park',
+    'subway platform under flickering lights',
+]
+SPEAKERS = ['Narrator', 'Vera Lane', 'Lt. Malone', 'Eddie the Fence', 'Editor Hayes']
+
+# Parse a latency spec: "fixed:S", "uniform:A:B", "normal:MU:SIGMA" or "lognormal:MEDIAN:SIGMA" (seconds)
+def parse_latency(spec):
+    kind, *args = spec.split(':')
+    args = [float(a) for a in args]
+    if kind == 'fixed':
+        return lambda: args[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(args[0], args[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(args[0], args[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def canned_outline():
+    return {'levels': [
+        {
+            'level_number': n,
+            'role': 'detective' if n % 2 else 'journalist',
+            'summary': f"Level {n}: the trail of the missing singer leads deeper into the city's underworld.",
+            'key_characters': [
+                {'name': 'Vera Lane', 'description': 'jazz singer in a sequined dress'},
+                {'name': 'Lt. Malone', 'description': 'tired police lieutenant in a trench coat'},
+            ],
+        }
+        for n in range(1, 11)
+    ]}
+
+# Branching tree: n1 -> (n2|n3) -> (n4|n5) -> (n6|n7) -> n8
+def canned_level(level_number, role='detective'):
+    links = {
+        'n1': ['n2', 'n3'], 'n2': ['n4', 'n5'], 'n3': ['n4', 'n5'],
+        'n4': ['n6', 'n7'], 'n5': ['n6', 'n7'], 'n6': ['n8'], 'n7': ['n8'], 'n8': [],
+    }
+    nodes = []
+    for i, (node_id, targets) in enumerate(links.items()):
+        nodes.append({
+            'id': node_id,
+            'speaker': SPEAKERS[i % len(SPEAKERS)],
+            'text': f"Level {level_number}, beat {i + 1}. The city never sleeps, and neither do its secrets.",
+            'scene_description': SCENES[(level_number + i) % len(SCENES)],
+            'choices': [{'text': f"Option {j + 1}", 'next_id': t} for j, t in enumerate(targets)],
+        })
+    return {'level_number': level_number, 'role': role, 'start_node': 'n1', 'dialogue_nodes': nodes}
+
+def canned_reply(messages):
+    system = messages[0].get('content', '') if messages else ''
+    user = {}
+    if len(messages) > 1:
+        try:
+            user = json.loads(messages[1].get('content') or '{}')
+        except json.JSONDecodeError:
+            user = {}
+    if 'story designer' in system:
+        return json.dumps(canned_outline())
+    if 'narrative engine' in system:
+        # The role is only named in the instructions ("... for level N as role R.")
+        role = re.search(r"as role (\w+)", system)
+        return json.dumps(canned_level(user.get('current_level', 1), role.group(1) if role else 'detective'))
+    if 'headline' in system:
+        return '"CITY REELS AS DETECTIVE CRACKS THE CASE"'
+    name = user.get('node_context') or user.get('name') or 'scene'
+    return json.dumps({
+        'prompt': f"16-bit noir pixel art: {name}",
+        'image_name': f"stub_{uuid.uuid4().hex[:6]}.png",
+    })
+
+_png_cache = {}
+_png_lock = threading.Lock()
+
+def png_bytes(size):
+    with _png_lock:
+        if size not in _png_cache:
+            w, h = (int(x) for x in size.split('x'))
+            img = Image.effect_noise((w, h), 64).convert('RGBA')
+            buf = BytesIO()
+            img.save(buf, format='PNG')
+            _png_cache[size] = buf.getvalue()
+        return _png_cache[size]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Set by make_server
+    latency = {}
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, content_type='application/json', headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _maybe_rate_limit(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests'}},
+                       headers={'retry-after': '1'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.startswith('/images/'):
+            size = self.path.rsplit('/', 1)[-1].split('.')[0]
+            return self._send(200, png_bytes(size), content_type='image/png')
+        self._send(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path.endswith('/chat/completions'):
+            time.sleep(self.latency['chat']())
+            if self._maybe_rate_limit():
+                return
+            return self._chat(body)
+        if self.path.endswith('/images/generations'):
+            time.sleep(self.latency['image']())
+            if self._maybe_rate_limit():
+                return
+            return self._image(body)
+        self._send(404, {'error': {'message': 'not found'}})
+
+    def _chat(self, body):
+        content = canned_reply(body.get('messages') or [])
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get('model', 'gpt-4')
+        usage = {
+            'prompt_tokens': sum(len(m.get('content') or '') for m in body.get('messages') or []) // 4,
+            'completion_tokens': len(content) // 4,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not body.get('stream'):
+            return self._send(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk_size = 40
+        for i in range(0, len(content), chunk_size):
+            chunk = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': content[i:i + chunk_size]}, 'finish_reason': None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.latency['token']())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _image(self, body):
+        size = body.get('size') or '512x512'
+        if body.get('response_format') == 'b64_json':
+            item = {'b64_json': base64.b64encode(png_bytes(size)).decode('ascii')}
+        else:
+            host = self.headers.get('Host') or f"127.0.0.1:{self.server.server_address[1]}"
+            item = {'url': f"http://{host}/images/{size}.png"}
+        self._send(200, {'created': int(time.time()), 'data': [item]})
+
+def make_server(host, port, chat_latency='lognormal:2.0:0.4', image_latency='lognormal:6.0:0.3',
+                token_latency='fixed:0.02', error_rate=0.0):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {
+        'latency': {
+            'chat': parse_latency(chat_latency),
+            'image': parse_latency(image_latency),
+            'token': parse_latency(token_latency),
+        },
+        'error_rate': error_rate,
+    })
+    return ThreadingHTTPServer((host, port), handler)
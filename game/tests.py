@@ -1,3 +1,1057 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+from datetime import timedelta
+from unittest import mock
+import brotli
+from PIL import Image
+from django.core.cache import caches
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import (
+    assets, clients, imaging, jobs, metrics, pipeline, prefetch, singleflight, state_cache, story, utils, warm_pool
+)
+from .checks import check_game_state_cache
+from .jobs import cache_background
+from .level_graph import compile_level
+from .models import (
+    Asset, AssetRef, ChoiceEvent, Game, GenerationLock, ImageJob, LevelData, PrefetchedLevel, SceneCache, WarmStart
+)
+from .renderers import MEDIA_TYPE, packb, unpackb
+from .schemas import repair_level
+from .similarity import SceneIndex, tokenize
+from .streaming import IncrementalLevelParser
+from .stub_openai import make_server
+from .utils import generate_level_content, generate_story_outline
+from .views import parse_byte_range
 
-# Create your tests here.
+def node(node_id, *next_ids, scene=''):
+    return {
+        'id': node_id, 'speaker': 'Vera', 'text': f'text {node_id}', 'scene_description': scene,
+        'choices': [{'text': f'to {n}', 'next_id': n} for n in next_ids],
+    }
+
+def level(start, *nodes):
+    return {'level_number': 1, 'role': 'detective', 'start_node': start, 'dialogue_nodes': list(nodes)}
+
+# Runs the app against the offline OpenAI stub (game/stub_openai.py) on a free port, with
+# generated images under a temporary BASE_DIR. TransactionTestCase because image jobs and
+# prefetches write from their own threads.
+class StubOpenAITestCase(TransactionTestCase):
+    stub_settings = {
+        'OPENAI_MAX_RETRIES': 0,
+        'PREFETCH_ENABLED': False,
+        'WARM_POOL_AUTO_REFILL': False,
+        'LOCAL_BACKGROUNDS_ENABLED': False,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = make_server(
+            '127.0.0.1', 0, chat_latency='fixed:0', image_latency='fixed:0', token_latency='fixed:0'
+        )
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(cls.base_dir, 'static', 'images'))
+        cls.overrides = override_settings(
+            OPENAI_BASE_URL=f'http://127.0.0.1:{cls.server.server_port}/v1', BASE_DIR=cls.base_dir,
+            **cls.stub_settings
+        )
+        cls.overrides.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.overrides.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.base_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        # Clients are built once per process; point them at this class's stub
+        clients._client = clients._async_client = None
+        caches['default'].clear()
+
+    def tearDown(self):
+        self.drain()
+        clients._client = clients._async_client = None
+
+    # Let background image jobs and prefetches finish before the tables are flushed
+    def drain(self):
+        with jobs._futures_lock:
+            futures = list(jobs._futures.values())
+        with prefetch._lock:
+            futures += list(prefetch._inflight.values())
+        wait(futures, timeout=30)
+
+    def post(self, url, data=None, **extra):
+        return self.client.post(url, data or {}, content_type='application/json', **extra)
+
+    def new_game(self):
+        return self.post('/api/new_game/').json()['game_id']
+
+    # A PNG under the temporary static/images, as if generated
+    def write_image(self, image_name, size=(16, 16)):
+        Image.new('RGBA', size, (90, 60, 30, 255)).save(os.path.join(assets.images_dir(), image_name))
+        return image_name
+
+    # [(event, data)] of a Server-Sent Events response
+    def sse_events(self, response):
+        body = b''.join(response.streaming_content).decode('utf-8')
+        events = []
+        for message in body.split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.splitlines() if ': ' in line)
+            if 'event' in fields:
+                events.append((fields['event'], json.loads(fields['data'])))
+        return events
+
+# Choices through the stub's canned level (game/stub_openai.py) ending at its final node n8
+STUB_PATH = [
+    {'node_id': 'n1', 'choice_text': 'Option 2'}, {'node_id': 'n3', 'choice_text': 'Option 1'},
+    {'node_id': 'n4', 'choice_text': 'Option 2'}, {'node_id': 'n7', 'choice_text': 'Option 1'},
+]
+
+class StubOpenAITests(StubOpenAITestCase):
+    def test_level_role_follows_the_outline(self):
+        outline = generate_story_outline()
+        self.assertEqual(len(outline['levels']), 10)
+        for level_number, role in ((1, 'detective'), (2, 'journalist')):
+            content = generate_level_content(outline, [], level_number)
+            self.assertEqual((content['level_number'], content['role']), (level_number, role))
+
+    def test_next_level_role_follows_the_outline(self):
+        game_id = self.client.post('/api/new_game/', {}, content_type='application/json').json()['game_id']
+        response = self.client.post(
+            '/api/next_level/', {'game_id': game_id, 'choices_path': []}, content_type='application/json'
+        )
+        self.assertEqual(response.json()['level']['role'], 'journalist')
+
+class PrefetchTests(StubOpenAITestCase):
+    stub_settings = dict(StubOpenAITestCase.stub_settings, PREFETCH_ENABLED=True, PREFETCH_MAX_BRANCHES=2)
+
+    def test_candidate_paths_reach_distinct_endings(self):
+        content = level('a', node('a', 'b', 'c'), node('b', 'd', 'e'), node('c', 'd'), node('d'), node('e'))
+        paths = prefetch.candidate_paths(content, 5)
+        self.assertEqual([p[-1]['node_id'] for p in paths], ['b', 'b'])
+        self.assertEqual(
+            [prefetch.outcome_key(content, p) for p in paths],
+            [prefetch.outcome_key(content, [{'node_id': 'c', 'choice_text': 'to d'}]),
+             prefetch.outcome_key(content, [{'node_id': 'b', 'choice_text': 'to e'}])]
+        )
+
+    def test_any_path_to_the_prefetched_ending_is_a_hit(self):
+        game_id = self.new_game()
+        self.drain()
+        self.assertEqual(PrefetchedLevel.objects.filter(game_id=game_id, level_number=2).count(), 1)
+        hits = metrics.get('prefetch_hits')
+        # The stub's level has a single ending, so a path that was never speculated still hits
+        response = self.post('/api/next_level/', {'game_id': game_id, 'choices_path': STUB_PATH})
+        self.assertEqual(response.json()['level']['level_number'], 2)
+        self.assertEqual(metrics.get('prefetch_hits'), hits + 1)
+
+    def test_other_ending_is_a_miss(self):
+        game = Game.objects.create(outline=generate_story_outline(), current_level=1)
+        content = level('a', node('a', 'b', 'c'), node('b'), node('c'))
+        LevelData.objects.create(game=game, level_number=1, role='detective', content=content)
+        with override_settings(PREFETCH_MAX_BRANCHES=1):
+            prefetch.schedule_prefetch(game, content, 1)
+        self.drain()
+        misses = metrics.get('prefetch_misses')
+        self.assertIsNone(prefetch.claim_prefetched(game, 2, [{'node_id': 'a', 'choice_text': 'to c'}]))
+        self.assertEqual(metrics.get('prefetch_misses'), misses + 1)
+        self.assertFalse(PrefetchedLevel.objects.filter(game=game).exists())
+
+    def test_rows_stored_after_the_claim_are_discarded_with_the_level(self):
+        game_id = self.new_game()
+        self.drain()
+        PrefetchedLevel.objects.all().delete()
+
+        # A sibling branch still running when the level is claimed stores its row late
+        def claim_then_store_late(*args):
+            PrefetchedLevel.objects.create(game_id=game_id, level_number=2, path_key='late', content={})
+            return None
+
+        with override_settings(PREFETCH_ENABLED=False), \
+                mock.patch('game.views.claim_prefetched', side_effect=claim_then_store_late):
+            self.post('/api/next_level/', {'game_id': game_id, 'choices_path': STUB_PATH})
+        self.assertFalse(PrefetchedLevel.objects.filter(game_id=game_id, level_number=2).exists())
+
+class IncrementalLevelParserTests(SimpleTestCase):
+    def events(self, text, size):
+        parser = IncrementalLevelParser()
+        events = []
+        for i in range(0, len(text), size):
+            events.extend(parser.feed(text[i:i + size]))
+        return events
+
+    def test_same_events_for_any_chunking(self):
+        content = level('a', node('a', 'b', scene='office "upstairs"'), node('b'))
+        text = json.dumps(content)
+        expected = [('start_node', 'a')] + [('node', n) for n in content['dialogue_nodes']]
+        for size in (1, 2, 7, len(text)):
+            self.assertEqual(self.events(text, size), expected, size)
+
+    def test_nodes_before_start_node_and_numeric_start(self):
+        text = '{"dialogue_nodes": [{"id": 1, "choices": [{"next_id": 2}]}], "start_node": 1}'
+        self.assertEqual(self.events(text, 3), [
+            ('node', {'id': 1, 'choices': [{'next_id': 2}]}),
+            ('start_node', 1),
+        ])
+
+    def test_ignores_code_fences_and_brackets_in_strings(self):
+        text = '```json\n{"title": "a {tricky} [one]", "start_node": "a\\"b", "dialogue_nodes": [{"id": "x}"}]}\n```'
+        self.assertEqual(self.events(text, 5), [('start_node', 'a"b'), ('node', {'id': 'x}'})])
+
+    def test_nested_objects_are_not_nodes(self):
+        text = '{"meta": {"dialogue_nodes": [{"id": "fake"}]}, "dialogue_nodes": [{"id": "a", "extra": {"k": 1}}]}'
+        self.assertEqual(self.events(text, 4), [('node', {'id': 'a', 'extra': {'k': 1}})])
+
+class NextLevelStreamTests(StubOpenAITestCase):
+    def test_event_sequence(self):
+        game_id = self.new_game()
+        events = self.sse_events(self.post('/api/next_level/stream/', {'game_id': game_id, 'choices_path': STUB_PATH}))
+        names = [name for name, _ in events]
+        self.assertEqual(names[:2], ['meta', 'start_node'])
+        self.assertEqual(names[-1], 'level')
+        self.assertEqual(events[0][1]['level_number'], 2)
+        self.assertEqual(events[0][1]['role'], 'journalist')
+        level_content = events[-1][1]['level']
+        self.assertEqual(events[1][1], level_content['start_node'])
+        self.assertEqual([data for name, data in events if name == 'node'], level_content['dialogue_nodes'])
+        self.assertEqual(LevelData.objects.get(game_id=game_id, level_number=2).content, level_content)
+        self.assertEqual(Game.objects.get(pk=game_id).current_level, 2)
+
+    def test_generation_failure_ends_with_an_error_event(self):
+        game_id = self.new_game()
+        with mock.patch('game.views.stream_level_content', side_effect=RuntimeError('upstream down')):
+            events = self.sse_events(self.post('/api/next_level/stream/', {'game_id': game_id, 'choices_path': []}))
+        self.assertEqual([name for name, _ in events], ['meta', 'error'])
+        self.assertIn('upstream down', events[-1][1]['error'])
+        self.assertEqual(Game.objects.get(pk=game_id).current_level, 1)
+
+    def test_requires_a_game(self):
+        response = self.post('/api/next_level/stream/', {'choices_path': []})
+        self.assertEqual(response.status_code, 400)
+
+class AsyncViewTests(StubOpenAITestCase):
+    async def apost(self, url, data=None):
+        return await self.async_client.post(url, data or {}, content_type='application/json')
+
+    async def test_new_game_then_next_level(self):
+        game = (await self.apost('/api/async/new_game/')).json()
+        self.assertEqual(game['level']['level_number'], 1)
+        self.assertEqual(game['graph']['start_node'], game['level']['start_node'])
+        response = await self.apost('/api/async/next_level/', {'game_id': game['game_id'], 'choices_path': STUB_PATH})
+        self.assertEqual(response.json()['level']['level_number'], 2)
+        self.assertEqual(await LevelData.objects.filter(game_id=game['game_id']).acount(), 2)
+
+    async def test_invalid_requests(self):
+        self.assertEqual((await self.apost('/api/async/next_level/', {'choices_path': []})).status_code, 400)
+        response = await self.apost('/api/async/next_level/', {'game_id': str(uuid.uuid4()), 'choices_path': []})
+        self.assertEqual(response.json(), {'error': 'Invalid game_id'})
+
+    async def test_background_miss_renders_the_placeholder_off_the_event_loop(self):
+        game_id = (await self.apost('/api/async/new_game/')).json()['game_id']
+        loop_thread = threading.current_thread()
+        threads = []
+
+        def placeholder(level_number, scene_description):
+            threads.append(threading.current_thread())
+            return {'image_name': 'placeholder.png'}
+
+        with mock.patch('game.async_views.placeholder_background', side_effect=placeholder):
+            response = await self.apost('/api/async/generate_background/', {
+                'game_id': game_id, 'level_number': 1, 'level_summary': 's',
+                'scene_description': 'a rooftop water tower at dawn',
+            })
+        payload = response.json()
+        self.assertEqual(payload['image_name'], 'placeholder.png')
+        self.assertIn('job_id', payload)
+        self.assertNotEqual(threads, [loop_thread])
+
+class AssetStoreTests(StubOpenAITestCase):
+    def store(self, key, description, game=None, size=(16, 16)):
+        image_name = self.write_image(f'bg_{key}.png', size)
+        return assets.store(key, Asset.KIND_BACKGROUND, description, 'prompt', image_name, game)
+
+    def test_lookup_hit_records_a_reference(self):
+        game = Game.objects.create(outline={}, current_level=1)
+        self.store('k1', 'office at night')
+        asset = assets.lookup('k1', game)
+        self.assertEqual(asset.key, 'k1')
+        self.assertTrue(AssetRef.objects.filter(asset=asset, game=game).exists())
+        self.assertIsNone(assets.lookup('unknown', game))
+
+    def test_lookup_forgets_an_asset_whose_file_is_gone(self):
+        asset = self.store('k1', 'office at night')
+        os.remove(os.path.join(assets.images_dir(), asset.image_name))
+        self.assertIsNone(assets.lookup('k1'))
+        self.assertFalse(Asset.objects.filter(key='k1').exists())
+
+    def test_payload_urls_are_content_addressed(self):
+        payload = assets.asset_payload(self.store('k1', 'office at night'))
+        digest = assets.file_hash(payload['image_name'])
+        self.assertEqual(payload['url'], f"/assets/{digest[:assets.HASH_URL_CHARS]}/{payload['image_name']}")
+
+    def test_garbage_collection_evicts_unreferenced_assets_least_recently_used_first(self):
+        game = Game.objects.create(outline={}, current_level=1)
+        oldest = self.store('k1', 'office at night', game)
+        older = self.store('k2', 'wet alley')
+        newer = self.store('k3', 'jazz club stage')
+        for i, asset in enumerate((oldest, older, newer)):
+            Asset.objects.filter(pk=asset.pk).update(last_used_at=timezone.now() - timedelta(hours=3 - i))
+        SceneCache.objects.create(
+            game=game, scene_key='s', level_number=1, scene_description='wet alley',
+            payload=assets.asset_payload(older)
+        )
+        with override_settings(ASSET_STORE_MAX_BYTES=oldest.size_bytes + newer.size_bytes):
+            self.assertEqual(assets.collect_garbage(), 1)
+        # The referenced asset is older but kept; the per-game cache no longer points at the evicted file
+        self.assertEqual(set(Asset.objects.values_list('key', flat=True)), {'k1', 'k3'})
+        self.assertFalse(os.path.exists(os.path.join(assets.images_dir(), older.image_name)))
+        self.assertFalse(SceneCache.objects.exists())
+
+    def test_referenced_assets_are_kept_over_budget(self):
+        game = Game.objects.create(outline={}, current_level=1)
+        self.store('k1', 'office at night', game)
+        over_budget = metrics.get('asset_store_over_budget')
+        with override_settings(ASSET_STORE_MAX_BYTES=1):
+            self.assertEqual(assets.collect_garbage(), 0)
+        self.assertEqual(metrics.get('asset_store_over_budget'), over_budget + 1)
+        assets.release(game)
+        with override_settings(ASSET_STORE_MAX_BYTES=1):
+            self.assertEqual(assets.collect_garbage(), 1)
+
+class SceneIndexTests(StubOpenAITestCase):
+    def add_background(self, key, description):
+        image_name = self.write_image(f'bg_{key}.png')
+        return Asset.objects.create(key=key, kind=Asset.KIND_BACKGROUND, description=description, image_name=image_name)
+
+    def test_tokenize_drops_stopwords_and_plurals(self):
+        self.assertEqual(tokenize("The detective's offices at night"), ['detective', 'office', 'night'])
+
+    def test_near_duplicate_scenes_match(self):
+        self.add_background('k1', 'dimly lit office at night')
+        self.add_background('k2', 'rain-soaked harbor docks')
+        index = SceneIndex()
+        key, score = index.best_match("the detective's office, night")
+        self.assertEqual(key, 'k1')
+        self.assertGreater(score, 0.3)
+        self.assertEqual(index.best_match('sunny beach picnic'), (None, 0.0))
+
+    def test_document_vectors_are_reused_until_the_index_changes(self):
+        self.add_background('k1', 'dimly lit office at night')
+        index = SceneIndex()
+        with mock.patch.object(index, '_vector', wraps=index._vector) as vector:
+            index.best_match('office at night')
+            index.best_match('office at night')
+            # One query vector per call, the document vector only once
+            self.assertEqual(vector.call_count, 3)
+            index.add('k2', 'office on the top floor')
+            index.best_match('office at night')
+            self.assertEqual(vector.call_count, 6)
+
+    def test_refresh_picks_up_assets_stored_by_other_processes(self):
+        index = SceneIndex()
+        self.assertEqual(index.best_match('foggy harbor docks'), (None, 0.0))
+        self.add_background('k2', 'rainy harbor docks with fog')
+        self.assertEqual(index.best_match('foggy harbor docks')[0], None)
+        with override_settings(SCENE_INDEX_REFRESH_SECONDS=0):
+            self.assertEqual(index.best_match('foggy harbor docks')[0], 'k2')
+
+    def test_match_evicted_elsewhere_is_dropped(self):
+        self.add_background('k1', 'rainy harbor docks with fog')
+        index = SceneIndex()
+        index.best_match('docks')
+        Asset.objects.filter(key='k1').delete()
+        with mock.patch('game.assets.scene_index', index), override_settings(SCENE_MATCH_THRESHOLD=0.1):
+            self.assertIsNone(assets.lookup_similar_background('foggy harbor docks'))
+        self.assertEqual(index.best_match('foggy harbor docks'), (None, 0.0))
+
+class ImageJobTests(StubOpenAITestCase):
+    def setUp(self):
+        super().setUp()
+        self.game = Game.objects.create(outline=generate_story_outline(), current_level=1)
+
+    def finished(self, job):
+        self.drain()
+        return ImageJob.objects.get(pk=job.pk)
+
+    def test_job_generates_and_caches_the_background(self):
+        job = jobs.enqueue_background(self.game, 1, 'summary', 'smoky jazz club')
+        job = self.finished(job)
+        self.assertEqual(job.status, ImageJob.STATUS_DONE)
+        self.assertTrue(os.path.isfile(os.path.join(assets.images_dir(), job.result['image_name'])))
+        self.assertEqual(jobs.cached_background(self.game, 1, 'smoky jazz club'), job.result)
+
+    def test_concurrent_requests_for_a_scene_share_one_job(self):
+        started = threading.Barrier(4)
+        found = []
+
+        def enqueue():
+            started.wait()
+            found.append(jobs.enqueue_background(self.game, 1, 'summary', 'smoky jazz club').pk)
+
+        with mock.patch('game.jobs.generate_background', side_effect=lambda *args: time.sleep(0.3) or {}):
+            threads = [threading.Thread(target=enqueue) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            self.drain()
+        self.assertEqual(len(set(found)), 1)
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+    def test_contended_key_does_not_block_other_enqueues(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with singleflight.exclusive(f"enqueue:{assets.background_key(1, 'wet alley')}"):
+                held.set()
+                release.wait(10)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait(5)
+        # Waits for the lock row held above
+        waiter = threading.Thread(target=jobs.enqueue_background, args=(self.game, 1, 'summary', 'wet alley'))
+        waiter.start()
+        try:
+            time.sleep(0.1)
+            started = time.monotonic()
+            jobs.enqueue_background(self.game, 1, 'summary', 'smoky jazz club')
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            release.set()
+            holder.join(5)
+            waiter.join(5)
+
+    def test_resume_runs_pending_and_stale_jobs(self):
+        params = {'level_number': 1, 'level_summary': 's', 'scene_description': 'wet alley'}
+        pending = ImageJob.objects.create(kind=Asset.KIND_BACKGROUND, dedupe_key='a', game=self.game, params=params)
+        stale = ImageJob.objects.create(
+            kind=Asset.KIND_BACKGROUND, dedupe_key='b', game=self.game, status=ImageJob.STATUS_RUNNING,
+            params=dict(params, scene_description='jazz club')
+        )
+        ImageJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.resume_pending(), 2)
+        self.assertEqual(self.finished(pending).status, ImageJob.STATUS_DONE)
+        self.assertEqual(self.finished(stale).status, ImageJob.STATUS_DONE)
+
+    def test_events_stream_until_the_job_is_done(self):
+        job = jobs.enqueue_background(self.game, 1, 'summary', 'smoky jazz club')
+        events = self.sse_events(self.client.get(f'/api/jobs/{job.pk}/events/'))
+        self.assertEqual(events[-1][1]['status'], ImageJob.STATUS_DONE)
+        self.assertEqual(events[-1][1]['job_id'], str(job.pk))
+
+    def test_level_backgrounds_are_queued_once_per_scene(self):
+        content = generate_level_content(self.game.outline, [], 1)
+        graph = compile_level(content)
+        scenes = jobs.level_scenes(content, graph)
+        with override_settings(LEVEL_PREGEN_MAX_IMAGES=2):
+            self.assertEqual(jobs.pregenerate_level_backgrounds(self.game, content, 's', graph), 2)
+        self.drain()
+        # The start scene comes first; a second run only queues what is still missing
+        self.assertIsNotNone(jobs.cached_background(self.game, 1, scenes[0]))
+        with override_settings(LEVEL_PREGEN_MAX_IMAGES=10):
+            self.assertEqual(jobs.pregenerate_level_backgrounds(self.game, content, 's', graph), len(scenes) - 2)
+
+class RetryTests(StubOpenAITestCase):
+    stub_settings = dict(StubOpenAITestCase.stub_settings, OPENAI_MAX_RETRIES=2, OPENAI_BACKOFF_MAX=0.01)
+
+    # Answer the first `failures` chat requests with the stub's 429 + Retry-After
+    def rate_limit_first(self, failures):
+        handler = self.server.RequestHandlerClass
+        original = handler._maybe_rate_limit
+        seen = []
+
+        def maybe_rate_limit(handler_self):
+            seen.append(1)
+            return original(handler_self) if len(seen) <= failures else False
+
+        return seen, mock.patch.multiple(handler, error_rate=1.0, _maybe_rate_limit=maybe_rate_limit)
+
+    def test_rate_limited_call_is_retried(self):
+        seen, patch = self.rate_limit_first(1)
+        retries, limited = metrics.get('openai_retries'), metrics.get('openai_rate_limited')
+        with patch:
+            outline = generate_story_outline()
+        self.assertEqual(len(outline['levels']), 10)
+        self.assertEqual(len(seen), 2)
+        self.assertEqual((metrics.get('openai_retries'), metrics.get('openai_rate_limited')), (retries + 1, limited + 1))
+
+    def test_gives_up_after_max_retries(self):
+        import openai
+        seen, patch = self.rate_limit_first(10)
+        with patch, self.assertRaises(openai.RateLimitError):
+            generate_story_outline()
+        self.assertEqual(len(seen), 3)
+
+    def test_exhausted_quota_and_other_errors_are_not_retried(self):
+        import openai
+        response = mock.Mock(status_code=429, headers={})
+        for error in (
+            openai.RateLimitError('quota', response=response, body={'code': 'insufficient_quota'}),
+            ValueError('bad request'),
+        ):
+            fn = mock.Mock(side_effect=error)
+            with self.assertRaises(type(error)):
+                clients.with_retries(fn)
+            self.assertEqual(fn.call_count, 1)
+
+class RepairLevelTests(SimpleTestCase):
+    def test_valid_level_needs_no_repairs(self):
+        repaired, repairs = repair_level(level('a', node('a', 'b'), node('b')), 1, 'detective')
+        self.assertEqual(repairs, [])
+        self.assertEqual(repaired['start_node'], 'a')
+
+    def test_ids_become_strings_and_duplicates_are_dropped(self):
+        content = level(1, node(1, 2), node(2), node(2, 1))
+        repaired, repairs = repair_level(content, 1, 'detective')
+        self.assertEqual([n['id'] for n in repaired['dialogue_nodes']], ['1', '2'])
+        self.assertEqual(repaired['dialogue_nodes'][0]['choices'][0]['next_id'], '2')
+        self.assertEqual(repaired['start_node'], '1')
+        self.assertIn('dropped duplicate node 2', repairs)
+
+    def test_drops_dangling_and_malformed_choices(self):
+        a = node('a', 'b', 'ghost')
+        a['choices'].append({'text': 'no target'})
+        repaired, repairs = repair_level(level('a', a, node('b')), 1, 'detective')
+        self.assertEqual([c['next_id'] for c in repaired['dialogue_nodes'][0]['choices']], ['b'])
+        self.assertIn('dropped dangling next_id ghost in a', repairs)
+        self.assertIn('dropped malformed choice in a', repairs)
+
+    def test_invalid_start_node_prefers_the_root(self):
+        repaired, repairs = repair_level(level('ghost', node('b'), node('a', 'b')), 1, 'detective')
+        self.assertEqual(repaired['start_node'], 'a')
+        self.assertIn('set start_node to a', repairs)
+
+    def test_fills_missing_fields(self):
+        repaired, _ = repair_level(
+            {'dialogue_nodes': [{'id': 'a', 'scene_description': 'a wet alley'}, 'junk']}, 3, 'journalist'
+        )
+        self.assertEqual((repaired['level_number'], repaired['role']), (3, 'journalist'))
+        first = repaired['dialogue_nodes'][0]
+        self.assertEqual((first['speaker'], first['text'], first['choices']), ('Narrator', 'a wet alley', []))
+
+    def test_no_usable_nodes_raises(self):
+        with self.assertRaises(ValueError):
+            repair_level({'dialogue_nodes': [{'text': 'no id'}]}, 1, 'detective')
+        with self.assertRaises(ValueError):
+            repair_level(['not', 'a', 'level'], 1, 'detective')
+
+class StructuredOutputFallbackTests(StubOpenAITestCase):
+    stub_settings = dict(StubOpenAITestCase.stub_settings, OPENAI_STRUCTURED_OUTPUT='json_schema')
+
+    def tearDown(self):
+        utils._structured_output['supported'] = True
+        super().tearDown()
+
+    def test_rejected_response_format_is_dropped_for_the_process(self):
+        handler = self.server.RequestHandlerClass
+        original = handler._chat
+        formats = []
+
+        def chat(handler_self, body):
+            formats.append(body.get('response_format'))
+            if 'response_format' in body:
+                return handler_self._send(400, {'error': {
+                    'message': "Invalid parameter: 'response_format' is not supported with this model.",
+                    'type': 'invalid_request_error', 'param': 'response_format',
+                }})
+            return original(handler_self, body)
+
+        unsupported = metrics.get('structured_output_unsupported')
+        with mock.patch.object(handler, '_chat', chat):
+            generate_story_outline()
+            generate_story_outline()
+        self.assertEqual([f and f['type'] for f in formats], ['json_schema', None, None])
+        self.assertEqual(metrics.get('structured_output_unsupported'), unsupported + 1)
+        self.assertIsNone(utils.structured_format('outline', {}))
+
+class StoryDigestTests(StubOpenAITestCase):
+    def test_transition_records_the_level_outcome_once(self):
+        game_id = self.new_game()
+        game = Game.objects.get(pk=game_id)
+        level_one = LevelData.objects.get(game=game, level_number=1).content
+        self.post('/api/next_level/', {'game_id': game_id, 'choices_path': STUB_PATH})
+        # A retried transition rewrites the row instead of adding another
+        story.record_level_outcome(game, 1, STUB_PATH, level_one)
+        self.assertEqual(ChoiceEvent.objects.filter(game=game).count(), 1)
+        entry, = story.load_story_digest(game)
+        self.assertEqual(entry['choices'], ['Option 2', 'Option 1', 'Option 2', 'Option 1'])
+        self.assertTrue(entry['outcome'].startswith('Level 1, beat 8.'))
+
+    def test_digest_is_in_level_order(self):
+        game = Game.objects.create(outline={'levels': []})
+        content = level('a', node('a', 'b'), node('b'))
+        for level_number in (3, 1, 2):
+            story.record_level_outcome(game, level_number, [{'node_id': 'a', 'choice_text': 'to b'}], content)
+        self.assertEqual([e['level'] for e in story.load_story_digest(game)], [1, 2, 3])
+
+    def test_digest_with_level_replaces_its_entry(self):
+        content = level('a', node('a', 'b'), node('b'))
+        digest = [{'level': 1, 'outcome': 'old'}, {'level': 2, 'outcome': 'older'}]
+        digest = story.digest_with_level(digest, 2, [{'node_id': 'a', 'choice_text': 'to b'}], content)
+        self.assertEqual([(e['level'], e['outcome']) for e in digest], [(1, 'old'), (2, 'text b')])
+
+    @override_settings(STORY_DIGEST_RECENT_LEVELS=2)
+    def test_prompt_context_compacts_older_levels(self):
+        outline = {'levels': [{'level_number': n, 'summary': f'level {n}'} for n in range(1, 11)]}
+        digest = [{'level': n, 'choices': ['go'], 'outcome': 'x' * 300} for n in (4, 1, 3, 2)]
+        context = story.prompt_context(outline, digest, 5)
+        self.assertEqual([lvl['level_number'] for lvl in context['outline']['levels']], [4, 5, 6])
+        self.assertEqual(context['outline']['total_levels'], 10)
+        self.assertEqual([e['level'] for e in context['earlier_levels']], [1, 2])
+        self.assertEqual(len(context['earlier_levels'][0]['outcome']), story.MAX_OLD_OUTCOME_CHARS)
+        self.assertEqual([e['level'] for e in context['recent_levels']], [3, 4])
+
+class WarmPoolTests(StubOpenAITestCase):
+    stub_settings = dict(StubOpenAITestCase.stub_settings, WARM_POOL_SIZE=2, WARM_POOL_LOW_WATER=1)
+
+    def tearDown(self):
+        thread = warm_pool._refill_thread
+        if thread is not None:
+            thread.join(timeout=30)
+        super().tearDown()
+
+    def test_refill_tops_up_to_the_target(self):
+        self.assertEqual(warm_pool.refill(), 2)
+        self.assertEqual(warm_pool.refill(), 0)
+        self.assertEqual(warm_pool.refill(target=3), 1)
+        self.assertEqual(WarmStart.objects.count(), 3)
+
+    def test_claim_takes_the_oldest_entry(self):
+        first = WarmStart.objects.create(outline={'levels': [], 'n': 1}, level_content={})
+        WarmStart.objects.create(outline={'levels': [], 'n': 2}, level_content={})
+        hits = metrics.get('warm_pool_hits')
+        outline, _ = warm_pool.claim()
+        self.assertEqual(outline['n'], 1)
+        self.assertFalse(WarmStart.objects.filter(pk=first.pk).exists())
+        self.assertEqual(metrics.get('warm_pool_hits'), hits + 1)
+
+    def test_miss_alerts_without_refilling(self):
+        misses, alerts = metrics.get('warm_pool_misses'), metrics.get('warm_pool_low_water')
+        with self.settings(WARM_POOL_AUTO_REFILL=True):
+            self.assertIsNone(warm_pool.claim())
+        self.assertIsNone(warm_pool._refill_thread)
+        self.assertEqual((metrics.get('warm_pool_misses'), metrics.get('warm_pool_low_water')), (misses + 1, alerts + 1))
+
+    def test_hit_refills_in_the_background(self):
+        warm_pool.refill(target=1)
+        with self.settings(WARM_POOL_AUTO_REFILL=True):
+            self.assertIsNotNone(warm_pool.claim())
+            thread = warm_pool._refill_thread
+            self.assertIsNotNone(thread)
+            thread.join(timeout=30)
+        self.assertEqual(WarmStart.objects.count(), 2)
+
+    def test_new_game_starts_from_a_warm_entry(self):
+        warm_pool.refill(target=1)
+        outline = WarmStart.objects.get().outline
+        game_id = self.new_game()
+        self.assertEqual(WarmStart.objects.count(), 0)
+        self.assertEqual(Game.objects.get(pk=game_id).outline, outline)
+        self.assertTrue(LevelData.objects.filter(game_id=game_id, level_number=1).exists())
+
+class StateCacheTests(StubOpenAITestCase):
+    def test_read_through_then_hit(self):
+        game_id = self.new_game()
+        state_cache.invalidate(game_id)
+        hits, misses = metrics.get('game_state_cache_hits'), metrics.get('game_state_cache_misses')
+        first = state_cache.get_state(game_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(state_cache.get_state(game_id), first)
+        self.assertEqual((metrics.get('game_state_cache_hits'), metrics.get('game_state_cache_misses')), (hits + 1, misses + 1))
+        self.assertEqual(first['level_content']['level_number'], 1)
+        self.assertIsNone(state_cache.get_state(uuid.uuid4()))
+        self.assertIsNone(state_cache.get_state('not-a-uuid'))
+
+    def test_level_change_moves_the_version(self):
+        game_id = self.new_game()
+        self.assertEqual(state_cache.get_state(game_id)['current_level'], 1)
+        self.post('/api/next_level/', {'game_id': game_id, 'choices_path': STUB_PATH})
+        with self.assertNumQueries(0):
+            state = state_cache.get_state(game_id)
+        self.assertEqual((state['current_level'], state['level_content']['level_number']), (2, 2))
+        self.assertEqual([e['level'] for e in state['story_digest']], [1])
+
+    def test_game_from_state_saves_only_its_fields(self):
+        game = Game.objects.create(outline={'levels': []}, current_level=3)
+        state = state_cache.build_state(game)
+        with self.assertNumQueries(0):
+            cached = state_cache.game_from_state(state)
+        self.assertEqual(cached.get_deferred_fields(), {'created_at', 'updated_at'})
+        cached.current_level = 4
+        with self.assertNumQueries(1):
+            cached.save()
+        saved = Game.objects.get(pk=game.pk)
+        self.assertEqual((saved.current_level, saved.created_at), (4, game.created_at))
+
+class GameStateCacheCheckTests(SimpleTestCase):
+    def test_process_local_cache_warns(self):
+        self.assertEqual([w.id for w in check_game_state_cache(None)], ['game.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://x'}}
+        with self.settings(CACHES=shared):
+            self.assertEqual(check_game_state_cache(None), [])
+
+@override_settings(BACKGROUND_VARIANT_WIDTHS=[8], IMAGE_WEBP_VARIANTS=True)
+class ImageVariantTests(SimpleTestCase):
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.save_dir, ignore_errors=True)
+
+    def save(self, image_name):
+        source = Image.new('RGBA', (32, 16), (90, 60, 30, 255))
+        return imaging.save_variants(source, image_name, (16, 8), True, self.save_dir)
+
+    def test_variants_are_read_from_the_manifest(self):
+        variants = self.save('bg_a.png')
+        self.save('bg_a2.png')
+        self.assertEqual(variants[0]['image_name'], 'bg_a.png')
+        self.assertTrue(os.path.isfile(os.path.join(self.save_dir, 'bg_a.variants.json')))
+        with mock.patch('os.listdir') as listdir, mock.patch.object(imaging.Image, 'open') as image_open:
+            self.assertEqual(imaging.existing_variants('bg_a.png', self.save_dir), variants)
+        listdir.assert_not_called()
+        image_open.assert_not_called()
+
+    def test_images_without_a_manifest_match_only_their_own_files(self):
+        variants = self.save('bg_a.png')
+        self.save('bg_a2.png')
+        os.remove(os.path.join(self.save_dir, 'bg_a.variants.json'))
+        found = imaging.existing_variants('bg_a.png', self.save_dir)
+        self.assertEqual(sorted(v['image_name'] for v in found), sorted(v['image_name'] for v in variants))
+        self.assertEqual({v['image_name']: v['width'] for v in found}, {v['image_name']: v['width'] for v in variants})
+
+    def test_remove_variants_drops_the_manifest(self):
+        imaging.remove_variants(self.save('bg_a.png'), self.save_dir)
+        self.assertEqual(os.listdir(self.save_dir), [])
+
+class ParseByteRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_byte_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_byte_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_byte_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_byte_range('bytes=990-2000', 1000), (990, 999))
+        self.assertEqual(parse_byte_range('bytes=-5000', 1000), (0, 999))
+
+    def test_whole_file(self):
+        for header in (None, '', 'bytes=-', 'items=0-1', 'bytes=0-1,5-6'):
+            self.assertIsNone(parse_byte_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        self.assertIs(parse_byte_range('bytes=1000-', 1000), False)
+        self.assertIs(parse_byte_range('bytes=50-10', 1000), False)
+
+class AssetFileTests(StubOpenAITestCase):
+    def test_immutable_url_with_validators_and_ranges(self):
+        url = assets.asset_url(self.write_image('bg_file.png'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        body = b''.join(response.streaming_content)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        partial = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual((partial.status_code, partial.content), (206, body[:10]))
+        self.assertEqual(partial['Content-Range'], f'bytes 0-9/{len(body)}')
+        # A stale validator gets the whole file rather than a range of different bytes
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+
+    def test_regenerated_file_is_not_served_under_the_old_url(self):
+        url = assets.asset_url(self.write_image('bg_file.png'))
+        self.write_image('bg_file.png', size=(8, 8))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+class LevelTransitionTests(StubOpenAITestCase):
+    def test_streams_the_next_level_and_the_headline(self):
+        game_id = self.new_game()
+        events = self.sse_events(self.post('/api/level_transition/', {'game_id': game_id, 'choices_path': STUB_PATH}))
+        # The headline goes out whenever it is ready; the level events keep their order
+        names = [name for name, _ in events if name != 'headline']
+        self.assertEqual(names, ['meta', 'start_node'] + ['node'] * 8 + ['level'])
+        self.assertEqual(len(events), len(names) + 1)
+        data = dict(events)
+        self.assertTrue(data['headline']['headline'])
+        self.assertEqual(data['level']['level']['level_number'], 2)
+        self.assertEqual(ChoiceEvent.objects.filter(game_id=game_id).count(), 1)
+
+    def test_headline_can_be_skipped(self):
+        game_id = self.new_game()
+        response = self.post('/api/level_transition/', {'game_id': game_id, 'choices_path': [], 'headline': False})
+        self.assertNotIn('headline', [name for name, _ in self.sse_events(response)])
+
+    def test_last_level_completes_the_game(self):
+        game_id = self.new_game()
+        Game.objects.filter(pk=game_id).update(current_level=10)
+        # Background jobs of level 1 add their references when they finish
+        self.drain()
+        for url in ('/api/level_transition/', '/api/async/level_transition/'):
+            payload = self.post(url, {'game_id': game_id, 'choices_path': []}).json()
+            self.assertEqual(payload['message'], 'Game completed! No more levels.')
+            self.assertTrue(payload['headline'])
+        self.assertFalse(AssetRef.objects.filter(game_id=game_id).exists())
+        self.assertEqual(Game.objects.get(pk=game_id).current_level, 10)
+
+    def test_async_transition_returns_one_body(self):
+        game_id = self.new_game()
+        payload = self.post('/api/async/level_transition/', {'game_id': game_id, 'choices_path': STUB_PATH}).json()
+        self.assertEqual(payload['level']['level_number'], 2)
+        self.assertTrue(payload['headline'])
+
+    def test_malformed_requests_are_rejected_by_every_level_endpoint(self):
+        game_id = self.new_game()
+        for prefix in ('/api/', '/api/async/'):
+            for name in ('next_level', 'level_transition', 'headline'):
+                url = f'{prefix}{name}/'
+                self.assertEqual(self.post(url, {'game_id': game_id}).status_code, 400, url)
+                response = self.post(url, {'game_id': game_id, 'choices_path': 'n1'})
+                self.assertEqual(response.status_code, 400, url)
+                self.assertIn('choices_path must be a list', response.json()['error'])
+                response = self.post(url, {'game_id': 'not-a-uuid', 'choices_path': []})
+                self.assertEqual(response.json(), {'error': 'Invalid game_id'}, url)
+        self.assertEqual(Game.objects.get(pk=game_id).current_level, 1)
+
+@override_settings(SINGLEFLIGHT_POLL_INTERVAL=0.01)
+class SingleflightTests(TransactionTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def produce():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'sheet'
+
+        leader = threading.Thread(target=lambda: results.append(singleflight.run('k', produce)))
+        leader.start()
+        started.wait(5)
+        waiters = [threading.Thread(target=lambda: results.append(singleflight.run('k', produce))) for _ in range(3)]
+        for thread in waiters:
+            thread.start()
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['sheet'] * 4)
+        self.assertFalse(GenerationLock.objects.exists())
+
+    def test_leader_failure_reaches_waiters_and_releases_the_key(self):
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def produce():
+            started.set()
+            release.wait(5)
+            raise RuntimeError('filtered')
+
+        def call():
+            try:
+                singleflight.run('k', produce)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(target=call)
+        waiter.start()
+        release.set()
+        leader.join(5)
+        waiter.join(5)
+        self.assertEqual(errors, ['filtered', 'filtered'])
+        self.assertFalse(GenerationLock.objects.exists())
+        self.assertEqual(singleflight.run('k', lambda: 'retried'), 'retried')
+
+    def test_lookup_short_circuits_the_leader(self):
+        self.assertEqual(singleflight.run('k', lambda: self.fail('produced'), lambda: 'stored'), 'stored')
+
+    async def test_async_callers_share_one_call(self):
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'sheet'
+
+        results = await asyncio.gather(*(singleflight.arun('k', produce) for _ in range(4)))
+        self.assertEqual(results, ['sheet'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    async def test_async_leader_failure_reaches_waiters(self):
+        async def produce():
+            await asyncio.sleep(0.05)
+            raise RuntimeError('filtered')
+
+        results = await asyncio.gather(*(singleflight.arun('k', produce) for _ in range(3)), return_exceptions=True)
+        self.assertEqual([str(r) for r in results], ['filtered'] * 3)
+
+    async def test_cancelled_leader_hands_over_to_a_waiter(self):
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'sheet'
+
+        leader = asyncio.ensure_future(singleflight.arun('k', produce))
+        await asyncio.sleep(0.02)
+        waiter = asyncio.ensure_future(singleflight.arun('k', produce))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        self.assertEqual(await waiter, 'sheet')
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(len(calls), 2)
+
+class ResponseEncodingTests(StubOpenAITestCase):
+    def test_msgpack_is_negotiated(self):
+        game_id = self.new_game()
+        for url in ('/api/next_level/', '/api/async/next_level/'):
+            response = self.client.post(
+                url, packb({'game_id': game_id, 'choices_path': []}), content_type=MEDIA_TYPE, HTTP_ACCEPT=MEDIA_TYPE
+            )
+            self.assertEqual(response['Content-Type'], MEDIA_TYPE)
+            self.assertIn('dialogue_nodes', unpackb(response.content)['level'])
+        self.assertEqual(Game.objects.get(pk=game_id).current_level, 3)
+        response = self.post('/api/headline/', {'game_id': game_id, 'choices_path': []})
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_brotli_when_accepted_else_gzip(self):
+        response = self.client.get('/api/stats/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('game_state_cache', json.loads(brotli.decompress(response.content)))
+        self.assertEqual(self.client.get('/api/stats/', HTTP_ACCEPT_ENCODING='gzip')['Content-Encoding'], 'gzip')
+        self.assertFalse(self.client.get('/api/stats/').has_header('Content-Encoding'))
+
+    def test_event_streams_are_not_compressed(self):
+        game_id = self.new_game()
+        response = self.post(
+            '/api/next_level/stream/', {'game_id': game_id, 'choices_path': []}, HTTP_ACCEPT_ENCODING='br'
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.sse_events(response)[-1][0], 'level')
+
+class FirstScreenTests(StubOpenAITestCase):
+    def setUp(self):
+        super().setUp()
+        self.game = Game.objects.create(outline={'levels': []})
+        self.content = level('a', node('a', 'b', scene='office at night'), node('b', scene='wet alley'))
+        self.graph = compile_level(self.content)
+        self.job = ImageJob.objects.create(
+            kind='background', game=self.game, dedupe_key=assets.background_key(1, 'office at night')
+        )
+        # The start scene's job is taken as queued and never run, so each test decides how it ends
+        patcher = mock.patch('game.pipeline.enqueue_background', return_value=self.job)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def first_screen(self, sprite_atlas=None):
+        return pipeline.first_screen(self.game, self.content, self.graph, 'summary', sprite_atlas, time.monotonic())
+
+    def finish(self, job, result=None, delay=0):
+        time.sleep(delay)
+        ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.STATUS_DONE, result=result)
+
+    @override_settings(NEW_GAME_BACKGROUND_DEADLINE=5)
+    def test_job_without_an_estimate_is_not_waited_for(self):
+        skipped = metrics.get('new_game_waits_skipped')
+        started = time.monotonic()
+        with mock.patch('game.pipeline.expected_remaining', return_value=None):
+            background, _, status = self.first_screen()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual((background['job_id'], background['status']), (str(self.job.pk), 'pending'))
+        self.assertEqual(metrics.get('new_game_waits_skipped'), skipped + 1)
+        self.assertEqual(status['ready'], [])
+        self.assertEqual(
+            [(p['scene'], p['job_id']) for p in status['pending']],
+            [('office at night', str(self.job.pk)), ('wet alley', None)]
+        )
+
+    @override_settings(NEW_GAME_BACKGROUND_DEADLINE=5)
+    def test_job_about_to_finish_is_waited_for(self):
+        payload = {'image_name': 'bg_office.png', 'url': '/static/images/bg_office.png'}
+
+        def finish():
+            time.sleep(0.2)
+            cache_background(self.game, 1, 'office at night', payload)
+            self.finish(self.job)
+
+        thread = threading.Thread(target=finish)
+        with mock.patch('game.pipeline.expected_remaining', return_value=0.2):
+            thread.start()
+            started = time.monotonic()
+            background, _, status = self.first_screen()
+        thread.join()
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(background, payload)
+        self.assertEqual(status['ready'], [{'kind': 'background', 'scene': 'office at night'}])
+
+    def test_finished_atlas_job_is_returned_in_place(self):
+        self.finish(self.job)
+        atlas = ImageJob.objects.create(kind='sprite_atlas', game=self.game, dedupe_key='atlas')
+        self.finish(atlas, {'image_name': 'atlas.png'})
+        with mock.patch('game.pipeline.expected_remaining', return_value=None):
+            _, sprite_atlas, status = self.first_screen({'job_id': str(atlas.pk)})
+        self.assertEqual(sprite_atlas, {'image_name': 'atlas.png'})
+        self.assertIn({'kind': 'sprite_atlas'}, status['ready'])
+
+    def test_asset_status_lists_ready_and_pending(self):
+        cache_background(self.game, 1, 'wet alley', {'image_name': 'bg_alley.png'})
+        status = pipeline.asset_status(self.game, 1, self.graph, {'job_id': 'j1'})
+        self.assertEqual(status['ready'], [{'kind': 'background', 'scene': 'wet alley'}])
+        self.assertEqual(status['pending'], [
+            {'kind': 'background', 'scene': 'office at night', 'job_id': str(self.job.pk)},
+            {'kind': 'sprite_atlas', 'job_id': 'j1'},
+        ])
+
+class CompileLevelTests(SimpleTestCase):
+    def test_prunes_unreachable_nodes(self):
+        content = level('a', node('a', 'b'), node('b'), node('orphan', 'b'))
+        graph = compile_level(content)
+        self.assertEqual(graph['pruned'], ['orphan'])
+        self.assertEqual([n['id'] for n in content['dialogue_nodes']], ['a', 'b'])
+        self.assertEqual(graph['index'], {'a': 0, 'b': 1})
+
+    def test_depth_is_the_shortest_choice_count(self):
+        content = level('a', node('a', 'b', 'd'), node('b', 'c'), node('c', 'd'), node('d'))
+        graph = compile_level(content)
+        self.assertEqual(graph['depth'], {'a': 0, 'b': 1, 'd': 1, 'c': 2})
+        self.assertEqual(graph['max_depth'], 2)
+        self.assertEqual(graph['terminal'], ['d'])
+
+    def test_records_cycles_without_looping(self):
+        content = level('a', node('a', 'b'), node('b', 'c'), node('c', 'a', 'd'), node('d'))
+        graph = compile_level(content)
+        self.assertEqual(graph['cycles'], [['c', 'a']])
+        self.assertEqual(graph['pruned'], [])
+
+    def test_self_loop_is_a_cycle(self):
+        graph = compile_level(level('a', node('a', 'a', 'b'), node('b')))
+        self.assertEqual(graph['cycles'], [['a', 'a']])
+
+    def test_scenes_in_order_of_first_reach(self):
+        content = level(
+            'a', node('a', 'b', 'c', scene='office'), node('c', scene='street'),
+            node('b', 'c', scene='office'), node('x', scene='roof')
+        )
+        graph = compile_level(content)
+        self.assertEqual(graph['scenes'], {'office': ['a', 'b'], 'street': ['c']})
+
+    def test_missing_start_node_keeps_every_node(self):
+        content = level('nope', node('a', 'b'), node('b'))
+        graph = compile_level(content)
+        self.assertEqual(graph['pruned'], [])
+        self.assertEqual(graph['depth'], {})
+        self.assertEqual(graph['max_depth'], 0)
+        self.assertEqual(len(content['dialogue_nodes']), 2)
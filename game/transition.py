@@ -0,0 +1,77 @@
+# game/transition.py
+# Fused end-of-level transition: the finished level's headline is generated on a small pool
+# while the request thread claims or generates the next level, so the two completions overlap
+# instead of costing the client two sequential round trips.
+import contextvars
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from . import metrics
+from .streaming import sse_event
+from .utils import generate_headline
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TRANSITION_HEADLINE_WORKERS,
+                thread_name_prefix='headline'
+            )
+        return _executor
+
+def _generate(outline, story_digest, level_number):
+    with metrics.timed('transition_headline'):
+        return generate_headline(outline, story_digest, level_number)
+
+# Future for the headline of level_number, given the digest that already includes its outcome
+def start_headline(outline, story_digest, level_number):
+    metrics.incr('transition_headlines')
+    # Run in a copy of the request's context so its stages show up in the request log
+    context = contextvars.copy_context()
+    return _get_executor().submit(context.run, _generate, outline, story_digest, level_number)
+
+# Events of a level stream with the headline event merged in the moment it is ready, rather
+# than between two level events (a replayed prefetched level has none left by then, and a
+# streamed one usually blocks on the model for longer than the headline takes). The level
+# stream runs on its own thread; headline_event(future) builds the headline's event.
+def merge_headline(level_stream, headline, headline_event):
+    events = queue.Queue()
+    finished = object()
+
+    def pump():
+        try:
+            for event in level_stream:
+                events.put(event)
+        except Exception as e:
+            metrics.record_error('transition_level', e)
+            logger.exception("Level stream of a transition failed")
+            events.put(sse_event('error', {'error': f'Failed to stream level: {e}'}))
+        finally:
+            connection.close()
+            events.put(finished)
+
+    def on_headline(future):
+        events.put(headline_event(future))
+        events.put(finished)
+
+    sources = 1
+    if headline is not None:
+        sources += 1
+        headline.add_done_callback(on_headline)
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(pump,), name='transition-level', daemon=True).start()
+    while sources:
+        event = events.get()
+        if event is finished:
+            sources -= 1
+        else:
+            yield event
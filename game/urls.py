@@ -1,11 +1,18 @@
 # game/urls.py
 from django.urls import path
-from .views import NewGameView, NextLevelView, HeadlineView, GenerateBackgroundView, GenerateSpriteView
+from .views import NewGameView, NextLevelView, NextLevelStreamView, HeadlineView, LevelTransitionView, GenerateBackgroundView, GenerateSpriteView, SpriteAtlasView, ImageJobView, ImageJobEventsView, MetricsView, StatsView
 
 urlpatterns = [
     path('new_game/', NewGameView.as_view(), name='new_game'),
     path('next_level/', NextLevelView.as_view(), name='next_level'),
+    path('next_level/stream/', NextLevelStreamView.as_view(), name='next_level_stream'),
     path('headline/', HeadlineView.as_view(), name='headline'),
+    path('level_transition/', LevelTransitionView.as_view(), name='level_transition'),
     path('generate_background/', GenerateBackgroundView.as_view(), name='generate_background'),
     path('generate_sprite/', GenerateSpriteView.as_view(), name='generate_sprite'),
+    path('sprite_atlas/<uuid:game_id>/', SpriteAtlasView.as_view(), name='sprite_atlas'),
+    path('jobs/<uuid:job_id>/', ImageJobView.as_view(), name='image_job'),
+    path('jobs/<uuid:job_id>/events/', ImageJobEventsView.as_view(), name='image_job_events'),
+    path('stats/', StatsView.as_view(), name='stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
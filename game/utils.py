@@ -1,51 +1,149 @@
 # game/utils.py
 import os
 import json
+import base64
+import logging
+import time
 import uuid
-import requests
-from io import BytesIO
-from PIL import Image
-import openai  # pylint: disable=no-member
 from django.conf import settings
+from . import metrics
+from .clients import get_openai_client, with_retries, download
+from .imaging import process_and_save
+from .schemas import (
+    OUTLINE_SCHEMA, LEVEL_SCHEMA, IMAGE_PROMPT_SCHEMA,
+    validate, repair_level, repair_outline, fill_node_text,
+)
+from .story import context_json, count_tokens, record_prompt_tokens
+from .streaming import IncrementalLevelParser
 
-# Configure API key
-openai.api_key = settings.OPENAI_API_KEY
-
-# Helper to call OpenAI ChatCompletion using v1 interface
-def call_openai_chat(messages, max_tokens=1000, temperature=0.7):
-    # pylint: disable=no-member
-    response = openai.chat.completions.create(
-        model="gpt-4",
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
+logger = logging.getLogger(__name__)
+
+# Structured output: the response_format to request for a schema, per OPENAI_STRUCTURED_OUTPUT.
+# Switched off for the rest of the process if the model rejects it.
+_structured_output = {'supported': True}
+
+def structured_format(name, schema):
+    mode = settings.OPENAI_STRUCTURED_OUTPUT
+    if not _structured_output['supported'] or mode == 'off':
+        return None
+    if mode == 'json_object':
+        return {'type': 'json_object'}
+    return {'type': 'json_schema', 'json_schema': {'name': name, 'schema': schema, 'strict': True}}
+
+def is_unsupported_format_error(exc, response_format):
+    import openai  # pylint: disable=no-member
+    return response_format is not None and isinstance(exc, openai.BadRequestError) and 'response_format' in str(exc)
+
+def disable_structured_output():
+    _structured_output['supported'] = False
+    metrics.incr('structured_output_unsupported')
+
+def chat_kwargs(messages, max_tokens, temperature, response_format, **extra):
+    kwargs = dict(model="gpt-4", messages=messages, max_tokens=max_tokens, temperature=temperature, **extra)
+    if response_format is not None:
+        kwargs['response_format'] = response_format
+    return kwargs
+
+# Helper to call OpenAI ChatCompletion using v1 interface.
+# `purpose` (and `level_number`) label the prompt-token report for this call.
+def call_openai_chat(messages, max_tokens=1000, temperature=0.7, response_format=None, purpose='chat', level_number=None):
+    create = get_openai_client().chat.completions.create
+    try:
+        with metrics.timed('llm_chat'):
+            try:
+                response = with_retries(create, **chat_kwargs(messages, max_tokens, temperature, response_format))
+            except Exception as e:
+                if not is_unsupported_format_error(e, response_format):
+                    raise
+                disable_structured_output()
+                response = with_retries(create, **chat_kwargs(messages, max_tokens, temperature, None))
+    except Exception as e:
+        metrics.record_error('llm_chat', e)
+        raise
+    record_prompt_tokens(purpose, messages, level_number, getattr(response, 'usage', None))
     return response.choices[0].message.content
 
+# Streaming variant: yields content deltas as they arrive
+def stream_openai_chat(messages, max_tokens=1000, temperature=0.7, response_format=None):
+    # Only opening the stream is retried; a stream that breaks midway raises
+    create = get_openai_client().chat.completions.create
+    start = time.perf_counter()
+    try:
+        try:
+            stream = with_retries(create, **chat_kwargs(messages, max_tokens, temperature, response_format, stream=True))
+        except Exception as e:
+            if not is_unsupported_format_error(e, response_format):
+                raise
+            disable_structured_output()
+            stream = with_retries(create, **chat_kwargs(messages, max_tokens, temperature, None, stream=True))
+        first = True
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first:
+                    metrics.observe_stage('llm_first_token', time.perf_counter() - start)
+                    first = False
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        metrics.record_error('llm_stream', e)
+        raise
+    finally:
+        metrics.observe_stage('llm_stream', time.perf_counter() - start)
+
 # Generate story outline
-def generate_story_outline():
+def build_outline_messages():
     system_msg = {'role': 'system', 'content': (
         "You are a story designer for a noir dialogue-driven game set in 1940s New York. "
         "Generate an overarching story outline with 10 levels, alternating roles between detective and journalist starting with detective at level 1. "
         "Include historical context, fictional characters, a central mystery evolving over levels, key branching points. "
         "Return JSON with key 'levels': list of 10 items: each with 'level_number', 'role', 'summary', and optionally 'key_characters'."
     )}
-    content = call_openai_chat([system_msg], max_tokens=1000)
+    return [system_msg]
+
+# Parse a JSON object from model output; returns (obj, strict) where strict is False if the
+# object had to be cut out of surrounding text or have its braces balanced
+def parse_json_object(content):
     try:
-        outline = json.loads(content)
+        return json.loads(content), True
     except json.JSONDecodeError:
-        start = content.find('{'); end = content.rfind('}')
-        if start != -1 and end != -1:
-            try:
-                outline = json.loads(content[start:end+1])
-            except:
-                raise ValueError("Failed parse outline: " + content)
-        else:
+        pass
+    start = content.find('{')
+    end = content.rfind('}')
+    if start == -1:
+        return None, False
+    substring = content[start:end+1] if end != -1 else content[start:]
+    # Balance braces
+    open_braces = substring.count('{')
+    close_braces = substring.count('}')
+    if open_braces > close_braces:
+        substring += '}' * (open_braces - close_braces)
+    try:
+        return json.loads(substring), False
+    except json.JSONDecodeError:
+        return None, False
+
+def parse_outline(content):
+    with metrics.timed('parse'):
+        outline, strict = parse_json_object(content)
+        if outline is None:
+            metrics.incr('outline_parse_failed')
             raise ValueError("Failed parse outline: " + content)
-    return outline
+        try:
+            outline, repairs = repair_outline(outline)
+        except ValueError:
+            metrics.incr('outline_parse_failed')
+            raise ValueError("Failed parse outline: " + content)
+        metrics.incr('outline_parsed_clean' if strict and not repairs else 'outline_rescued')
+        return outline
 
-# Generate level dialogue tree
-def generate_level_content(outline, choices_history, level_number):
+def generate_story_outline():
+    content = call_openai_chat(
+        build_outline_messages(), max_tokens=1000, response_format=structured_format('outline', OUTLINE_SCHEMA),
+        purpose='outline'
+    )
+    return parse_outline(content)
+
+# Build chat messages for a level dialogue tree from the compacted story state; returns (messages, role)
+def build_level_messages(outline, story_digest, level_number):
     levels = outline.get('levels') or []
     level_outline = next((lvl for lvl in levels if lvl.get('level_number') == level_number), None)
     if not level_outline:
@@ -60,53 +158,92 @@ def generate_level_content(outline, choices_history, level_number):
         "Consider previous choices for coherence and NPC biases. "
         "Each node must have: 'id', 'speaker', 'text', 'choices': list of { 'text', 'next_id' }, and 'scene_description' for background context. "
         "Do NOT hardcode image names; use scene_description only. "
-        "Ensure 5-10 decision points. Return JSON with 'level_number','role','dialogue_nodes', and 'start_node'."
+        "Ensure 5-10 decision points. Return JSON with 'level_number','role','start_node', and 'dialogue_nodes', in that order, listing the start node first."
     )
     system_msg = {'role': 'system', 'content': prompt_text}
-    user_msg = {'role': 'user', 'content': json.dumps({'outline': outline, 'choices_history': choices_history, 'current_level': level_number})}
-    content = call_openai_chat([system_msg, user_msg], max_tokens=2000)
-    # Parsing helper inside function
-    def try_parse(s):
+    user_msg = {'role': 'user', 'content': context_json(outline, story_digest, level_number)}
+    return [system_msg, user_msg], role
+
+# Parse raw model output into a level dict. Output that is not valid JSON (typically cut off at
+# max_tokens) is salvaged from its completed dialogue nodes; the result is then repaired in place.
+def parse_level_content(content, level_number, role):
+    with metrics.timed('parse'):
+        level_content, strict = parse_json_object(content)
+        if level_content is None:
+            events = IncrementalLevelParser().feed(content)
+            salvaged = [value for event, value in events if event == 'node']
+            start_node = next((value for event, value in events if event == 'start_node'), None)
+            if salvaged:
+                level_content = {'start_node': start_node, 'dialogue_nodes': salvaged}
+        if level_content is None:
+            metrics.incr('level_parse_failed')
+            raise ValueError(f"Failed parse level {level_number}: " + content)
+        violations = validate(level_content, LEVEL_SCHEMA) if isinstance(level_content, dict) else ['not an object']
         try:
-            return json.loads(s)
-        except json.JSONDecodeError:
-            return None
-    level_content = try_parse(content)
-    if level_content is None:
-        start = content.find('{')
-        end = content.rfind('}')
-        if start != -1:
-            substring = content[start:end+1] if end != -1 else content[start:]
-            # Balance braces
-            open_braces = substring.count('{')
-            close_braces = substring.count('}')
-            if open_braces > close_braces:
-                substring += '}' * (open_braces - close_braces)
-            level_content = try_parse(substring)
-    if level_content is None:
-        raise ValueError(f"Failed parse level {level_number}: " + content)
-    level_content.setdefault('level_number', level_number)
-    level_content.setdefault('role', role)
-    # Ensure each node has non-empty text
-    for node in level_content.get('dialogue_nodes', []):
-        if not node.get('text') or not node['text'].strip():
-            desc = node.get('scene_description', '').strip()
-            node['text'] = desc or "..."
-    return level_content
+            level_content, repairs = repair_level(level_content, level_number, role)
+        except ValueError:
+            metrics.incr('level_parse_failed')
+            raise ValueError(f"Failed parse level {level_number}: " + content)
+        if strict and not violations and not repairs:
+            metrics.incr('level_parsed_clean')
+        else:
+            metrics.incr('level_rescued')
+        return level_content
+
+# Generate level dialogue tree
+def generate_level_content(outline, story_digest, level_number):
+    messages, role = build_level_messages(outline, story_digest, level_number)
+    content = call_openai_chat(
+        messages, max_tokens=2000, response_format=structured_format('level', LEVEL_SCHEMA),
+        purpose='level', level_number=level_number
+    )
+    return parse_level_content(content, level_number, role)
+
+# Stream a level dialogue tree: yields ('start_node', id) and ('node', dict) as soon as each
+# piece is parseable, then ('level', level_content) once the completion has finished
+def stream_level_content(outline, story_digest, level_number):
+    messages, role = build_level_messages(outline, story_digest, level_number)
+    record_prompt_tokens('level', messages, level_number)
+    parser = IncrementalLevelParser()
+    response_format = structured_format('level', LEVEL_SCHEMA)
+    for delta in stream_openai_chat(messages, max_tokens=2000, response_format=response_format):
+        for event, value in parser.feed(delta):
+            if event == 'node':
+                fill_node_text(value)
+            yield event, value
+    metrics.record_tokens('level', 0, count_tokens([{'content': parser.text}]))
+    yield 'level', parse_level_content(parser.text, level_number, role)
 
 # Generate headline
-def generate_headline(outline, choices_history, level_number):
+def build_headline_messages(outline, story_digest, level_number):
     system_msg = {'role': 'system', 'content': (
         "You are a 1940s newspaper headline writer in New York. "
         f"Given the story outline and choices up to level {level_number}, produce a sensational newspaper headline summarizing this level's events and player's impact. "
         "Return one-line headline."
     )}
-    user_msg = {'role': 'user', 'content': json.dumps({'outline': outline, 'choices_history': choices_history, 'current_level': level_number})}
-    content = call_openai_chat([system_msg, user_msg], max_tokens=100)
+    user_msg = {'role': 'user', 'content': context_json(outline, story_digest, level_number)}
+    return [system_msg, user_msg]
+
+def parse_headline(content):
     return content.strip().strip('"')
 
+def generate_headline(outline, story_digest, level_number):
+    content = call_openai_chat(
+        build_headline_messages(outline, story_digest, level_number), max_tokens=100,
+        purpose='headline', level_number=level_number
+    )
+    return parse_headline(content)
+
+# Parse a {'prompt', 'image_name'} reply, falling back to a locally built prompt
+def _parse_prompt_reply(content, fallback):
+    result, _ = parse_json_object(content)
+    if result is None or validate(result, IMAGE_PROMPT_SCHEMA):
+        metrics.incr('image_prompt_fallback')
+        return fallback()
+    return result
+
 # Generate background prompt
-def generate_dynamic_background_prompt(level_number, level_summary, node_context=None):
+def build_background_prompt_messages(level_number, level_summary, node_context=None):
     system_msg = {'role': 'system', 'content': (
         "You are an AI assistant generating pixel-art prompts for a 1940s New York noir game. "
         "Given level number and summary, and optionally node context (e.g., 'office at night'), produce a pixel-art prompt: 16-bit style, limited palette (4-8 colors), no anti-aliasing, hard edges, dithering, dramatic chiaroscuro, noir atmosphere, aspect ratio 16:9. "
@@ -116,71 +253,95 @@ def generate_dynamic_background_prompt(level_number, level_summary, node_context
     if node_context:
         user_content['node_context'] = node_context
     user_msg = {'role': 'user', 'content': json.dumps(user_content)}
-    content = call_openai_chat([system_msg, user_msg], max_tokens=200)
-    try:
-        result = json.loads(content)
-    except json.JSONDecodeError:
-        start = content.find('{'); end = content.rfind('}')
-        if start != -1 and end != -1:
-            try:
-                result = json.loads(content[start:end+1])
-            except:
-                prompt = f"1940s New York noir pixel art level {level_number}: {level_summary}, scene: {node_context or 'generic'}, 16-bit, limited palette, no AA, hard edges, dithering, chiaroscuro --ar 16:9"
-                slug = (node_context.lower().replace(' ', '_') if node_context else f"lvl{level_number}")
-                image_name = f"bg_{level_number}_{slug}_{uuid.uuid4().hex[:6]}.png"
-                result = {'prompt': prompt, 'image_name': image_name}
-        else:
-            prompt = f"1940s New York noir pixel art level {level_number}: {level_summary}, scene: {node_context or 'generic'}, 16-bit, limited palette, no AA, hard edges, dithering, chiaroscuro --ar 16:9"
-            slug = (node_context.lower().replace(' ', '_') if node_context else f"lvl{level_number}")
-            image_name = f"bg_{level_number}_{slug}_{uuid.uuid4().hex[:6]}.png"
-            result = {'prompt': prompt, 'image_name': image_name}
-    return result
+    return [system_msg, user_msg]
+
+def parse_background_prompt(content, level_number, level_summary, node_context=None):
+    def fallback():
+        prompt = f"1940s New York noir pixel art level {level_number}: {level_summary}, scene: {node_context or 'generic'}, 16-bit, limited palette, no AA, hard edges, dithering, chiaroscuro --ar 16:9"
+        slug = (node_context.lower().replace(' ', '_') if node_context else f"lvl{level_number}")
+        image_name = f"bg_{level_number}_{slug}_{uuid.uuid4().hex[:6]}.png"
+        return {'prompt': prompt, 'image_name': image_name}
+    return _parse_prompt_reply(content, fallback)
+
+def generate_dynamic_background_prompt(level_number, level_summary, node_context=None):
+    messages = build_background_prompt_messages(level_number, level_summary, node_context)
+    content = call_openai_chat(
+        messages, max_tokens=200, response_format=structured_format('image_prompt', IMAGE_PROMPT_SCHEMA),
+        purpose='background_prompt'
+    )
+    return parse_background_prompt(content, level_number, level_summary, node_context)
 
 # Generate sprite prompt
-def generate_dynamic_sprite_prompt(character_name, character_description):
+def build_sprite_prompt_messages(character_name, character_description):
     system_msg = {'role': 'system', 'content': (
         "You are an AI assistant generating pixel-art sprite prompts for 1940s noir game. "
         "Given character name and description, produce prompt for 32x32 sprite sheet (idle/walk/talk), no anti-aliasing, hard edges, limited palette, dithering, chiaroscuro. "
         "Suggest filename 'sprite_<slug>.png'. Return JSON with 'prompt' and 'image_name'."
     )}
     user_msg = {'role': 'user', 'content': json.dumps({'name': character_name, 'description': character_description})}
-    content = call_openai_chat([system_msg, user_msg], max_tokens=200)
-    try:
-        result = json.loads(content)
-    except json.JSONDecodeError:
-        start = content.find('{'); end = content.rfind('}')
-        if start != -1 and end != -1:
-            try:
-                result = json.loads(content[start:end+1])
-            except:
-                prompt = f"Pixel art 32x32 sprite for {character_name}: {character_description}, no AA, hard edges, limited palette, dithering, chiaroscuro"
-                slug = character_name.lower().replace(' ', '_')
-                image_name = f"sprite_{slug}_{uuid.uuid4().hex[:6]}.png"
-                result = {'prompt': prompt, 'image_name': image_name}
-        else:
-            prompt = f"Pixel art 32x32 sprite for {character_name}: {character_description}, no AA, hard edges, limited palette, dithering, chiaroscuro"
-            slug = character_name.lower().replace(' ', '_')
-            image_name = f"sprite_{slug}_{uuid.uuid4().hex[:6]}.png"
-            result = {'prompt': prompt, 'image_name': image_name}
-    return result
+    return [system_msg, user_msg]
+
+def default_sprite_prompt(character_name, character_description):
+    return f"Pixel art 32x32 sprite for {character_name}: {character_description}, no AA, hard edges, limited palette, dithering, chiaroscuro"
+
+def parse_sprite_prompt(content, character_name, character_description):
+    def fallback():
+        prompt = default_sprite_prompt(character_name, character_description)
+        slug = character_name.lower().replace(' ', '_')
+        image_name = f"sprite_{slug}_{uuid.uuid4().hex[:6]}.png"
+        return {'prompt': prompt, 'image_name': image_name}
+    return _parse_prompt_reply(content, fallback)
+
+def generate_dynamic_sprite_prompt(character_name, character_description):
+    messages = build_sprite_prompt_messages(character_name, character_description)
+    content = call_openai_chat(
+        messages, max_tokens=200, response_format=structured_format('image_prompt', IMAGE_PROMPT_SCHEMA),
+        purpose='sprite_prompt'
+    )
+    return parse_sprite_prompt(content, character_name, character_description)
+
+def image_sizes(is_background):
+    if is_background:
+        return "512x512", (800, 600)
+    return "256x256", (32, 32)
+
+# Image bytes of a generation result: inline base64 when present, otherwise one download
+def image_bytes(item):
+    if getattr(item, 'b64_json', None):
+        return base64.b64decode(item.b64_json)
+    with metrics.timed('download'):
+        return download(item.url)
+
+# Quantize a generated image and store it plus its size/format variants under static/images
+def save_generated_image(item, image_name, final_size, is_background=True):
+    save_dir = os.path.join(settings.BASE_DIR, 'static', 'images')
+    return process_and_save(image_bytes(item), image_name, final_size, is_background, save_dir)
 
 # Generate and save image via OpenAI Image API using v1 interface; smaller size for speed
 def generate_and_save_image(prompt, image_name, is_background=True):
-    # pylint: disable=no-member
-    if is_background:
-        gen_size = "512x512"; final_size = (800, 600)
-    else:
-        gen_size = "256x256"; final_size = (32, 32)
+    gen_size, final_size = image_sizes(is_background)
+    stage = 'image_generate'
     try:
-        response = openai.images.generate(prompt=prompt, n=1, size=gen_size)
-        image_url = response.data[0].url
-        res = requests.get(image_url); res.raise_for_status()
-        img = Image.open(BytesIO(res.content)).convert('RGBA')
-        img = img.resize(final_size, Image.NEAREST)
-        save_dir = os.path.join(settings.BASE_DIR, 'static', 'images')
-        os.makedirs(save_dir, exist_ok=True)
-        save_path = os.path.join(save_dir, image_name)
-        img.save(save_path)
+        with metrics.timed(stage):
+            response = with_retries(
+                get_openai_client().images.generate, prompt=prompt, n=1, size=gen_size, response_format='b64_json'
+            )
+        stage = 'image_process'
+        save_generated_image(response.data[0], image_name, final_size, is_background)
         return True, None
     except Exception as e:
-        return False, str(e)
\ No newline at end of file
+        error = metrics.record_error(stage, e)
+        logger.warning("Image %s failed at %s: %s: %s", image_name, stage, error, e)
+        return False, f"{error}: {e}"
+
+def structured_output_stats():
+    return {
+        'mode': settings.OPENAI_STRUCTURED_OUTPUT if _structured_output['supported'] else 'off (unsupported by model)',
+        'level_parsed_clean': metrics.get('level_parsed_clean'),
+        'level_rescued': metrics.get('level_rescued'),
+        'level_parse_failed': metrics.get('level_parse_failed'),
+        'outline_parsed_clean': metrics.get('outline_parsed_clean'),
+        'outline_rescued': metrics.get('outline_rescued'),
+        'outline_parse_failed': metrics.get('outline_parse_failed'),
+        'image_prompt_fallback': metrics.get('image_prompt_fallback'),
+    }
@@ -1,131 +1,312 @@
 # game/views.py
 import json
+import logging
+import os
+import re
+import threading
+import time
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .models import Game, LevelData
+from .models import Game, LevelData, Asset, ImageJob
 from .serializers import LevelDataSerializer
+from .level_format import level_for_response
+from .level_graph import compile_level, scene_for_node
+from .streaming import sse_event
+from .story import record_level_outcome, digest_with_level, load_story_digest, token_report
+from . import assets, imaging, singleflight, state_cache, warm_pool
+from .jobs import (
+    enqueue_background, job_payload, known_background, placeholder_background,
+    pregenerate_level_backgrounds, sprite_atlas_for, wait_for_job
+)
+from . import metrics, pipeline
+from .prefetch import schedule_prefetch, claim_prefetched, discard as discard_prefetched
+from .transition import merge_headline, start_headline
+from .prefetch import stats as prefetch_stats
 from .utils import (
-    generate_story_outline, generate_level_content, generate_headline,
-    generate_dynamic_background_prompt, generate_dynamic_sprite_prompt, generate_and_save_image
+    generate_story_outline, generate_level_content, stream_level_content, generate_headline,
+    generate_dynamic_sprite_prompt, generate_and_save_image, structured_output_stats
 )
 
+logger = logging.getLogger(__name__)
+
+# Scene of a node of the game's current level, looked up in its compiled graph
+def state_scene(state, level_number, node_id):
+    if state.get('level_graph') is None or state['current_level'] != level_number:
+        return None
+    return scene_for_node(state['level_content'], state['level_graph'], node_id)
+
+# Count and log a failed stage by error class; returns the message for the error response
+def failure(stage, message, exc):
+    error = metrics.record_error(stage, exc)
+    logger.warning("%s failed: %s: %s", stage, error, exc)
+    return f"{message}: {exc}"
+
+def level_summary_for(outline, level_number):
+    return next(
+        (lvl['summary'] for lvl in outline.get('levels', []) if lvl.get('level_number') == level_number),
+        ''
+    )
+
+def level_content_for(game, level_number):
+    level = LevelData.objects.filter(game=game, level_number=level_number).first()
+    return level.content if level else None
+
+# 400 payload for a request without a usable game_id and choices_path, else None
+def choices_request_error(data):
+    choices_path = data.get('choices_path')
+    if not data.get('game_id') or choices_path is None:
+        return {'error': 'game_id and choices_path required'}
+    if not isinstance(choices_path, list) or not all(isinstance(step, dict) for step in choices_path):
+        return {'error': 'choices_path must be a list of {node_id, choice_text} objects'}
+    return None
+
+# Shared start of the endpoints that end a level (sync and async): validate the request, load
+# the game and record the finished level's choices. Returns (game, next_level, error), where
+# error is a 400 payload; next_level is None when the game is over, after its cached state and
+# asset references have been released.
+def begin_level_change(data):
+    error = choices_request_error(data)
+    if error is not None:
+        return None, None, error
+    try:
+        game = Game.objects.get(pk=data['game_id'])
+    except (Game.DoesNotExist, ValidationError):
+        return None, None, {'error': 'Invalid game_id'}
+    current_level = game.current_level
+    record_level_outcome(game, current_level, data['choices_path'], level_content_for(game, current_level))
+    if current_level >= 10:
+        state_cache.invalidate(game.pk)
+        assets.release(game)
+        return game, None, None
+    return game, current_level + 1, None
+
+GAME_COMPLETED = {'message': 'Game completed! No more levels.'}
+
+# Persist a freshly generated level (compiled, see game/level_graph.py) and advance the game
+# to it; returns (level_summary, graph)
+def store_next_level(game, next_level, level_content):
+    graph = compile_level(level_content)
+    game.current_level = next_level
+    game.save(update_fields=['current_level', 'updated_at'])
+    LevelData.objects.create(
+        game=game,
+        level_number=next_level,
+        role=level_content.get('role', ''),
+        content=level_content,
+        graph=graph
+    )
+    state_cache.store_game(game, level_content, graph)
+    discard_prefetched(game, next_level)
+    level_summary = level_summary_for(game.outline, next_level)
+    pregenerate_level_backgrounds(game, level_content, level_summary, graph)
+    schedule_prefetch(game, level_content, next_level, graph)
+    return level_summary, graph
+
 @method_decorator(csrf_exempt, name='dispatch')
 class NewGameView(APIView):
     def post(self, request):
-        try:
-            outline = generate_story_outline()
-        except Exception as e:
-            return Response(
-                {'error': 'Failed to generate story outline: ' + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        game = Game.objects.create(outline=outline, current_level=1, choices_history=[])
-        try:
-            level_content = generate_level_content(outline, [], 1)
-        except Exception as e:
-            return Response(
-                {'error': 'Failed generate level1: ' + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        warm = warm_pool.claim()
+        if warm is not None:
+            outline, level_content = warm
+            started = time.monotonic()
+            game = Game.objects.create(outline=outline, current_level=1)
+            sprite_atlas = sprite_atlas_for(game)
+        else:
+            try:
+                outline = generate_story_outline()
+            except Exception as e:
+                return Response(
+                    {'error': failure('outline', 'Failed to generate story outline', e)},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            started = time.monotonic()
+            game = Game.objects.create(outline=outline, current_level=1)
+            # Sprites only need the outline; backgrounds are queued while level 1 streams
+            sprite_atlas = sprite_atlas_for(game)
+            try:
+                level_content = pipeline.stream_first_level(game, outline, level_summary_for(outline, 1))
+            except Exception as e:
+                return Response(
+                    {'error': failure('level', 'Failed generate level1', e)},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+        graph = compile_level(level_content)
         LevelData.objects.create(
             game=game,
             level_number=1,
             role=level_content.get('role', 'detective'),
-            content=level_content
+            content=level_content,
+            graph=graph
         )
-        level_summary = next(
-            (lvl['summary'] for lvl in outline.get('levels', []) if lvl.get('level_number') == 1),
-            ''
+        state_cache.store_game(game, level_content, graph)
+        level_summary = level_summary_for(outline, 1)
+        pregenerate_level_backgrounds(game, level_content, level_summary, graph)
+        schedule_prefetch(game, level_content, 1, graph)
+        start_background, sprite_atlas, asset_status = pipeline.first_screen(
+            game, level_content, graph, level_summary, sprite_atlas, started
         )
         return Response({
             'game_id': str(game.pk),
-            'level': level_content,
-            'level_summary': level_summary
+            'level': level_for_response(level_content, request.query_params, request.data),
+            'graph': graph,
+            'level_summary': level_summary,
+            'sprite_atlas': sprite_atlas,
+            'start_background': start_background,
+            'assets': asset_status
         })
 
 @method_decorator(csrf_exempt, name='dispatch')
 class NextLevelView(APIView):
     def post(self, request):
         data = request.data
-        game_id = data.get('game_id')
-        choices_path = data.get('choices_path')
-        if not game_id or choices_path is None:
-            return Response(
-                {'error': 'game_id and choices_path required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        try:
-            game = Game.objects.get(pk=game_id)
-        except Game.DoesNotExist:
-            return Response(
-                {'error': 'Invalid game_id'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        current_level = game.current_level
-        game.choices_history.append({'level': current_level, 'path': choices_path})
-        next_level = current_level + 1
-        if next_level > 10:
-            return Response({'message': 'Game completed! No more levels.'})
-        try:
-            level_content = generate_level_content(
-                game.outline,
-                game.choices_history,
-                next_level
-            )
-        except Exception as e:
-            return Response(
-                {'error': f'Failed generate level{next_level}: ' + str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        game.current_level = next_level
-        game.save()
-        LevelData.objects.create(
-            game=game,
-            level_number=next_level,
-            role=level_content.get('role', ''),
-            content=level_content
-        )
-        level_summary = next(
-            (lvl['summary'] for lvl in game.outline.get('levels', []) if lvl.get('level_number') == next_level),
-            ''
-        )
-        return Response({'level': level_content, 'level_summary': level_summary})
+        game, next_level, error = begin_level_change(data)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        if next_level is None:
+            return Response(GAME_COMPLETED)
+        level_content = claim_prefetched(game, next_level, data['choices_path'])
+        if level_content is None:
+            try:
+                level_content = generate_level_content(
+                    game.outline,
+                    load_story_digest(game),
+                    next_level
+                )
+            except Exception as e:
+                return Response(
+                    {'error': failure('level', f'Failed generate level{next_level}', e)},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+        level_summary, graph = store_next_level(game, next_level, level_content)
+        return Response({
+            'level': level_for_response(level_content, request.query_params, data),
+            'graph': graph,
+            'level_summary': level_summary
+        })
+
+# Same contract as NextLevelView, but streams the level as Server-Sent Events:
+# 'meta', then 'start_node' and each 'node' as soon as parseable, then 'level' once stored
+@method_decorator(csrf_exempt, name='dispatch')
+class NextLevelStreamView(APIView):
+    def post(self, request):
+        data = request.data
+        game, next_level, error = begin_level_change(data)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        if next_level is None:
+            return Response(GAME_COMPLETED)
+        prefetched = claim_prefetched(game, next_level, data['choices_path'])
+        return sse_response(level_events(game, next_level, prefetched))
+
+# SSE events for the next level: 'meta', 'start_node', each 'node', then 'level' (with its
+# compiled graph) once stored, or 'error'. The prefetched level is replayed; otherwise the completion is streamed.
+def level_events(game, next_level, prefetched, story_digest=None):
+    level_outline = next(
+        (lvl for lvl in game.outline.get('levels', []) if lvl.get('level_number') == next_level),
+        {}
+    )
+    yield sse_event('meta', {
+        'level_number': next_level,
+        'role': level_outline.get('role'),
+        'level_summary': level_outline.get('summary', ''),
+    })
+    level_content = prefetched
+    if prefetched is None and story_digest is None:
+        story_digest = load_story_digest(game)
+    try:
+        if level_content is not None:
+            yield sse_event('start_node', level_content.get('start_node'))
+            for node in level_content.get('dialogue_nodes', []):
+                yield sse_event('node', node)
+        else:
+            for event, value in stream_level_content(game.outline, story_digest, next_level):
+                if event == 'level':
+                    level_content = value
+                else:
+                    yield sse_event(event, value)
+    except Exception as e:
+        yield sse_event('error', {'error': failure('level_stream', f'Failed generate level{next_level}', e)})
+        return
+    level_summary, graph = store_next_level(game, next_level, level_content)
+    yield sse_event('level', {'level': level_content, 'graph': graph, 'level_summary': level_summary})
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def headline_payload(future):
+    try:
+        return {'headline': future.result()}
+    except Exception as e:
+        return {'error': failure('headline', 'Failed generate headline', e)}
+
+# End of a level in one round trip: records the choices once, then streams the next level like
+# NextLevelStreamView while the finished level's headline is generated alongside it. The
+# 'headline' event is sent as soon as it is ready, wherever that falls among the level's
+# events (possibly after 'level'); "headline": false skips it.
+@method_decorator(csrf_exempt, name='dispatch')
+class LevelTransitionView(APIView):
+    def post(self, request):
+        data = request.data
+        game, next_level, error = begin_level_change(data)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        story_digest = load_story_digest(game)
+        headline = None
+        if data.get('headline', True):
+            headline = start_headline(game.outline, story_digest, game.current_level)
+        if next_level is None:
+            payload = dict(GAME_COMPLETED)
+            if headline is not None:
+                payload.update(headline_payload(headline))
+            return Response(payload)
+        # Claiming may wait on an in-flight prefetch; the headline is already running meanwhile
+        prefetched = claim_prefetched(game, next_level, data['choices_path'])
+
+        return sse_response(merge_headline(
+            level_events(game, next_level, prefetched, story_digest), headline,
+            lambda future: sse_event('headline', headline_payload(future))
+        ))
 
 @method_decorator(csrf_exempt, name='dispatch')
 class HeadlineView(APIView):
     def post(self, request):
         data = request.data
-        game_id = data.get('game_id')
-        choices_path = data.get('choices_path')
-        if not game_id or choices_path is None:
-            return Response(
-                {'error': 'game_id and choices_path required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        try:
-            game = Game.objects.get(pk=game_id)
-        except Game.DoesNotExist:
+        error = choices_request_error(data)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        choices_path = data['choices_path']
+        state = state_cache.get_state(data['game_id'])
+        if state is None:
             return Response(
                 {'error': 'Invalid game_id'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        temp_history = list(game.choices_history)
-        temp_history.append({
-            'level': game.current_level,
-            'path': choices_path
-        })
+        story_digest = digest_with_level(
+            state['story_digest'],
+            state['current_level'],
+            choices_path,
+            state['level_content']
+        )
         try:
             headline = generate_headline(
-                game.outline,
-                temp_history,
-                game.current_level
+                state['outline'],
+                story_digest,
+                state['current_level']
             )
         except Exception as e:
             return Response(
-                {'error': 'Failed generate headline: ' + str(e)},
+                {'error': failure('headline', 'Failed generate headline', e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         return Response({'headline': headline})
@@ -137,58 +318,29 @@ class GenerateBackgroundView(APIView):
         game_id = data.get('game_id')
         level_number = data.get('level_number')
         scene_description = data.get('scene_description')
+        node_id = data.get('node_id')
         level_summary = data.get('level_summary')
         if not game_id or level_number is None or level_summary is None:
             return Response(
                 {'error': 'game_id, level_number and level_summary required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        try:
-            game = Game.objects.get(pk=game_id)
-        except Game.DoesNotExist:
+        state = state_cache.get_state(game_id)
+        if state is None:
             return Response({'error': 'Invalid game_id'}, status=status.HTTP_400_BAD_REQUEST)
+        game = state_cache.game_from_state(state)
+        if not scene_description and node_id is not None:
+            scene_description = state_scene(state, level_number, node_id)
 
-        # Check cache first
-        cache_key = f"lvl{level_number}:{scene_description}"
-        cache_entry = game.bg_cache.get(cache_key)
-        if cache_entry:
-            return Response(cache_entry)
-
-        # Fallback default based on level
-        default_map = {1: 'default_detective_office.png', 2: 'default_newsroom.png'}
-        default_image = default_map.get(level_number, 'placeholder_bg.png')
-        default_url = f'/static/images/{default_image}'
-        response_payload = {
-            'prompt': None,
-            'image_name': default_image,
-            'url': default_url
-        }
+        # Per-game cache first, then the shared asset store (any game may have generated this scene)
+        known = known_background(game, level_number, scene_description)
+        if known is not None:
+            return Response(known)
 
-        try:
-            bg_info = generate_dynamic_background_prompt(
-                level_number,
-                level_summary,
-                node_context=scene_description
-            )
-            prompt = bg_info.get('prompt')
-            image_name = bg_info.get('image_name')
-            success, err = generate_and_save_image(
-                prompt,
-                image_name,
-                is_background=True
-            )
-            if success:
-                response_payload = {
-                    'prompt': prompt,
-                    'image_name': image_name,
-                    'url': f'/static/images/{image_name}'
-                }
-        except Exception:
-            pass
-
-        # Update cache and save
-        game.bg_cache[cache_key] = response_payload
-        game.save(update_fields=['bg_cache'])
+        # Generate in the background; answer with the level default right away
+        job = enqueue_background(game, level_number, level_summary, scene_description)
+        response_payload = placeholder_background(level_number, scene_description)
+        response_payload.update({'job_id': str(job.pk), 'status': job.status})
         return Response(response_payload)
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -202,27 +354,204 @@ class GenerateSpriteView(APIView):
                 {'error': 'character_name and character_description required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        try:
+        asset_key = assets.sprite_key(character_name, character_description)
+        asset = assets.lookup(asset_key)
+        if asset is not None:
+            return Response(assets.asset_payload(asset))
+
+        def produce():
             sp = generate_dynamic_sprite_prompt(
                 character_name,
                 character_description
             )
             prompt = sp.get('prompt')
-            image_name = sp.get('image_name')
+            image_name = assets.asset_image_name(Asset.KIND_SPRITE, asset_key)
             success, err = generate_and_save_image(
                 prompt,
                 image_name,
                 is_background=False
             )
             if not success:
-                return Response(
-                    {'error': 'Sprite gen failed: ' + err},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            url_path = f'/static/images/{image_name}'
-            return Response({'prompt': prompt, 'image_name': image_name, 'url': url_path})
+                raise RuntimeError('Sprite gen failed: ' + err)
+            return assets.store(
+                asset_key, Asset.KIND_SPRITE, f"{character_name}: {character_description}", prompt, image_name
+            )
+
+        # Double-clicks and other games asking for the same character wait on one generation
+        try:
+            asset = singleflight.run(asset_key, produce, lambda: assets.lookup(asset_key))
+            return Response(assets.asset_payload(asset))
         except Exception as e:
             return Response(
-                {'error': 'Sprite prompt/gen failed: ' + str(e)},
+                {'error': failure('sprite', 'Sprite prompt/gen failed', e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+# Sprite sheet + frame manifest for all of the game's key characters (or the job building it)
+class SpriteAtlasView(APIView):
+    def get(self, request, game_id):
+        state = state_cache.get_state(game_id)
+        if state is None:
+            return Response({'error': 'Invalid game_id'}, status=status.HTTP_400_BAD_REQUEST)
+        payload = sprite_atlas_for(state_cache.game_from_state(state))
+        if payload is None:
+            return Response({'error': 'No key characters in this game'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payload)
+
+class ImageJobView(APIView):
+    def get(self, request, job_id):
+        try:
+            job = ImageJob.objects.get(pk=job_id)
+        except ImageJob.DoesNotExist:
+            return Response({'error': 'Invalid job_id'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job_payload(job))
+
+# Server-Sent Events: a 'status' event whenever the job changes, until it is done or failed
+_event_streams_lock = threading.Lock()
+_event_streams = 0
+
+def _open_event_stream():
+    global _event_streams
+    with _event_streams_lock:
+        if _event_streams >= settings.IMAGE_JOB_EVENT_MAX_STREAMS:
+            return False
+        _event_streams += 1
+        return True
+
+def _close_event_stream():
+    global _event_streams
+    with _event_streams_lock:
+        _event_streams -= 1
+
+class ImageJobEventsView(APIView):
+    def get(self, request, job_id):
+        if not ImageJob.objects.filter(pk=job_id).exists():
+            return Response({'error': 'Invalid job_id'}, status=status.HTTP_404_NOT_FOUND)
+
+        def event_stream():
+            # Each stream holds a worker thread: past the cap, send the current status once and
+            # leave the rest to polling /api/jobs/<id>/
+            if not _open_event_stream():
+                metrics.incr('image_job_streams_rejected')
+                yield sse_event('status', job_payload(ImageJob.objects.get(pk=job_id)))
+                return
+            try:
+                last_status = None
+                interval = 0.25
+                deadline = time.monotonic() + settings.IMAGE_JOB_EVENT_TIMEOUT
+                while time.monotonic() < deadline:
+                    job = ImageJob.objects.get(pk=job_id)
+                    if job.status != last_status:
+                        last_status = job.status
+                        yield sse_event('status', job_payload(job))
+                    if job.status in (ImageJob.STATUS_DONE, ImageJob.STATUS_FAILED):
+                        return
+                    # Jobs run by this process wake the stream as soon as they finish; others
+                    # are polled with a backoff
+                    timeout = min(interval, max(deadline - time.monotonic(), 0))
+                    if not wait_for_job(job_id, timeout):
+                        time.sleep(timeout)
+                    interval = min(interval * 2, settings.IMAGE_JOB_EVENT_MAX_INTERVAL)
+            finally:
+                _close_event_stream()
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+ASSET_NAME_RE = re.compile(r'^[A-Za-z0-9_@-]+\.(png|webp)$')
+ASSET_CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Single "bytes=a-b" / "bytes=a-" / "bytes=-n" range -> (start, end inclusive); None to send
+# the whole file, False when the range cannot be satisfied
+def parse_byte_range(header, size):
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+# Generated art under content-hash URLs (/assets/<hash>/<name>). The bytes behind a URL never
+# change, so responses are cacheable forever and revalidate with a strong ETag.
+class AssetFileView(View):
+    def get(self, request, content_hash, image_name):
+        if not ASSET_NAME_RE.match(image_name) or len(content_hash) < assets.HASH_URL_CHARS:
+            raise Http404('Invalid asset')
+        try:
+            digest = assets.file_hash(image_name)
+        except OSError:
+            raise Http404('Invalid asset')
+        if not digest.startswith(content_hash):
+            # The file was regenerated; never serve different bytes under an immutable URL
+            raise Http404('Invalid asset')
+        etag = f'"{digest}"'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+            metrics.incr('asset_file_not_modified')
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = ASSET_CACHE_CONTROL
+            return response
+
+        path = os.path.join(assets.images_dir(), image_name)
+        size = os.path.getsize(path)
+        byte_range = None
+        if request.headers.get('If-Range', etag) == etag:
+            byte_range = parse_byte_range(request.headers.get('Range'), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            start, end = byte_range
+            with open(path, 'rb') as fh:
+                fh.seek(start)
+                response = HttpResponse(fh.read(end - start + 1), status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            metrics.incr('asset_file_partial')
+        else:
+            response = FileResponse(open(path, 'rb'))
+            response['Content-Length'] = str(size)
+            metrics.incr('asset_file_served')
+        response['Content-Type'] = ASSET_CONTENT_TYPES[image_name.rsplit('.', 1)[1]]
+        response['ETag'] = etag
+        response['Cache-Control'] = ASSET_CACHE_CONTROL
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+# Prometheus text format: counters, per-stage latency histograms, errors by class, tokens
+class MetricsView(View):
+    def get(self, request):
+        return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class StatsView(APIView):
+    def get(self, request):
+        return Response({
+            'prefetch': prefetch_stats(),
+            'assets': assets.stats(),
+            'scene_match': assets.scene_match_stats(),
+            'images': imaging.stats(),
+            'structured_output': structured_output_stats(),
+            'prompt_tokens': token_report(),
+            'stages': metrics.stage_report(),
+            'warm_pool': warm_pool.stats(),
+            'singleflight': singleflight.stats(),
+            'new_game': pipeline.stats(),
+            'game_state_cache': state_cache.stats(),
+            'image_jobs': {
+                'workers': settings.IMAGE_JOB_WORKERS,
+                'pending': ImageJob.objects.filter(status=ImageJob.STATUS_PENDING).count(),
+                'running': ImageJob.objects.filter(status=ImageJob.STATUS_RUNNING).count(),
+                'resumed': metrics.get('image_jobs_resumed'),
+                'event_streams_rejected': metrics.get('image_job_streams_rejected'),
+            },
+            'counters': metrics.snapshot(),
+        })
@@ -0,0 +1,88 @@
+# game/warm_pool.py
+# Pool of ready-to-claim outline + level 1 pairs so new games skip both GPT calls.
+# Each entry is generated independently and handed to exactly one game.
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from . import metrics
+from .models import WarmStart
+from .utils import generate_story_outline, generate_level_content
+
+logger = logging.getLogger(__name__)
+
+_refill_lock = threading.Lock()
+_refill_thread = None
+
+def size():
+    return WarmStart.objects.count()
+
+# Atomically take the oldest entry; returns (outline, level_content) or None if the pool is empty
+def claim():
+    for _ in range(5):
+        entry = WarmStart.objects.order_by('created_at').first()
+        if entry is None:
+            break
+        # Whoever deletes the row owns it; concurrent claimers retry with the next entry
+        deleted, _ = WarmStart.objects.filter(pk=entry.pk).delete()
+        if deleted:
+            metrics.incr('warm_pool_hits')
+            check_low_water(refill_allowed=True)
+            return entry.outline, entry.level_content
+    metrics.incr('warm_pool_misses')
+    # A miss only alerts: refilling here would spend GPT calls on every cold new game
+    check_low_water()
+    return None
+
+def check_low_water(refill_allowed=False):
+    remaining = size()
+    if remaining < settings.WARM_POOL_LOW_WATER:
+        metrics.incr('warm_pool_low_water')
+        logger.warning("Warm pool low: %d of %d entries left", remaining, settings.WARM_POOL_SIZE)
+    if refill_allowed and settings.WARM_POOL_AUTO_REFILL and remaining < settings.WARM_POOL_SIZE:
+        schedule_refill()
+    return remaining
+
+# Generate entries until the pool holds `target` (default WARM_POOL_SIZE); returns how many were added
+def refill(target=None):
+    target = settings.WARM_POOL_SIZE if target is None else target
+    added = 0
+    while size() < target:
+        try:
+            outline = generate_story_outline()
+            level_content = generate_level_content(outline, [], 1)
+        except Exception:
+            logger.exception("Warm pool refill failed")
+            metrics.incr('warm_pool_refill_failed')
+            break
+        WarmStart.objects.create(outline=outline, level_content=level_content)
+        added += 1
+    return added
+
+def _refill_worker():
+    global _refill_thread
+    try:
+        refill()
+    finally:
+        close_old_connections()
+        with _refill_lock:
+            _refill_thread = None
+
+# Top the pool up in a background thread; at most one refiller runs per process
+def schedule_refill():
+    global _refill_thread
+    with _refill_lock:
+        if _refill_thread is not None:
+            return
+        _refill_thread = threading.Thread(target=_refill_worker, name='warm-pool-refill', daemon=True)
+        _refill_thread.start()
+
+def stats():
+    return {
+        'size': size(),
+        'target': settings.WARM_POOL_SIZE,
+        'low_water': settings.WARM_POOL_LOW_WATER,
+        'hits': metrics.get('warm_pool_hits'),
+        'misses': metrics.get('warm_pool_misses'),
+        'low_water_alerts': metrics.get('warm_pool_low_water'),
+    }
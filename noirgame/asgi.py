@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
+
+The async API under /api/async/ only pays off when served from here, e.g.
+    uvicorn noirgame.asgi:application --workers 2
 """
 
 import os
@@ -14,3 +17,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noirgame.settings')
 
 application = get_asgi_application()
+
+# Image jobs a previous server process left unfinished are re-queued here, in serving
+# processes only (not in every management command), see game/jobs.py
+from django.conf import settings
+
+if settings.IMAGE_JOB_RESUME_ON_STARTUP:
+    from game.jobs import schedule_resume
+    schedule_resume()
@@ -47,12 +47,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'game.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'game.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'noirgame.urls'
@@ -83,9 +85,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Background workers (prefetch, image jobs) write concurrently with requests;
+            # take the write lock up front so transactions wait instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Tests exercise those workers too; the in-memory test database fails their writes
+        # with "database table is locked", an on-disk one lets them wait like in production
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Cache backend for hot game state (game/state_cache.py). Local memory is per process and
+# only suits a single worker (development). Running several workers requires a shared cache
+# (Redis, Memcached) in CACHE_BACKEND/CACHE_LOCATION, or workers serve stale levels;
+# `manage.py check --deploy` warns about it.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'noirgame'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000'))},
+    }
+}
+GAME_STATE_CACHE_ALIAS = 'default'
+GAME_STATE_CACHE_TIMEOUT = int(os.getenv('GAME_STATE_CACHE_TIMEOUT', '1800'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -126,21 +151,156 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Optional OpenAI-compatible endpoint (proxy, gateway, `manage.py openai_stub`)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
 if not OPENAI_API_KEY:
-    raise Exception("OPENAI_API_KEY not found in environment variables")
+    if not OPENAI_BASE_URL:
+        raise Exception("OPENAI_API_KEY not found in environment variables")
+    # Stand-in servers do not check the key
+    OPENAI_API_KEY = 'stub'
+# Structured output for outlines/levels/image prompts: 'json_schema', 'json_object' or 'off'.
+# Falls back to free-form output automatically if the model rejects response_format.
+OPENAI_STRUCTURED_OUTPUT = os.getenv('OPENAI_STRUCTURED_OUTPUT', 'json_schema')
+# Prompt compaction (game/story.py): levels kept in full in the story digest sent to the model;
+# older levels are reduced to a one-line outcome
+STORY_DIGEST_RECENT_LEVELS = int(os.getenv('STORY_DIGEST_RECENT_LEVELS', '3'))
+
+# Upstream client behaviour (game/clients.py)
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '90'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+# Exponential backoff: base * 2**attempt (jittered), capped; Retry-After wins when present
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', '1.0'))
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', '30'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
 
 # REST Framework settings (if any customizations needed)
+# MessagePack (application/msgpack, game/renderers.py) is offered next to JSON
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'game.renderers.MessagePackRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
+        'game.renderers.MessagePackParser',
     ],
 }
 
+# Response compression (game.middleware.CompressionMiddleware): brotli at this quality when the
+# client accepts it, gzip otherwise
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+
+
+# Speculative generation of the next level while the current one is played, keyed by the
+# ending the player is likely to reach. Costs one extra level generation (a GPT-4 call) per
+# level and branch, wasted whenever the player reaches a different ending.
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Number of distinct endings generated ahead per level
+PREFETCH_MAX_BRANCHES = int(os.getenv('PREFETCH_MAX_BRANCHES', '1'))
+PREFETCH_MAX_WORKERS = int(os.getenv('PREFETCH_MAX_WORKERS', '2'))
+# Seconds a transition waits on a prefetch that is already running before generating inline
+PREFETCH_CLAIM_TIMEOUT = float(os.getenv('PREFETCH_CLAIM_TIMEOUT', '20'))
+
+# Single-flight generation (game/singleflight.py): how long a worker's lock on an asset key
+# stays valid if it dies mid-generation (a live worker renews it every third of that), and
+# how often waiting workers check it
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv('SINGLEFLIGHT_LOCK_TTL', '300'))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('SINGLEFLIGHT_POLL_INTERVAL', '0.25'))
+
+# Headlines generated alongside the next level by /api/level_transition/
+TRANSITION_HEADLINE_WORKERS = int(os.getenv('TRANSITION_HEADLINE_WORKERS', '4'))
+
+
+# Upper bound on concurrent OpenAI requests per process for the async API
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '32'))
+
+
+# Disk budget for the shared generated-asset store (static/images); LRU eviction beyond it
+ASSET_STORE_MAX_BYTES = int(os.getenv('ASSET_STORE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Minimum TF-IDF cosine similarity for reusing the background of a near-identical scene
+# (raise towards 1.0 for stricter matches; above 1.0 disables matching)
+SCENE_MATCH_THRESHOLD = float(os.getenv('SCENE_MATCH_THRESHOLD', '0.45'))
+# Seconds between checks for backgrounds other processes added to their similarity index
+SCENE_INDEX_REFRESH_SECONDS = float(os.getenv('SCENE_INDEX_REFRESH_SECONDS', '30'))
+
+# Generate missing default images (game/default_assets.py) in a background thread at startup.
+# Off by default: `manage.py bootstrap_assets` does it explicitly, and a missing default is
+# generated in the background the first time it is needed anyway.
+ASSET_BOOTSTRAP_ON_STARTUP = os.getenv('ASSET_BOOTSTRAP_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes')
+
+# Image post-processing (game/imaging.py): indexed palette size, Floyd-Steinberg dithering,
+# extra widths written per kind (the primary 800x600 / 32x32 PNG is always written) and WebP copies
+IMAGE_PALETTE_COLORS = int(os.getenv('IMAGE_PALETTE_COLORS', '8'))
+IMAGE_DITHER = os.getenv('IMAGE_DITHER', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_WEBP_VARIANTS = os.getenv('IMAGE_WEBP_VARIANTS', 'true').lower() in ('1', 'true', 'yes')
+BACKGROUND_VARIANT_WIDTHS = [int(w) for w in os.getenv('BACKGROUND_VARIANT_WIDTHS', '400,200').split(',') if w.strip()]
+SPRITE_VARIANT_WIDTHS = [int(w) for w in os.getenv('SPRITE_VARIANT_WIDTHS', '64').split(',') if w.strip()]
+
+# Procedural local backgrounds (game/compositor.py) shown until the generated image is ready
+LOCAL_BACKGROUNDS_ENABLED = os.getenv('LOCAL_BACKGROUNDS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Rendered scenes kept on disk; the oldest are removed beyond this
+LOCAL_BACKGROUNDS_MAX_FILES = int(os.getenv('LOCAL_BACKGROUNDS_MAX_FILES', '500'))
+
+# Character sprite atlas built for every new game (game/sprites.py); 0 characters disables it
+SPRITE_ATLAS_MAX_CHARACTERS = int(os.getenv('SPRITE_ATLAS_MAX_CHARACTERS', '16'))
+# Concurrent sprite generations inside one atlas build
+SPRITE_ATLAS_WORKERS = int(os.getenv('SPRITE_ATLAS_WORKERS', '4'))
+
+# Background image generation jobs (game/jobs.py)
+IMAGE_JOB_WORKERS = int(os.getenv('IMAGE_JOB_WORKERS', '4'))
+# Running jobs not updated for this long are assumed orphaned and re-queued on startup
+IMAGE_JOB_STALE_SECONDS = int(os.getenv('IMAGE_JOB_STALE_SECONDS', '600'))
+# Re-queue jobs left pending by a previous process when the WSGI/ASGI application loads;
+# without it, run `manage.py resume_image_jobs` after a restart
+IMAGE_JOB_RESUME_ON_STARTUP = os.getenv('IMAGE_JOB_RESUME_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+# Backgrounds queued per level as soon as it is stored (0 disables pre-generation);
+# they run on the IMAGE_JOB_WORKERS pool
+LEVEL_PREGEN_MAX_IMAGES = int(os.getenv('LEVEL_PREGEN_MAX_IMAGES', '8'))
+# Maximum lifetime of a /api/jobs/<id>/events/ stream
+IMAGE_JOB_EVENT_TIMEOUT = int(os.getenv('IMAGE_JOB_EVENT_TIMEOUT', '120'))
+# Streams open at once per process (each holds a worker thread), and the longest gap between
+# status checks of a job run by another process
+IMAGE_JOB_EVENT_MAX_STREAMS = int(os.getenv('IMAGE_JOB_EVENT_MAX_STREAMS', '16'))
+IMAGE_JOB_EVENT_MAX_INTERVAL = float(os.getenv('IMAGE_JOB_EVENT_MAX_INTERVAL', '4'))
+# Longest /api/new_game/ waits for the start scene's background and for the sprite atlas.
+# It only waits for a job expected to finish within that (from the average job time so far);
+# otherwise it answers with placeholders right away (game/pipeline.py)
+NEW_GAME_BACKGROUND_DEADLINE = float(os.getenv('NEW_GAME_BACKGROUND_DEADLINE', '1.5'))
+NEW_GAME_SPRITES_DEADLINE = float(os.getenv('NEW_GAME_SPRITES_DEADLINE', '1.5'))
+
+# Warm pool of pre-generated outline + level 1 pairs for instant new games (game/warm_pool.py).
+# Refill with `manage.py refill_warm_pool`; with WARM_POOL_AUTO_REFILL each successful claim
+# also tops the pool up in the background (off by default: every entry costs two GPT calls).
+WARM_POOL_SIZE = int(os.getenv('WARM_POOL_SIZE', '3'))
+WARM_POOL_LOW_WATER = int(os.getenv('WARM_POOL_LOW_WATER', '1'))
+WARM_POOL_AUTO_REFILL = os.getenv('WARM_POOL_AUTO_REFILL', 'false').lower() in ('1', 'true', 'yes')
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Structured request logs (game/middleware.py) and warnings from the game app go to stderr;
+# REQUEST_LOG_LEVEL=WARNING silences the per-request lines
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'game': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'game.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
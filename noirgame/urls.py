@@ -17,10 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
+from game.views import AssetFileView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Async endpoints; serve through noirgame/asgi.py (e.g. `uvicorn noirgame.asgi:application`)
+    path('api/async/', include('game.async_urls')),
     path('api/', include('game.urls')),
+    # Generated art under content-hash URLs, cacheable forever by browsers and CDNs
+    path('assets/<str:content_hash>/<str:image_name>', AssetFileView.as_view(), name='asset_file'),
     # Serve the frontend
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
 ]
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noirgame.settings')
 
 application = get_wsgi_application()
+
+# Image jobs a previous server process left unfinished are re-queued here, in serving
+# processes only (not in every management command), see game/jobs.py
+from django.conf import settings
+
+if settings.IMAGE_JOB_RESUME_ON_STARTUP:
+    from game.jobs import schedule_resume
+    schedule_resume()
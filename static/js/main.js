@@ -26,38 +26,64 @@ window.addEventListener('load', () => {
     }
 
     function create() {
-        fetch('/api/new_game/', {
+        fetch('/api/new_game/?level_format=interned', {
             method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify({})
         })
         .then(res => res.json())
         .then(data => {
             gameId = data.game_id;
-            dialogueData = data.level;
+            dialogueData = expandLevel(data.level);
+            dialogueData.graph = data.graph;
             levelSummary = data.level_summary || '';
             currentNodeId = dialogueData.start_node;
             choicePath = [];
             awaitingNext = false;
-            loadAndDisplayBackground(this, dialogueData, currentNodeId, levelSummary);
+            if (data.sprite_atlas) loadSpriteAtlas(this, data.sprite_atlas);
+            // new_game already resolved (or queued) the start scene; no second round trip
+            loadAndDisplayBackground(this, dialogueData, currentNodeId, levelSummary, data.start_background);
         });
     }
 
     function update() {}
 
-    function loadAndDisplayBackground(scene, level, nodeId, lvlSummary) {
-        const node = level.dialogue_nodes.find(n => n.id === nodeId);
+    // Levels sent with level_format=interned list speakers and scenes once; nodes hold indexes
+    function expandLevel(level) {
+        if (!level || level.format !== 'interned') return level;
+        const {speakers, scenes, format, ...rest} = level;
+        rest.dialogue_nodes = level.dialogue_nodes.map(n => Object.assign({}, n, {
+            speaker: n.speaker === null ? null : speakers[n.speaker],
+            scene_description: n.scene_description === null ? null : scenes[n.scene_description]
+        }));
+        return rest;
+    }
+
+    // O(1) through the level's compiled graph; a linear scan while the level is still streaming
+    function findNode(level, nodeId) {
+        const i = level.graph ? level.graph.index[nodeId] : undefined;
+        return i !== undefined ? level.dialogue_nodes[i] : level.dialogue_nodes.find(n => n.id === nodeId);
+    }
+
+    function loadAndDisplayBackground(scene, level, nodeId, lvlSummary, known) {
+        const node = findNode(level, nodeId);
         const defaultKey = level.level_number === 2 ? 'default_newsroom' : 'default_detective_office';
         if (backgroundImage) backgroundImage.destroy();
         backgroundImage = scene.add.image(400,300,defaultKey).setDisplaySize(800,600);
         if(node && node.scene_description) {
-            fetch('/api/generate_background/', {
+            const request = known ? Promise.resolve(known) : fetch('/api/generate_background/', {
                 method:'POST', headers:{'Content-Type':'application/json'},
-                body: JSON.stringify({ game_id: gameId, level_number: level.level_number, level_summary: lvlSummary, scene_description: node.scene_description })
-            })
-            .then(res => res.json())
-            .then(resdata => {
-                if (resdata && resdata.url) {
+                body: JSON.stringify({ game_id: gameId, level_number: level.level_number, level_summary: lvlSummary, node_id: nodeId, scene_description: node.scene_description })
+            }).then(res => res.json());
+            request.then(resdata => {
+                if (resdata && resdata.job_id) {
+                    // Image is generated in the background; show the placeholder now, swap when ready
+                    if (resdata.url) swapBackground(scene, resdata);
+                    displayNode(scene, nodeId);
+                    pollImageJob(resdata.job_id, result => {
+                        if (currentNodeId === nodeId && dialogueData === level) swapBackground(scene, result);
+                    });
+                } else if (resdata && resdata.url) {
                     const bgKey = `bg_${resdata.image_name}`;
-                    scene.load.image(bgKey, resdata.url);
+                    scene.load.image(bgKey, variantUrl(resdata, 800));
                     scene.load.once('complete', () => {
                         if(backgroundImage) backgroundImage.destroy();
                         backgroundImage = scene.add.image(400,300,bgKey).setDisplaySize(800,600);
@@ -70,16 +96,57 @@ window.addEventListener('load', () => {
         } else { displayNode(scene, nodeId); }
     }
 
+    const supportsWebp = document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp');
+
+    // Smallest rendition at least `width` px wide (WebP when the browser can decode it)
+    function variantUrl(payload, width) {
+        const fits = (payload.variants || [])
+            .filter(v => v.width >= width && (v.format !== 'webp' || supportsWebp))
+            .sort((a, b) => a.bytes - b.bytes);
+        return fits.length ? fits[0].url : payload.url;
+    }
+
+    function pollImageJob(jobId, onDone) {
+        fetch(`/api/jobs/${jobId}/`).then(res => res.json()).then(job => {
+            if (job.status === 'done' && job.result) onDone(job.result);
+            else if (job.status === 'pending' || job.status === 'running') setTimeout(() => pollImageJob(jobId, onDone), 1500);
+        }).catch(() => {});
+    }
+
+    // All key characters in one sheet; built in the background on a cold start
+    let spriteFrames = {};
+    function loadSpriteAtlas(scene, atlas) {
+        if (atlas.job_id) { pollImageJob(atlas.job_id, result => loadSpriteAtlas(scene, result)); return; }
+        if (!atlas.url || !atlas.manifest) return;
+        scene.load.atlas('characters', atlas.url, atlas.manifest);
+        scene.load.once('complete', () => { spriteFrames = atlas.manifest.characters || {}; });
+        scene.load.start();
+    }
+
+    function swapBackground(scene, result) {
+        const bgKey = `bg_${result.image_name}`;
+        const show = () => {
+            if (backgroundImage) backgroundImage.destroy();
+            backgroundImage = scene.add.image(400,300,bgKey).setDisplaySize(800,600).setDepth(-1);
+        };
+        if (scene.textures.exists(bgKey)) { show(); return; }
+        scene.load.image(bgKey, variantUrl(result, 800));
+        scene.load.once('complete', show);
+        scene.load.start();
+    }
+
     function displayNode(scene, nodeId) {
-        ['title','body','choices','choiceIndicator','bgGraphics'].forEach(key => {
+        ['title','body','choices','choiceIndicator','bgGraphics','portrait'].forEach(key => {
             if (texts[key]) {
                 if (Array.isArray(texts[key])) texts[key].forEach(t=>t.destroy());
                 else texts[key].destroy();
             }
         });
-        const node = dialogueData.dialogue_nodes.find(n=>n.id===nodeId);
+        const node = findNode(dialogueData, nodeId);
         const graphics = scene.add.graphics(); graphics.fillStyle(0x000000,0.8); graphics.fillRect(50,360,700,230); texts.bgGraphics=graphics;
         texts.title = scene.add.text(60,370,`${node.speaker}:`,{font:'14px Courier',fill:'#fff'});
+        const frame = spriteFrames[node.speaker];
+        if (frame && scene.textures.exists('characters')) texts.portrait = scene.add.image(720,320,'characters',frame).setScale(2);
         texts.body = scene.add.text(60,390,node.text,{font:'14px Courier',fill:'#fff',wordWrap:{width:680}});
         const choices = node.choices||[]; texts.choices=[]; let selected=0;
         if (choices.length===0) {
@@ -96,7 +163,7 @@ window.addEventListener('load', () => {
                 choicePath.push({node_id:node.id,choice_text:choices[selected].text});
                 scene.input.keyboard.removeListener('keydown',onKeyDown);
                 currentNodeId=choices[selected].next_id;
-                loadAndDisplayBackground(scene,dialogueData,currentNodeId,levelSummary);
+                whenNodeAvailable(currentNodeId,()=>loadAndDisplayBackground(scene,dialogueData,currentNodeId,levelSummary));
             }
         };
         scene.input.keyboard.on('keydown',onKeyDown);
@@ -104,21 +171,60 @@ window.addEventListener('load', () => {
 
     function onLevelComplete(scene) {
         if(awaitingNext) return; awaitingNext=true;
-        if (choicePath.length >= 10) proceedToNextLevel(scene);
-        else {
-            fetch('/api/headline/',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({game_id:gameId,choices_path:choicePath})})
-            .then(res=>res.json()).then(data=>{ if(data.headline) displayHeadline(scene,data.headline); })
-            .finally(()=>proceedToNextLevel(scene));
-        }
+        proceedToNextLevel(scene, choicePath.length < 10);
+    }
+
+    // One request per level change: the headline and the next level are generated together.
+    // The level streams over SSE and its first node is shown as soon as it is parsed; a headline
+    // that arrives first stays on screen for its full duration before the level replaces it.
+    function proceedToNextLevel(scene, withHeadline) {
+        const level={level_number:null,role:null,start_node:null,dialogue_nodes:[]};
+        // The level starts once its start node is in and the headline has been shown (or skipped)
+        let started=false, headlineUntil=0, headlineDone=!withHeadline;
+        const maybeStart=()=>{
+            if(started||!headlineDone||level.start_node===null||!level.dialogue_nodes.some(n=>n.id===level.start_node)) return;
+            started=true; dialogueData=level; currentNodeId=level.start_node; choicePath=[];
+            setTimeout(()=>{clearScene(scene); loadAndDisplayBackground(scene,dialogueData,currentNodeId,levelSummary);},Math.max(500,headlineUntil-Date.now()));
+        };
+        fetch('/api/level_transition/',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({game_id:gameId,choices_path:choicePath,headline:withHeadline})})
+        .then(res=>{
+            if(!(res.headers.get('Content-Type')||'').startsWith('text/event-stream')) return res.json().then(data=>{ if(data.headline) displayHeadline(scene,data.headline); });
+            return readEventStream(res,(event,data)=>{
+                if(event==='headline'){ headlineDone=true; if(data.headline){ displayHeadline(scene,data.headline); headlineUntil=Date.now()+2500; } }
+                if(event==='meta'){ level.level_number=data.level_number; level.role=data.role; levelSummary=data.level_summary||''; }
+                else if(event==='start_node'){ level.start_node=data; }
+                else if(event==='node'){ level.dialogue_nodes.push(data); }
+                else if(event==='level'){ Object.assign(level,data.level); level.graph=data.graph; levelSummary=data.level_summary||levelSummary; }
+                maybeStart(); flushNodeWaiters();
+            }).then(()=>{ headlineDone=true; maybeStart(); });
+        });
+    }
+
+    // Calls cb once nodeId exists in the (possibly still streaming) level
+    let nodeWaiters=[];
+    function whenNodeAvailable(nodeId,cb){
+        if(findNode(dialogueData,nodeId)) cb(); else nodeWaiters.push({nodeId,cb});
+    }
+    function flushNodeWaiters(){
+        const ready=nodeWaiters.filter(w=>dialogueData&&findNode(dialogueData,w.nodeId));
+        nodeWaiters=nodeWaiters.filter(w=>!ready.includes(w)); ready.forEach(w=>w.cb());
     }
 
-    function proceedToNextLevel(scene) {
-        fetch('/api/next_level/',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({game_id:gameId,choices_path:choicePath})})
-        .then(res=>res.json()).then(data=>{
-            if(data.level){ dialogueData=data.level; levelSummary=data.level_summary||''; currentNodeId=dialogueData.start_node; choicePath=[];
-                setTimeout(()=>{clearScene(scene); loadAndDisplayBackground(scene,dialogueData,currentNodeId,levelSummary);},500);
+    function readEventStream(res,onEvent){
+        const reader=res.body.getReader(); const decoder=new TextDecoder(); let buf='';
+        const pump=()=>reader.read().then(({done,value})=>{
+            if(done) return;
+            buf+=decoder.decode(value,{stream:true});
+            let idx;
+            while((idx=buf.indexOf('\n\n'))!==-1){
+                const raw=buf.slice(0,idx); buf=buf.slice(idx+2);
+                let event='message', data='';
+                raw.split('\n').forEach(line=>{ if(line.startsWith('event: ')) event=line.slice(7); else if(line.startsWith('data: ')) data+=line.slice(6); });
+                if(data) onEvent(event,JSON.parse(data));
             }
+            return pump();
         });
+        return pump();
     }
 
     function displayHeadline(scene,text){ if(headlineTextObj) headlineTextObj.destroy(); const g=scene.add.graphics(); g.fillStyle(0x000000,0.7); g.fillRect(100,200,600,100);